@@ -5,14 +5,197 @@ ThinkFlow - 统一入口点
 """
 
 import argparse
+import asyncio
+import json
 import sys
 import os
+from contextlib import nullcontext
 
 # 添加src目录到Python路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from src.tot import run_tot, run_tot_orchestrator
-from src.agent import run_multi_modal_agent, run_planner_agent
+from src.observability import close_events, configure_events, enable_tracing, export_chrome_trace, log
+from src.tot import (
+    run_tot,
+    arun_tot,
+    run_tot_orchestrator,
+    arun_tot_orchestrator,
+    get_speculation_stats,
+    eval_memo,
+    get_eval_memo_stats
+)
+from src.agent import run_multi_modal_agent, arun_multi_modal_agent, run_planner_agent, arun_planner_agent
+from src.llm import (
+    get_call_metrics,
+    get_route_stats,
+    get_scheduler_stats,
+    get_coalescing_stats,
+    get_hedge_stats,
+    get_structured_stats,
+    hedger,
+    get_cassette_stats,
+    use_cassette
+)
+from src.batch import load_jobs, run_batch
+
+
+def print_stream_event(event: dict):
+    """
+    --stream 模式下的事件回调：token 直接写到终端，节点事件打印一行摘要。
+    """
+    if event["type"] == "token":
+        sys.stdout.write(event["text"])
+        sys.stdout.flush()
+    elif event["type"] == "node":
+        print(f"\n>>> [流式] 节点完成: {event['node']}")
+
+
+def print_call_metrics():
+    """
+    打印每次LLM调用的首token时间 (TTFT) 与总耗时。
+    """
+    metrics = get_call_metrics()
+    if not metrics:
+        return
+    print("\n" + "="*60)
+    print("LLM调用耗时 (TTFT / 总耗时)")
+    for m in metrics:
+        ttft = f"{m['ttft']:.2f}s" if m["ttft"] is not None else "-"
+        print(f"  {m['label']:<16} {m['model']:<48} TTFT: {ttft:>7}  总耗时: {m['total_time']:.2f}s")
+
+
+def print_route_stats():
+    """
+    打印每条模型路由 (角色 -> 模型) 的调用次数、平均延迟与估算成本。
+    """
+    stats = get_route_stats()
+    if not stats:
+        return
+    print("\n" + "="*60)
+    print("模型路由统计")
+    for r in stats:
+        print(f"  {r['role']:<16} {r['model']:<48} 调用: {r['calls']:>3}  "
+              f"平均延迟: {r['avg_latency']:.2f}s  成本: ${r['cost']:.4f}")
+
+    s = get_scheduler_stats()
+    print("限流调度统计")
+    print(f"  请求: {s['calls']}  被限流(429): {s['throttled']}  重试: {s['retries']}  失败: {s['failures']}")
+    print(f"  排队等待: 合计 {s['queue_wait_total']:.2f}s  最长 {s['queue_wait_max']:.2f}s")
+
+    print("请求合并统计")
+    for name, c in get_coalescing_stats().items():
+        print(f"  {name:<8} 实际调用: {c['leaders']}  合并节省: {c['saved']}")
+
+    o = get_structured_stats()
+    print("结构化输出统计")
+    print(f"  解析: {o['calls']}  直接通过: {o['clean']}  本地修复: {o['repaired']} ({o['repair_rate']:.0%})  "
+          f"重新请求: {o['rerequested']} ({o['rerequest_rate']:.0%})  失败: {o['failed']}")
+
+    h = get_hedge_stats()
+    if h["enabled"]:
+        print("请求对冲统计")
+        print(f"  符合条件: {h['calls']}  对冲: {h['hedged']} ({h['hedge_rate']:.0%})  对冲获胜: {h['hedge_wins']}  "
+              f"超出预算: {h['budget_denied']}  估算对冲成本: ${h['hedge_cost']:.4f}")
+        if h["p99"] is not None:
+            print(f"  p50: {h['p50']:.2f}s  p99: {h['p99']:.2f}s  "
+                  f"单请求p99: {h['p99_without_hedging']:.2f}s  p99改善(下界): {h['p99_improvement']:.2f}s")
+
+    m = get_eval_memo_stats()
+    if m["enabled"]:
+        print("评估备忘录统计")
+        print(f"  查询: {m['lookups']}  完全命中: {m['exact_hits']}  近似命中: {m['near_hits']}  "
+              f"命中率: {m['hit_rate']:.0%}  新增: {m['stored']}  清理过期: {m['expired']}")
+
+    sp = get_speculation_stats()
+    if sp["launched"]:
+        print("推测生成统计")
+        print(f"  发起: {sp['launched']}  采用: {sp['committed']}  丢弃: {sp['discarded']}")
+
+
+def run_entry(use_async: bool, sync_fn, async_fn, *args, **kwargs):
+    """
+    --async 时在事件循环中运行 async 入口，否则直接调用同步入口。
+    """
+    if use_async:
+        return asyncio.run(async_fn(*args, **kwargs))
+    return sync_fn(*args, **kwargs)
+
+
+def cassette_scope(args):
+    """
+    --record / --replay 时返回对应的 cassette 上下文，否则返回空上下文。
+    """
+    if args.record:
+        return use_cassette(args.record, mode="record", meta={"mode": args.mode, "argv": sys.argv[1:]})
+    if args.replay:
+        return use_cassette(args.replay, mode="replay", latency_scale=args.replay_speed)
+    return nullcontext()
+
+
+def print_cassette_stats():
+    """
+    打印录制/回放统计。
+    """
+    c = get_cassette_stats()
+    if c is None:
+        return
+    print("\n" + "="*60)
+    if c["mode"] == "record":
+        print(f"已录制 {c['recorded']} 次交互 -> {c['path']}")
+    else:
+        print(f"回放: {c['path']}  命中: {c['replayed']}  未命中: {c['misses']}  "
+              f"未使用: {c['unused']}  模拟等待: {c['replay_wait']:.2f}s")
+
+
+def print_batch_summary(summary: dict):
+    """
+    打印批量运行的汇总：成功/失败数、吞吐、合并后的路由与调度统计、共享嵌入进程统计。
+    """
+    results = summary["results"]
+    failed = [r for r in results if r["error"]]
+    print("\n" + "="*60)
+    print(f"批量运行完成: {len(results)} 个任务  失败: {len(failed)}  总耗时: {summary['wall_time']:.1f}s  "
+          f"吞吐: {len(results) / summary['wall_time'] * 60 if summary['wall_time'] else 0:.1f} 个/分钟")
+    for r in failed:
+        print(f"  #{r['index']} ({r['mode']}) {r['error']}")
+
+    stats = summary["stats"]
+    if stats["routes"]:
+        print("模型路由统计 (所有进程)")
+        for r in stats["routes"]:
+            print(f"  {r['role']:<16} {r['model']:<48} 调用: {r['calls']:>3}  "
+                  f"平均延迟: {r['avg_latency']:.2f}s  成本: ${r['cost']:.4f}")
+    s = stats["scheduler"]
+    if s:
+        print("限流调度统计 (所有进程)")
+        print(f"  请求: {s['calls']}  被限流(429): {s['throttled']}  重试: {s['retries']}  失败: {s['failures']}")
+        print(f"  排队等待: 合计 {s['queue_wait_total']:.2f}s  最长 {s['queue_wait_max']:.2f}s")
+    o = stats["structured"]
+    if o.get("calls"):
+        print("结构化输出统计 (所有进程)")
+        print(f"  解析: {o['calls']}  本地修复: {o['repaired']} ({o['repair_rate']:.0%})  "
+              f"重新请求: {o['rerequested']} ({o['rerequest_rate']:.0%})  失败: {o['failed']}")
+
+    m = stats["eval_memo"]
+    if m:
+        print("评估备忘录统计 (所有进程)")
+        print(f"  查询: {m['lookups']}  完全命中: {m['exact_hits']}  近似命中: {m['near_hits']}  "
+              f"命中率: {m['hit_rate']:.0%}  新增: {m['stored']}")
+
+    e = summary["embedding"]
+    if e:
+        print("共享嵌入进程统计")
+        print(f"  请求: {e['requests']}  文本: {e['texts']}  批次: {e['batches']}  "
+              f"平均批大小: {e['avg_batch']:.1f}  计算耗时: {e['compute_time']:.2f}s")
+
+
+def write_batch_results(path: str, summary: dict):
+    """
+    把每个任务的结果按输入顺序写入 JSONL。
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        for r in summary["results"]:
+            f.write(json.dumps(r, ensure_ascii=False, default=str) + "\n")
 
 
 def main():
@@ -32,19 +215,71 @@ def main():
   
   # 规划Agent
   python main.py planner --problem "为期3天，从加州奥克兰出发，规划一次预算友好的东京之旅。"
+  
+  # 快速打分 (评估只输出分数，理由只为最终选中的思想获取)
+  python main.py tot --problem "..." --fast-scoring
+  
+  # 录制一次真实运行，之后离线回放 (--replay-speed 0 为零延迟，只测框架自身开销)
+  python main.py --record run.cassette.json tot --problem "..."
+  python main.py --replay run.cassette.json --replay-speed 0 --trace tot --problem "..."
+  
+  # 请求对冲：慢于近期p90的评估/规划请求会再发一份，先返回的获胜
+  python main.py --hedge --stats tot --problem "..."
+  
+  # 多进程批量运行 (jobs.jsonl 每行一个任务，如 {"mode": "tot", "problem": "..."}；.txt 每行一个问题)
+  python main.py --stats batch --input jobs.jsonl --processes 4 --output results.jsonl
+  
+  # 评估备忘录：跨运行复用相同或近似思想的历史分数 (评估提示词或模型变化时自动失效)
+  python main.py --eval-memo --stats tot --problem "..."
+  
+  # 使用 async 入口运行 (可用于任意模式)
+  python main.py --async tot --problem "..."
+  
+  # 流式输出 (可用于任意模式)
+  python main.py --stream tot --problem "..."
+  
+  # 分层延迟追踪 (导出 Chrome Trace)
+  python main.py --trace trace.json planner --problem "..."
+  
+  # 批量/服务场景：关闭终端日志，只把紧凑事件写入 JSONL
+  python main.py --quiet --events run.jsonl tot --problem "..."
         """
     )
     
+    parser.add_argument('--stream', action='store_true', help='流式输出token与节点事件，并统计首token时间')
+    parser.add_argument('--trace', type=str, nargs='?', const='thinkflow_trace.json', default=None,
+                        metavar='PATH', help='记录分层延迟追踪并导出为 Chrome Trace JSON (默认: thinkflow_trace.json)')
+    parser.add_argument('--quiet', action='store_true', help='安静模式：不输出逐步日志与事件摘要')
+    parser.add_argument('--events', type=str, default=None, metavar='PATH',
+                        help='把紧凑的运行事件 (新思想、分数、决策、步骤切换) 追加写入 JSONL 文件')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='使用 async 入口 (AsyncOpenAI + LangGraph astream) 运行')
+    parser.add_argument('--hedge', action='store_true',
+                        help='对慢请求发出对冲请求 (按模型近期延迟分位数触发，受对冲预算限制)')
+    parser.add_argument('--eval-memo', type=str, nargs='?', const='', default=None, metavar='PATH',
+                        help='跨运行复用历史评估分数 (相同或近似的问题与思想)，PATH 为 sqlite 文件 (默认: eval_memo.sqlite3)')
+    parser.add_argument('--stats', action='store_true', help='运行结束后打印模型路由、限流调度、请求合并与结构化输出统计')
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument('--record', type=str, default=None, metavar='PATH',
+                                help='把本次运行的LLM请求/响应、搜索与知识库结果及原始耗时录制到 cassette 文件')
+    cassette_group.add_argument('--replay', type=str, default=None, metavar='PATH',
+                                help='离线回放 cassette 文件，不访问网络')
+    parser.add_argument('--replay-speed', type=float, default=1.0, metavar='SCALE',
+                        help='回放延迟倍数：1 = 录制时的速度，0 = 零延迟 (默认: 1)')
+    
     subparsers = parser.add_subparsers(dest='mode', help='运行模式')
     
     # Tree of Thought (LangGraph)
     tot_parser = subparsers.add_parser('tot', help='运行Tree of Thought (LangGraph版本)')
     tot_parser.add_argument('--problem', type=str, required=True, help='要解决的问题')
+    tot_parser.add_argument('--speculative', action='store_true', help='评估期间在后台推测生成下一轮思想')
+    tot_parser.add_argument('--fast-scoring', action='store_true', help='评估只输出分数 (可用logprobs求期望分数)，理由按需获取')
     
     # Tree of Thought (Orchestrator)
     tot_orch_parser = subparsers.add_parser('tot-orchestrator', help='运行Tree of Thought (协调器版本)')
     tot_orch_parser.add_argument('--problem', type=str, required=True, help='要解决的问题')
     tot_orch_parser.add_argument('--k', type=int, default=6, help='生成的思想数量 (默认: 6)')
+    tot_orch_parser.add_argument('--fast-scoring', action='store_true', help='评估只输出分数 (可用logprobs求期望分数)，理由按需获取')
     
     # Multi-Modal Agent
     mm_parser = subparsers.add_parser('multi-modal', help='运行多模态Agent')
@@ -55,45 +290,98 @@ def main():
     planner_parser = subparsers.add_parser('planner', help='运行规划Agent')
     planner_parser.add_argument('--problem', type=str, required=True, help='要规划的任务')
     
+    # 批量运行 (多进程)
+    batch_parser = subparsers.add_parser('batch', help='在进程池中批量运行任务 (共享嵌入进程，结果与统计集中汇总)')
+    batch_parser.add_argument('--input', type=str, required=True, metavar='PATH',
+                              help='任务文件：.jsonl 每行一个任务对象，其他文件每行一个问题')
+    batch_parser.add_argument('--engine', type=str, default='tot', choices=['tot', 'tot-orchestrator', 'planner'],
+                              help='任务未指定 mode 时使用的运行模式 (默认: tot)')
+    batch_parser.add_argument('--processes', type=int, default=None, help='工作进程数 (默认: CPU核数)')
+    batch_parser.add_argument('--output', type=str, default=None, metavar='PATH', help='把每个任务的结果写入 JSONL 文件')
+    batch_parser.add_argument('--no-embedding-worker', action='store_true',
+                              help='不启动共享嵌入进程，各工作进程自行加载嵌入模型')
+    batch_parser.add_argument('--fast-scoring', action='store_true', help='任务未指定时默认开启快速打分')
+    
     args = parser.parse_args()
     
     if not args.mode:
         parser.print_help()
         return
+    if args.mode == 'batch':
+        for flag, value in (('--stream', args.stream), ('--trace', args.trace), ('--events', args.events),
+                            ('--record', args.record), ('--replay', args.replay)):
+            if value:
+                parser.error(f"批量模式不支持 {flag} (每个工作进程都是独立的进程)")
+    
+    configure_events(quiet=args.quiet, jsonl_path=args.events)
     
-    print("="*60)
-    print("ThinkFlow - 基于思维树的多模态智能代理框架")
-    print("="*60)
-    print()
+    log("="*60)
+    log("ThinkFlow - 基于思维树的多模态智能代理框架")
+    log("="*60)
+    log()
+    
+    on_event = print_stream_event if args.stream else None
+    if args.trace:
+        enable_tracing()
+    if args.hedge:
+        hedger.enable()
+    if args.eval_memo is not None:
+        eval_memo.enable(path=args.eval_memo or None)
     
     try:
-        if args.mode == 'tot':
-            print(f"运行模式: Tree of Thought (LangGraph)")
-            print(f"问题: {args.problem}")
-            print()
-            run_tot(args.problem)
+        with cassette_scope(args):
+            if args.mode == 'tot':
+                log(f"运行模式: Tree of Thought (LangGraph)")
+                log(f"问题: {args.problem}")
+                log()
+                run_entry(args.use_async, run_tot, arun_tot, args.problem, on_event=on_event,
+                          speculative=args.speculative, fast_scoring=args.fast_scoring)
+            
+            elif args.mode == 'tot-orchestrator':
+                log(f"运行模式: Tree of Thought (协调器)")
+                log(f"问题: {args.problem}")
+                log(f"生成思想数量: {args.k}")
+                log()
+                run_entry(args.use_async, run_tot_orchestrator, arun_tot_orchestrator,
+                          args.problem, args.k, on_event=on_event, fast_scoring=args.fast_scoring)
             
-        elif args.mode == 'tot-orchestrator':
-            print(f"运行模式: Tree of Thought (协调器)")
-            print(f"问题: {args.problem}")
-            print(f"生成思想数量: {args.k}")
-            print()
-            run_tot_orchestrator(args.problem, args.k)
+            elif args.mode == 'multi-modal':
+                log(f"运行模式: 多模态Agent")
+                log(f"输入: {args.input}")
+                if args.image_url:
+                    log(f"图片URL: {args.image_url}")
+                log()
+                result = run_entry(args.use_async, run_multi_modal_agent, arun_multi_modal_agent,
+                                   args.input, args.image_url, on_event=on_event)
+                print(f"\n结果: {result}")
             
-        elif args.mode == 'multi-modal':
-            print(f"运行模式: 多模态Agent")
-            print(f"输入: {args.input}")
-            if args.image_url:
-                print(f"图片URL: {args.image_url}")
-            print()
-            result = run_multi_modal_agent(args.input, args.image_url)
-            print(f"\n结果: {result}")
+            elif args.mode == 'planner':
+                log(f"运行模式: 规划Agent")
+                log(f"任务: {args.problem}")
+                log()
+                run_entry(args.use_async, run_planner_agent, arun_planner_agent,
+                          args.problem, on_event=on_event)
             
-        elif args.mode == 'planner':
-            print(f"运行模式: 规划Agent")
-            print(f"任务: {args.problem}")
-            print()
-            run_planner_agent(args.problem)
+            elif args.mode == 'batch':
+                jobs = load_jobs(args.input, default_mode=args.engine)
+                log(f"运行模式: 批量运行 (多进程)")
+                log(f"任务文件: {args.input} ({len(jobs)} 个任务)")
+                log()
+                summary = run_batch(jobs, processes=args.processes,
+                                    embedding_worker=not args.no_embedding_worker,
+                                    use_async=args.use_async, hedge=args.hedge,
+                                    fast_scoring=args.fast_scoring,
+                                    eval_memo_path=eval_memo.path if eval_memo.enabled else None)
+                if args.output:
+                    write_batch_results(args.output, summary)
+                    log(f"结果已写入: {args.output}")
+                print_batch_summary(summary)
+        
+            if args.stream:
+                print_call_metrics()
+            if args.stats and args.mode != 'batch':
+                print_route_stats()
+            print_cassette_stats()
             
     except KeyboardInterrupt:
         print("\n\n用户中断")
@@ -103,6 +391,11 @@ def main():
         import traceback
         traceback.print_exc()
         sys.exit(1)
+    finally:
+        close_events()
+        if args.trace:
+            count = export_chrome_trace(args.trace)
+            print(f"\n追踪已导出: {args.trace} ({count} 个span，可在 chrome://tracing 或 ui.perfetto.dev 打开)")
 
 
 if __name__ == "__main__":
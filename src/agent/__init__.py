@@ -1,11 +1,19 @@
 """Agent模块"""
-from .multi_modal_agent import create_multi_modal_agent, run_multi_modal_agent
-from .planner_agent import create_planner_workflow, run_planner_agent
+from .multi_modal_agent import create_multi_modal_agent, run_multi_modal_agent, arun_multi_modal_agent
+from .planner_agent import (
+    create_planner_workflow,
+    create_async_planner_workflow,
+    run_planner_agent,
+    arun_planner_agent
+)
 
 __all__ = [
     "create_multi_modal_agent",
     "run_multi_modal_agent",
+    "arun_multi_modal_agent",
     "create_planner_workflow",
-    "run_planner_agent"
+    "create_async_planner_workflow",
+    "run_planner_agent",
+    "arun_planner_agent"
 ]
 
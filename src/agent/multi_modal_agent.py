@@ -1,31 +1,141 @@
 import os
+import time
+import httpx
 from langchain_openai import ChatOpenAI
 from langchain.agents import AgentExecutor, create_openai_tools_agent
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.memory import ConversationBufferMemory
 from dotenv import load_dotenv
 
-from src.tools import image_analyzer
+from src.llm import (
+    AsyncCassetteTransport,
+    AsyncSchedulingTransport,
+    CassetteTransport,
+    SchedulingTransport,
+    emit,
+    get_stream_handler,
+    router,
+    streaming
+)
+from src.llm.streaming import record_call
+from src.observability import is_quiet, is_tracing_enabled, log, span, start_span, traced
+from src.tools import batch_image_analyzer, image_analyzer
 
 load_dotenv()
 
 
+class StreamingCallbackHandler(BaseCallbackHandler):
+    """
+    把 AgentExecutor 内部LLM的增量token转发为流式事件，
+    并记录每次LLM调用的首token时间与总耗时。
+    """
+
+    # ainvoke / astream 时也在事件循环中直接调用，保持 token 顺序
+    run_inline = True
+
+    def __init__(self, model: str, label: str = "agent"):
+        self.model = model
+        self.label = label
+        self._runs = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._runs[run_id] = {"start": time.perf_counter(), "ttft": None}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._runs[run_id] = {"start": time.perf_counter(), "ttft": None}
+
+    def on_llm_new_token(self, token: str, *, run_id, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None and run["ttft"] is None:
+            run["ttft"] = time.perf_counter() - run["start"]
+        if token:
+            emit({"type": "token", "source": self.label, "text": token})
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        record_call({
+            "label": self.label,
+            "model": self.model,
+            "streamed": True,
+            "ttft": run["ttft"],
+            "total_time": time.perf_counter() - run["start"],
+        })
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    把 AgentExecutor 循环中的每次LLM调用与工具调用记录为 span (见 src.observability)。
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._spans = {}
+
+    def _start(self, run_id, name: str, **attributes):
+        self._spans[run_id] = start_span(name, **attributes)
+
+    def _end(self, run_id, error: BaseException = None):
+        run_span = self._spans.pop(run_id, None)
+        if run_span is None:
+            return
+        if error is not None:
+            run_span.set_attribute("error", f"{type(error).__name__}: {error}")
+        run_span.end()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "agent.llm")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "agent.llm")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, "agent.tool", tool=(serialized or {}).get("name"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
 def create_multi_modal_agent():
     """
     创建多模态Agent
+    如果当前上下文开启了流式输出，LLM会以 streaming=True 创建并推送token。
+    LLM请求经由 SchedulingTransport (async 调用经由 AsyncSchedulingTransport) 走共享的限流调度器，
+    并可被 cassette 录制/回放。
     """
-    print(">>> 正在创建视觉Agent...")
+    log(">>> 正在创建视觉Agent...")
 
-    tools = [image_analyzer]
+    tools = [image_analyzer, batch_image_analyzer]
 
+    model = router.model_for("agent")
+    stream_enabled = get_stream_handler() is not None
     llm = ChatOpenAI(
-        model="meta-llama/llama-4-maverick:free",
+        model=model,
         openai_api_key=os.environ.get("OPENROUTER_API_KEY"),
         openai_api_base=os.environ.get("OPENROUTER_API_BASE", "https://openrouter.ai/api/v1"),
+        streaming=stream_enabled,
+        max_retries=0,
+        http_client=httpx.Client(transport=SchedulingTransport("agent", transport=CassetteTransport())),
+        http_async_client=httpx.AsyncClient(
+            transport=AsyncSchedulingTransport("agent", transport=AsyncCassetteTransport())
+        ),
+        callbacks=[StreamingCallbackHandler(model)] if stream_enabled else None,
     )
 
     prompt_template = ChatPromptTemplate.from_messages([
-        ("system", "你是一个乐于助人的、强大的AI助手。你能调用工具来分析图片。"),
+        ("system", "你是一个乐于助人的、强大的AI助手。你能调用工具来分析图片；涉及多张图片或多个问题时，用批量工具一次完成。"),
         MessagesPlaceholder(variable_name="chat_history"),
         ("user", "{input}"),
         ("user", "图片URL: {image_url}"),
@@ -44,25 +154,70 @@ def create_multi_modal_agent():
         agent=agent,
         tools=tools,
         memory=memory,
-        verbose=True
+        verbose=not is_quiet()
     )
 
-    print(">>> 视觉Agent执行器 (AgentExecutor) 已创建。准备就绪。")
+    log(">>> 视觉Agent执行器 (AgentExecutor) 已创建。准备就绪。")
     return agent_executor
 
 
-def run_multi_modal_agent(input_text: str, image_url: str = ""):
+@traced("run.multi_modal")
+def run_multi_modal_agent(input_text: str, image_url: str = "", on_event=None):
     """
     运行多模态Agent
+    on_event: 可选的事件回调，传入后开启流式输出 (token / 工具调用步骤，见 src.llm.streaming)
+    """
+    with streaming(on_event), span("agent.executor"):
+        agent_executor = create_multi_modal_agent()
+        inputs = {
+            "input": input_text,
+            "image_url": image_url
+        }
+        config = {"callbacks": [TracingCallbackHandler()]} if is_tracing_enabled() else None
+
+        if get_stream_handler() is None:
+            response = agent_executor.invoke(inputs, config=config)
+            return response['output']
+
+        output = None
+        for chunk in agent_executor.stream(inputs, config=config):
+            output = _on_chunk(chunk, output)
+        return output
+
+
+@traced("run.multi_modal")
+async def arun_multi_modal_agent(input_text: str, image_url: str = "", on_event=None):
+    """
+    run_multi_modal_agent() 的 async 版本 (AgentExecutor.ainvoke / astream + async 工具)。
+    取消会传进正在进行的LLM请求与工具调用。
     """
-    agent_executor = create_multi_modal_agent()
-    
-    response = agent_executor.invoke({
-        "input": input_text,
-        "image_url": image_url
-    })
-    
-    return response['output']
+    with streaming(on_event), span("agent.executor"):
+        agent_executor = create_multi_modal_agent()
+        inputs = {
+            "input": input_text,
+            "image_url": image_url
+        }
+        config = {"callbacks": [TracingCallbackHandler()]} if is_tracing_enabled() else None
+
+        if get_stream_handler() is None:
+            response = await agent_executor.ainvoke(inputs, config=config)
+            return response['output']
+
+        output = None
+        async for chunk in agent_executor.astream(inputs, config=config):
+            output = _on_chunk(chunk, output)
+        return output
+
+
+def _on_chunk(chunk: dict, output):
+    """把 AgentExecutor 的一个流式块转成节点事件，返回 (可能更新后的) 最终输出。"""
+    for action in chunk.get("actions", []):
+        emit({"type": "node", "node": "agent_action",
+              "update": {"tool": action.tool, "tool_input": action.tool_input}})
+    for step in chunk.get("steps", []):
+        emit({"type": "node", "node": "tool_result",
+              "update": {"tool": step.action.tool, "observation": step.observation}})
+    return chunk.get("output", output)
 
 
 if __name__ == "__main__":
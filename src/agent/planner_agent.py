@@ -1,11 +1,18 @@
+import asyncio
 import os
-from openai import OpenAI
-import json
 from dotenv import load_dotenv
 from langgraph.graph import StateGraph, END
 from typing import TypedDict, List
 import time
 
+from src.llm import emit, streaming
+from src.llm.structured import (
+    StructuredOutputError,
+    acomplete_structured,
+    complete_structured,
+    validate_plan
+)
+from src.observability import emit_event, events, log, run_scope, traced
 from src.prompts import PLANNER_SYSTEM_PROMPT
 
 load_dotenv()
@@ -14,52 +21,65 @@ os.environ.setdefault("LANGCHAIN_TRACING_V2", "false")
 os.environ.pop("LANGCHAIN_API_KEY", None)
 os.environ.pop("LANGSMITH_ENDPOINT", None)
 
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.environ.get("OPENROUTER_API_KEY"),
-)
-
 
 def generate_plan(problem: str) -> dict:
     """
     调用"规划师"Agent，为其分配一个复杂任务，
-    并返回一个结构化的JSON计划。
+    并返回一个结构化的JSON计划。失败时返回空dict (错误写入日志)。
     """
-    print(f"--- [规划师] 接收到任务: {problem} ---")
-    
     try:
-        response = client.chat.completions.create(
-            model="meta-llama/llama-4-maverick:free",
-            messages=[
-                {"role": "system", "content": PLANNER_SYSTEM_PROMPT},
-                {"role": "user", "content": problem}
-            ],
-            temperature=0.0
-        )
-        
-        raw_response_content = response.choices[0].message.content
-        
-        start_index = raw_response_content.find('{')
-        end_index = raw_response_content.rfind('}')
-        
-        if start_index == -1 or end_index == -1:
-            print(f"--- [规划师] 错误: 在模型回复中找不到JSON的 '{{' 或 '}}' ---")
-            print(f"--- 原始回复: {raw_response_content} ---")
-            return {}
-            
-        clean_json_string = raw_response_content[start_index : end_index + 1]
-        plan_dict = json.loads(clean_json_string)
-        
-        print(f"--- [规划师] 已生成蓝图 (JSON): ---")
-        print(json.dumps(plan_dict, indent=2, ensure_ascii=False))
-        
-        return plan_dict
+        return _request_plan(problem)
 
+    except StructuredOutputError as e:
+        log(f"--- [规划师] 错误: 本地修复与重新请求后仍无法得到有效计划: {e} ---")
+        return {}
     except Exception as e:
-        print(f"--- [规划师] 错误 (可能是JSON解析失败): {e} ---")
+        log(f"--- [规划师] 错误: {e} ---")
         return {}
 
 
+async def agenerate_plan(problem: str) -> dict:
+    """generate_plan() 的 async 版本。"""
+    try:
+        return await _arequest_plan(problem)
+
+    except StructuredOutputError as e:
+        log(f"--- [规划师] 错误: 本地修复与重新请求后仍无法得到有效计划: {e} ---")
+        return {}
+    except Exception as e:
+        log(f"--- [规划师] 错误: {e} ---")
+        return {}
+
+
+def _request_plan(problem: str) -> dict:
+    """生成计划，失败时抛出异常 (供工作流使用，让运行结果如实反映失败)。"""
+    log(f"--- [规划师] 接收到任务: {problem} ---")
+    return _planned(complete_structured(**_planner_request(problem)))
+
+
+async def _arequest_plan(problem: str) -> dict:
+    log(f"--- [规划师] 接收到任务: {problem} ---")
+    return _planned(await acomplete_structured(**_planner_request(problem)))
+
+
+def _planner_request(problem: str) -> dict:
+    return {
+        "role": "planner",
+        "messages": [
+            {"role": "system", "content": PLANNER_SYSTEM_PROMPT},
+            {"role": "user", "content": problem}
+        ],
+        "validator": validate_plan,
+        "temperature": 0.0
+    }
+
+
+def _planned(plan_dict: dict) -> dict:
+    log(f"--- [规划师] 已生成蓝图: {len(plan_dict['plan'])} 个步骤 ---")
+    emit_event(events.PLAN, steps=plan_dict["plan"])
+    return plan_dict
+
+
 class AgentState(TypedDict):
     problem: str
     plan: List[str]
@@ -67,13 +87,14 @@ class AgentState(TypedDict):
     result: str
 
 
+@traced("node.planner")
 def planner_node(state: AgentState):
     """
     "规划师"节点：只运行一次，生成"蓝图"。
     """
-    print("--- [节点: 规划师] ---")
+    log("--- [节点: 规划师] ---")
     problem = state["problem"]
-    plan_dict = generate_plan(problem)
+    plan_dict = _request_plan(problem)
     
     return {
         "plan": plan_dict.get("plan", []),
@@ -81,24 +102,62 @@ def planner_node(state: AgentState):
     }
 
 
+@traced("node.planner")
+async def aplanner_node(state: AgentState):
+    """planner_node() 的 async 版本。"""
+    log("--- [节点: 规划师] ---")
+    plan_dict = await _arequest_plan(state["problem"])
+
+    return {
+        "plan": plan_dict.get("plan", []),
+        "step": 1
+    }
+
+
+@traced("node.executor")
 def executor_node(state: AgentState):
     """
     "执行者"节点：在循环中运行，逐一执行任务。
     """
-    print(f"--- [节点: 执行者 (第 {state['step']} 步)] ---")
+    log(f"--- [节点: 执行者 (第 {state['step']} 步)] ---")
     
+    task = _current_task(state)
+    if task is None:
+        return {"result": "执行错误"}
+    
+    time.sleep(1)
+    return _executed(state, task)
+
+
+@traced("node.executor")
+async def aexecutor_node(state: AgentState):
+    """executor_node() 的 async 版本，模拟执行时不阻塞事件循环。"""
+    log(f"--- [节点: 执行者 (第 {state['step']} 步)] ---")
+
+    task = _current_task(state)
+    if task is None:
+        return {"result": "执行错误"}
+
+    await asyncio.sleep(1)
+    return _executed(state, task)
+
+
+def _current_task(state: AgentState):
     plan = state["plan"]
     step = state["step"]
     
     if not plan or step > len(plan):
-        print("   错误：执行者在没有有效计划或步骤的情况下被调用。")
-        return {"result": "执行错误"}
+        log("   错误：执行者在没有有效计划或步骤的情况下被调用。")
+        return None
 
     task = plan[step - 1]
-    print(f"   执行任务: {task}")
-    
-    time.sleep(1)
+    log(f"   执行任务: {task}")
+    return task
+
+
+def _executed(state: AgentState, task: str) -> dict:
     result = f"成功完成了 '{task}'"
+    emit_event(events.PLAN_STEP, step=state["step"], result=result)
     
     return {
         "step": state["step"] + 1,
@@ -106,19 +165,20 @@ def executor_node(state: AgentState):
     }
 
 
+@traced("router.should_continue")
 def should_continue(state: AgentState):
     """
     "扳道工"：决定下一步是"继续执行"还是"结束"。
     """
-    print("--- [节点: 路由 (扳道工)] ---")
+    log("--- [节点: 路由 (扳道工)] ---")
     plan = state["plan"]
     step = state["step"]
     
     if step > len(plan):
-        print("   决策：计划已完成。")
+        log("   决策：计划已完成。")
         return END
     else:
-        print(f"   决策：继续执行第 {step} 步。")
+        log(f"   决策：继续执行第 {step} 步。")
         return "executor"
 
 
@@ -126,12 +186,23 @@ def create_planner_workflow():
     """
     创建并编译规划Agent工作流
     """
-    print("\n--- [LangGraph 阶段] ---")
+    log("\n--- [LangGraph 阶段] ---")
+    return _compile_workflow(planner_node, executor_node)
+
 
+def create_async_planner_workflow():
+    """
+    create_planner_workflow() 的 async 版本：节点都是 async 函数，供 ainvoke / astream 使用。
+    """
+    log("\n--- [LangGraph 阶段 (async)] ---")
+    return _compile_workflow(aplanner_node, aexecutor_node)
+
+
+def _compile_workflow(planner, executor):
     workflow = StateGraph(AgentState)
 
-    workflow.add_node("planner", planner_node)
-    workflow.add_node("executor", executor_node)
+    workflow.add_node("planner", planner)
+    workflow.add_node("executor", executor)
 
     workflow.set_entry_point("planner")
 
@@ -147,26 +218,63 @@ def create_planner_workflow():
     )
 
     app = workflow.compile()
-    print(">>> (9) 工作流图已编译！`app` 已准备就绪。")
+    log(">>> (9) 工作流图已编译！`app` 已准备就绪。")
     
     return app
 
 
-def run_planner_agent(problem: str):
+@traced("run.planner")
+def run_planner_agent(problem: str, on_event=None):
     """
-    运行规划Agent
+    运行规划Agent，返回 {"plan": [步骤...], "results": [每一步的执行结果...]}
+    on_event: 可选的事件回调，传入后开启流式输出 (见 src.llm.streaming)
+    生成计划失败等运行时错误会记录日志后原样抛出。
     """
     app = create_planner_workflow()
     
-    print("\n--- [运行规划Agent] ---")
+    log("\n--- [运行规划Agent] ---")
     
+    report = {"plan": [], "results": []}
+    try:
+        with streaming(on_event), run_scope("planner"):
+            for s in app.stream({"problem": problem}):
+                _on_step(s, report)
+    except Exception as e:
+        log(f"\n--- 运行时错误 ---: {e}")
+        raise
+    return report
+
+
+@traced("run.planner")
+async def arun_planner_agent(problem: str, on_event=None):
+    """
+    run_planner_agent() 的 async 版本 (基于 LangGraph 的 astream)，返回值相同。
+    """
+    app = create_async_planner_workflow()
+
+    log("\n--- [运行规划Agent (async)] ---")
+
+    report = {"plan": [], "results": []}
     try:
-        for s in app.stream({"problem": problem}):
-            print("---")
-            state_summary = {k: v for k, v in s.items() if k != 'problem'}
-            print(state_summary)
+        with streaming(on_event), run_scope("planner"):
+            async for s in app.astream({"problem": problem}):
+                _on_step(s, report)
     except Exception as e:
-        print(f"\n--- 运行时错误 ---: {e}")
+        log(f"\n--- 运行时错误 ---: {e}")
+        raise
+    return report
+
+
+def _on_step(s: dict, report: dict):
+    state_summary = {k: v for k, v in s.items() if k != 'problem'}
+    for node, update in state_summary.items():
+        if "plan" in update:
+            report["plan"] = update["plan"]
+        if node == "executor":
+            report["results"].append(update.get("result"))
+        # 只发出"步骤切换"，计划与每步结果由节点自己以增量事件发出
+        emit_event(events.STEP, node=node)
+        emit({"type": "node", "node": node, "update": update})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,12 @@
+"""批量运行模块：多进程执行与共享嵌入进程"""
+from .runner import BatchJob, load_jobs, merge_stats, run_batch
+from .embedding_worker import EmbeddingServer, SharedMemoryEmbeddings
+
+__all__ = [
+    "BatchJob",
+    "load_jobs",
+    "merge_stats",
+    "run_batch",
+    "EmbeddingServer",
+    "SharedMemoryEmbeddings"
+]
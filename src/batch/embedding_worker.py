@@ -0,0 +1,250 @@
+"""
+共享嵌入进程 (Shared Embedding Worker)
+批量运行时，每个工作进程各自加载 bge 模型既浪费内存，又会让嵌入计算与编排线程争抢GIL。
+这里由一个专门的进程加载模型，把所有工作进程的嵌入请求合并成批计算；
+向量以 float32 矩阵的形式写进每个工作进程独占的一块共享内存 (multiprocessing.shared_memory)，
+两端都通过直接映射在共享内存上的 numpy 数组读写；回复队列里只传 (请求id, 形状)，向量本身不经过 pickle。
+工作进程一侧只在交给 LangChain (它要求 List[List[float]]) 时转换一次。
+
+可调的环境变量:
+    THINKFLOW_EMBED_BATCH_SIZE    每批最多合并的文本数 (默认 64)
+    THINKFLOW_EMBED_BATCH_WAIT_MS 收到第一个请求后等待更多请求的时间 (默认 5)
+    THINKFLOW_EMBED_SLOT_MB       每个工作进程的共享内存大小 (默认 4)
+"""
+import itertools
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+load_dotenv()
+
+EMBED_BATCH_SIZE = int(os.environ.get("THINKFLOW_EMBED_BATCH_SIZE", "64"))
+EMBED_BATCH_WAIT = float(os.environ.get("THINKFLOW_EMBED_BATCH_WAIT_MS", "5")) / 1000
+EMBED_SLOT_BYTES = int(float(os.environ.get("THINKFLOW_EMBED_SLOT_MB", "4")) * 1024 * 1024)
+
+# 等待嵌入进程加载模型 / 回复单个请求的超时时间
+STARTUP_TIMEOUT = 300
+REPLY_TIMEOUT = 120
+
+_STOP = None
+
+
+def _load_model(model_name: str) -> Embeddings:
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={"device": "cpu"},
+        encode_kwargs={"normalize_embeddings": True},
+    )
+
+
+def _collect(requests, first) -> tuple:
+    """在等待窗口内尽量多收一些请求，凑成一批；返回 (批, 是否收到了停止信号)。"""
+    batch = [first]
+    texts = len(first[2])
+    deadline = time.perf_counter() + EMBED_BATCH_WAIT
+    while texts < EMBED_BATCH_SIZE:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        try:
+            item = requests.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if item is _STOP:
+            return batch, True
+        batch.append(item)
+        texts += len(item[2])
+    return batch, False
+
+
+def _slot_array(slot: shared_memory.SharedMemory, shape: tuple) -> np.ndarray:
+    """直接映射在槽位上的 float32 矩阵 (不复制)。用完后需要释放引用，槽位才能关闭。"""
+    return np.ndarray(shape, dtype=np.float32, buffer=slot.buf)
+
+
+def _write_rows(slot: shared_memory.SharedMemory, rows: np.ndarray):
+    # 客户端按槽位容量分块，这里不会越界
+    _slot_array(slot, rows.shape)[:] = rows
+
+
+def _read_rows(slot: shared_memory.SharedMemory, shape: tuple) -> List[List[float]]:
+    view = _slot_array(slot, shape)
+    try:
+        return view.tolist()
+    finally:
+        del view
+
+
+def _serve(model_name: str, requests, slot_names: List[str], replies: list, info):
+    """嵌入进程主循环。请求为 (客户端id, 请求id, 文本列表)，None 表示停止。"""
+    try:
+        model = _load_model(model_name)
+        dim = len(model.embed_query("ping"))
+    except Exception as e:
+        info.put({"error": str(e)})
+        return
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    info.put({"dim": dim})
+
+    stats = {"requests": 0, "texts": 0, "batches": 0, "compute_time": 0.0}
+    stopping = False
+    try:
+        while not stopping:
+            first = requests.get()
+            if first is _STOP:
+                break
+            batch, stopping = _collect(requests, first)
+
+            texts = [text for _, _, chunk in batch for text in chunk]
+            start = time.perf_counter()
+            try:
+                vectors = np.asarray(model.embed_documents(texts), dtype=np.float32)
+                error = None
+            except Exception as e:
+                vectors, error = None, str(e)
+            stats["compute_time"] += time.perf_counter() - start
+            stats["batches"] += 1
+            stats["requests"] += len(batch)
+            stats["texts"] += len(texts)
+
+            offset = 0
+            for client_id, request_id, chunk in batch:
+                if error is not None:
+                    replies[client_id].put((request_id, None, error))
+                    continue
+                rows = vectors[offset:offset + len(chunk)]
+                offset += len(chunk)
+                _write_rows(slots[client_id], rows)
+                replies[client_id].put((request_id, (len(rows), dim), None))
+    finally:
+        for slot in slots:
+            slot.close()
+        info.put({"stats": stats})
+
+
+class EmbeddingServer:
+    """
+    父进程持有的嵌入进程句柄：创建共享内存槽位与队列，启动/停止嵌入进程。
+    每个工作进程通过 client_config(i) 取得连接信息 (可以作为进程参数传递)。
+    """
+
+    def __init__(self, num_clients: int, model_name: Optional[str] = None, ctx=None,
+                 slot_bytes: int = EMBED_SLOT_BYTES):
+        import multiprocessing
+
+        self.ctx = ctx or multiprocessing.get_context("spawn")
+        self.model_name = model_name or os.environ.get("EMBED_MODEL", "BAAI/bge-small-zh-v1.5")
+        self.slots = [shared_memory.SharedMemory(create=True, size=slot_bytes) for _ in range(num_clients)]
+        self.requests = self.ctx.Queue()
+        self.replies = [self.ctx.Queue() for _ in range(num_clients)]
+        self._info = self.ctx.Queue()
+        self.dim: Optional[int] = None
+        self.process = None
+        self._stats: Optional[dict] = None
+
+    def start(self):
+        """启动嵌入进程并等待模型加载完成；加载失败时抛出 RuntimeError。"""
+        self.process = self.ctx.Process(
+            target=_serve,
+            args=(self.model_name, self.requests, [s.name for s in self.slots], self.replies, self._info),
+            name="thinkflow-embedding",
+            daemon=True,
+        )
+        self.process.start()
+        try:
+            info = self._info.get(timeout=STARTUP_TIMEOUT)
+        except queue.Empty:
+            self.stop()
+            raise RuntimeError("嵌入进程启动超时")
+        if "error" in info:
+            self.stop()
+            raise RuntimeError(f"嵌入进程加载模型失败: {info['error']}")
+        self.dim = info["dim"]
+        return self
+
+    def client_config(self, client_id: int) -> dict:
+        return {
+            "client_id": client_id,
+            "slot_name": self.slots[client_id].name,
+            "slot_bytes": self.slots[client_id].size,
+            "dim": self.dim,
+            "requests": self.requests,
+            "reply": self.replies[client_id],
+        }
+
+    def stop(self):
+        """停止嵌入进程并释放共享内存。"""
+        if self.process is not None and self.process.is_alive():
+            self.requests.put(_STOP)
+            try:
+                while self._stats is None:
+                    info = self._info.get(timeout=10)
+                    self._stats = info.get("stats")
+            except queue.Empty:
+                pass
+            self.process.join(timeout=10)
+            if self.process.is_alive():
+                self.process.terminate()
+        for slot in self.slots:
+            slot.close()
+            slot.unlink()
+        self.slots = []
+
+    def stats(self) -> Optional[dict]:
+        """嵌入进程的统计 (stop() 之后可用)。"""
+        if self._stats is None:
+            return None
+        stats = dict(self._stats)
+        stats["avg_batch"] = stats["texts"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+
+class SharedMemoryEmbeddings(Embeddings):
+    """
+    工作进程一侧的 LangChain Embeddings：把文本发给嵌入进程，从共享内存槽位中读回向量。
+    同一进程内的多个线程共用一个槽位，请求按顺序进行。
+    """
+
+    def __init__(self, config: dict):
+        self.client_id = config["client_id"]
+        self.dim = config["dim"]
+        self.requests = config["requests"]
+        self.reply = config["reply"]
+        self.slot = shared_memory.SharedMemory(name=config["slot_name"])
+        self.capacity = max(1, config["slot_bytes"] // (self.dim * 4))
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _embed_chunk(self, texts: List[str]) -> List[List[float]]:
+        request_id = next(self._ids)
+        self.requests.put((self.client_id, request_id, texts))
+        while True:
+            try:
+                reply_id, shape, error = self.reply.get(timeout=REPLY_TIMEOUT)
+            except queue.Empty:
+                raise RuntimeError("嵌入进程无响应")
+            # 之前超时放弃的请求的迟到回复直接丢弃
+            if reply_id == request_id:
+                break
+        if error is not None:
+            raise RuntimeError(f"嵌入计算失败: {error}")
+        return _read_rows(self.slot, shape)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        with self._lock:
+            for i in range(0, len(texts), self.capacity):
+                vectors.extend(self._embed_chunk(list(texts[i:i + self.capacity])))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
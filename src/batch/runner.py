@@ -0,0 +1,261 @@
+"""
+多进程批量运行 (Batch Runner)
+离线批量任务 (大量 run_tot / run_tot_orchestrator / run_planner_agent) 在单个进程里跑不满：
+JSON处理、去重等CPU工作和编排线程争抢同一个GIL。这里把任务分片到进程池 (spawn) 中执行，
+可选地启动一个共享嵌入进程 (见 embedding_worker.py) 为所有工作进程的 query_local_knowledge 提供向量，
+结果与各进程的统计 (模型路由、限流调度、结构化输出、评估备忘录) 在父进程中汇总。
+
+每个工作进程都有自己的限流调度器，所以每模型/每提供商的RPM预算会按进程数平分。
+"""
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, TypedDict
+
+from src.observability import log
+
+ENGINES = ("tot", "tot-orchestrator", "planner")
+
+# 在父进程中按进程数平分的限流配置 (子进程导入 src.llm 时读取)
+_RPM_ENV = {
+    "THINKFLOW_RPM_PER_MODEL": "20",
+    "THINKFLOW_RPM_PER_PROVIDER": "60",
+}
+
+
+class BatchJob(TypedDict, total=False):
+    """一个批量任务。只有 problem 是必需的。"""
+    mode: str
+    problem: str
+    k: int
+    fast_scoring: bool
+    speculative: bool
+
+
+def load_jobs(path: str, default_mode: str = "tot") -> List[BatchJob]:
+    """
+    读取任务文件：.jsonl 每行一个 BatchJob 对象；其他文件每行一个问题。
+    空行与 # 开头的行会被跳过。
+    """
+    jobs: List[BatchJob] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                job = json.loads(line)
+                if not isinstance(job, dict) or not job.get("problem"):
+                    raise ValueError(f"{path}:{line_number}: 任务缺少 problem 字段")
+            else:
+                job = {"problem": line}
+            job.setdefault("mode", default_mode)
+            if job["mode"] not in ENGINES:
+                raise ValueError(f"{path}:{line_number}: 未知的运行模式 {job['mode']}")
+            jobs.append(job)
+    return jobs
+
+
+# --- 工作进程 ---
+
+_worker_options: dict = {}
+
+
+def _init_worker(slot_ids, embedding_configs: Optional[list], options: dict):
+    """进程池初始化：关闭终端日志，接上共享嵌入进程，应用全局开关。"""
+    from src.llm import hedger
+    from src.observability import configure_events
+
+    _worker_options.update(options)
+    configure_events(quiet=True)
+    if options.get("hedge"):
+        hedger.enable()
+    if options.get("eval_memo_path"):
+        from src.tot import eval_memo
+
+        eval_memo.enable(path=options["eval_memo_path"])
+
+    if embedding_configs is not None:
+        from src.tools.tools import set_embeddings
+        from .embedding_worker import SharedMemoryEmbeddings
+
+        set_embeddings(SharedMemoryEmbeddings(embedding_configs[slot_ids.get()]))
+
+
+def _run_engine(job: BatchJob):
+    from src.agent import arun_planner_agent, run_planner_agent
+    from src.tot import arun_tot, arun_tot_orchestrator, run_tot, run_tot_orchestrator
+
+    mode, problem = job["mode"], job["problem"]
+    fast_scoring = job.get("fast_scoring", _worker_options.get("fast_scoring", False))
+    if mode == "tot":
+        kwargs = {"speculative": job.get("speculative", False), "fast_scoring": fast_scoring}
+        sync_fn, async_fn = run_tot, arun_tot
+    elif mode == "tot-orchestrator":
+        kwargs = {"k": job.get("k", 6), "fast_scoring": fast_scoring}
+        sync_fn, async_fn = run_tot_orchestrator, arun_tot_orchestrator
+    else:
+        kwargs = {}
+        sync_fn, async_fn = run_planner_agent, arun_planner_agent
+
+    if _worker_options.get("use_async"):
+        result = asyncio.run(async_fn(problem, **kwargs))
+    else:
+        result = sync_fn(problem, **kwargs)
+    # LangGraph 版本返回整个最终状态，只保留选中的思想
+    if mode == "tot" and result:
+        result = result.get("best_thought")
+    return result
+
+
+def _stats_snapshot() -> dict:
+    from src.llm import get_route_stats, get_scheduler_stats, get_structured_stats
+    from src.tot import get_eval_memo_stats
+
+    return {
+        "routes": get_route_stats(),
+        "scheduler": get_scheduler_stats(),
+        "structured": get_structured_stats(),
+        "eval_memo": get_eval_memo_stats(),
+    }
+
+
+def _run_job(index: int, job: BatchJob) -> dict:
+    start = time.perf_counter()
+    try:
+        result, error = _run_engine(job), None
+    except Exception as e:
+        result, error = None, f"{type(e).__name__}: {e}"
+    return {
+        "index": index,
+        "mode": job["mode"],
+        "problem": job["problem"],
+        "result": result,
+        "error": error,
+        "elapsed": time.perf_counter() - start,
+        "pid": os.getpid(),
+        # 统计是进程内累计的，父进程对每个进程只保留最新的一份
+        "stats": _stats_snapshot(),
+    }
+
+
+# --- 汇总 ---
+
+def merge_stats(snapshots: List[dict]) -> dict:
+    """合并各进程的累计统计。"""
+    routes: Dict[tuple, dict] = {}
+    scheduler: Dict[str, float] = {}
+    structured: Dict[str, float] = {}
+    memo: Dict[str, float] = {}
+    for snapshot in snapshots:
+        for r in snapshot["routes"]:
+            merged = routes.setdefault((r["role"], r["model"]), {
+                "role": r["role"], "model": r["model"], "calls": 0, "total_latency": 0.0,
+                "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0,
+            })
+            for key in ("calls", "total_latency", "prompt_tokens", "completion_tokens", "cost"):
+                merged[key] += r[key]
+        for key, value in snapshot["scheduler"].items():
+            scheduler[key] = max(scheduler.get(key, 0), value) if key.endswith("_max") else scheduler.get(key, 0) + value
+        for key, value in snapshot["structured"].items():
+            if not key.endswith("_rate"):
+                structured[key] = structured.get(key, 0) + value
+        if snapshot["eval_memo"]["enabled"]:
+            for key in ("lookups", "exact_hits", "near_hits", "misses", "stored", "expired"):
+                memo[key] = memo.get(key, 0) + snapshot["eval_memo"][key]
+
+    for r in routes.values():
+        r["avg_latency"] = r["total_latency"] / r["calls"] if r["calls"] else 0.0
+    calls = structured.get("calls") or 1
+    structured["repair_rate"] = structured.get("repaired", 0) / calls
+    structured["rerequest_rate"] = structured.get("rerequested", 0) / calls
+    if memo:
+        memo["hit_rate"] = (memo["exact_hits"] + memo["near_hits"]) / memo["lookups"] if memo["lookups"] else 0.0
+    return {"routes": list(routes.values()), "scheduler": scheduler, "structured": structured, "eval_memo": memo}
+
+
+def _split_rate_limits(processes: int) -> dict:
+    """把RPM预算按进程数平分，返回需要在结束后恢复的原始环境变量。"""
+    previous = {}
+    for name, default in _RPM_ENV.items():
+        previous[name] = os.environ.get(name)
+        total = float(os.environ.get(name, default))
+        os.environ[name] = str(total / processes)
+    return previous
+
+
+def _restore_env(previous: dict):
+    for name, value in previous.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+
+def run_batch(jobs: List[BatchJob], processes: Optional[int] = None, embedding_worker: bool = True,
+              use_async: bool = False, hedge: bool = False, fast_scoring: bool = False,
+              eval_memo_path: Optional[str] = None, on_result=None) -> dict:
+    """
+    在进程池中运行一批任务，返回:
+        {"results": [按输入顺序的结果], "stats": 合并后的统计, "embedding": 嵌入进程统计, "wall_time": 秒}
+    embedding_worker: 启动共享嵌入进程 (模型加载失败时退回各进程自行加载)
+    eval_memo_path: 开启评估备忘录，所有工作进程共用这个 sqlite 文件
+    on_result: 每个任务完成时在父进程中回调 (参数为该任务的结果dict)
+    """
+    import multiprocessing
+
+    if not jobs:
+        return {"results": [], "stats": merge_stats([]), "embedding": None, "wall_time": 0.0}
+
+    processes = max(1, min(processes or os.cpu_count() or 1, len(jobs)))
+    ctx = multiprocessing.get_context("spawn")
+    options = {"use_async": use_async, "hedge": hedge, "fast_scoring": fast_scoring,
+               "eval_memo_path": eval_memo_path}
+
+    server = None
+    embedding_configs = None
+    if embedding_worker:
+        from .embedding_worker import EmbeddingServer
+
+        log(f"--- [批量] 正在启动共享嵌入进程... ---")
+        try:
+            server = EmbeddingServer(processes, ctx=ctx).start()
+            embedding_configs = [server.client_config(i) for i in range(processes)]
+        except Exception as e:
+            log(f"--- [批量] 共享嵌入进程不可用 ({e})，各进程自行加载嵌入模型 ---")
+            server = None
+
+    slot_ids = ctx.Queue()
+    for i in range(processes):
+        slot_ids.put(i)
+
+    log(f"--- [批量] {len(jobs)} 个任务，{processes} 个工作进程 ---")
+    results: List[Optional[dict]] = [None] * len(jobs)
+    snapshots: Dict[int, dict] = {}
+    start = time.perf_counter()
+    previous_env = _split_rate_limits(processes)
+    try:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(slot_ids, embedding_configs, options)) as pool:
+            futures = [pool.submit(_run_job, i, job) for i, job in enumerate(jobs)]
+            for done, future in enumerate(as_completed(futures), 1):
+                item = future.result()
+                snapshots[item.pop("pid")] = item.pop("stats")
+                results[item["index"]] = item
+                status = "失败" if item["error"] else "完成"
+                log(f"--- [批量] {status} {done}/{len(jobs)} #{item['index']} ({item['mode']}, {item['elapsed']:.1f}s) ---")
+                if on_result is not None:
+                    on_result(item)
+    finally:
+        _restore_env(previous_env)
+        if server is not None:
+            server.stop()
+
+    return {
+        "results": results,
+        "stats": merge_stats(list(snapshots.values())),
+        "embedding": server.stats() if server is not None else None,
+        "wall_time": time.perf_counter() - start,
+    }
@@ -0,0 +1,83 @@
+"""LLM调用层：共享客户端、模型路由、限流调度、请求合并、请求对冲、结构化输出、流式输出与录制/回放"""
+from .cassette import (
+    Cassette,
+    CassetteMiss,
+    CassetteTransport,
+    AsyncCassetteTransport,
+    use_cassette,
+    recorded,
+    arecorded,
+    get_cassette,
+    get_cassette_stats
+)
+from .client import client, async_client, complete, chat_completion, acomplete, achat_completion
+from .coalesce import SingleFlight, request_key, get_coalescing_stats
+from .hedging import Hedger, hedger, get_hedge_stats
+from .routing import ModelRouter, router, get_route_stats
+from .scheduler import (
+    RateLimitScheduler,
+    SchedulingTransport,
+    AsyncSchedulingTransport,
+    scheduler,
+    get_scheduler_stats
+)
+from .structured import (
+    StructuredOutputError,
+    complete_structured,
+    acomplete_structured,
+    repair_json,
+    get_structured_stats
+)
+from .streaming import (
+    streaming,
+    emit,
+    iter_events,
+    aiter_events,
+    get_stream_handler,
+    get_call_metrics,
+    reset_call_metrics
+)
+
+__all__ = [
+    "Cassette",
+    "CassetteMiss",
+    "CassetteTransport",
+    "AsyncCassetteTransport",
+    "use_cassette",
+    "recorded",
+    "arecorded",
+    "get_cassette",
+    "get_cassette_stats",
+    "client",
+    "async_client",
+    "complete",
+    "chat_completion",
+    "acomplete",
+    "achat_completion",
+    "SingleFlight",
+    "request_key",
+    "get_coalescing_stats",
+    "Hedger",
+    "hedger",
+    "get_hedge_stats",
+    "ModelRouter",
+    "router",
+    "get_route_stats",
+    "RateLimitScheduler",
+    "SchedulingTransport",
+    "AsyncSchedulingTransport",
+    "scheduler",
+    "get_scheduler_stats",
+    "StructuredOutputError",
+    "complete_structured",
+    "acomplete_structured",
+    "repair_json",
+    "get_structured_stats",
+    "streaming",
+    "emit",
+    "iter_events",
+    "aiter_events",
+    "get_stream_handler",
+    "get_call_metrics",
+    "reset_call_metrics"
+]
@@ -0,0 +1,378 @@
+"""
+录制/回放 (Record / Replay Cassettes)
+录制模式下，把一次真实运行中的每个LLM HTTP请求/响应 (含流式分块的到达时间)、
+搜索结果与知识库查询结果连同原始耗时写入本地 cassette 文件；
+回放模式下不访问网络，按录制时的速度 (或按比例缩放、或零延迟) 重放这些响应，
+用来单独测量框架自身的CPU与调度开销，并在同一份真实轨迹上比较不同版本的引擎。
+
+LLM请求在 httpx 传输层录制 (CassetteTransport / AsyncCassetteTransport)，所以 complete()、
+acomplete() 与 LangChain 的 ChatOpenAI 都会被覆盖；工具结果在函数层录制 (recorded)。
+同一个请求出现多次时 (例如采样、429 后重试)，按录制顺序依次回放。
+回放时不再经过令牌桶限流 (响应来自本地文件)，重试的退避时间与录制延迟一样乘以 latency_scale。
+"""
+import asyncio
+import base64
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+from .coalesce import request_key
+
+CASSETTE_VERSION = 1
+
+
+class CassetteMiss(RuntimeError):
+    """回放时 cassette 中没有匹配的录制记录"""
+
+
+class Cassette:
+    """
+    一份录制文件。mode 为 "record" 或 "replay"。
+    latency_scale: 回放时的延迟倍数，1.0 = 按录制速度，0 = 零延迟。
+    """
+
+    def __init__(self, path: str, mode: str = "record", latency_scale: float = 1.0,
+                 meta: Optional[dict] = None):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"未知的 cassette 模式: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = max(0.0, latency_scale)
+        self.meta = dict(meta or {})
+        self._lock = threading.Lock()
+        self._recorded = []
+        self._queues = {}
+        self._stats = {"recorded": 0, "replayed": 0, "misses": 0, "replay_wait": 0.0}
+        if mode == "replay":
+            self._load()
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != CASSETTE_VERSION:
+            raise ValueError(f"不支持的 cassette 版本: {data.get('version')}")
+        self.meta = data.get("meta", {})
+        for entry in data.get("interactions", []):
+            self._queues.setdefault(entry["key"], deque()).append(entry)
+
+    def record(self, entry: dict):
+        with self._lock:
+            self._recorded.append(entry)
+            self._stats["recorded"] += 1
+
+    def next(self, kind: str, key: str) -> dict:
+        """取出该请求的下一条录制记录。"""
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                self._stats["misses"] += 1
+                raise CassetteMiss(f"cassette 中没有匹配的 {kind} 请求 (key={key[:12]})")
+            self._stats["replayed"] += 1
+            return queue.popleft()
+
+    def _scaled(self, seconds: float) -> float:
+        delay = seconds * self.latency_scale
+        if delay > 0:
+            with self._lock:
+                self._stats["replay_wait"] += delay
+        return delay
+
+    def wait(self, seconds: float):
+        """回放时模拟录制下来的耗时。"""
+        delay = self._scaled(seconds)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def asleep(self, seconds: float):
+        """wait() 的 async 版本。"""
+        delay = self._scaled(seconds)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def call(self, kind: str, key: str, fn: Callable):
+        """函数层的录制/回放：结果必须可以JSON序列化。"""
+        if self.mode == "replay":
+            entry = self.next(kind, key)
+            self.wait(entry["latency"])
+            return entry["result"]
+
+        start = time.perf_counter()
+        result = fn()
+        self.record({
+            "kind": kind,
+            "key": key,
+            "start": start,
+            "latency": time.perf_counter() - start,
+            "result": result,
+        })
+        return result
+
+    async def acall(self, kind: str, key: str, fn: Callable[[], Awaitable]):
+        """call() 的 async 版本：fn() 返回一个 awaitable。"""
+        if self.mode == "replay":
+            entry = self.next(kind, key)
+            await self.asleep(entry["latency"])
+            return entry["result"]
+
+        start = time.perf_counter()
+        result = await fn()
+        self.record({
+            "kind": kind,
+            "key": key,
+            "start": start,
+            "latency": time.perf_counter() - start,
+            "result": result,
+        })
+        return result
+
+    def save(self):
+        if self.mode != "record":
+            return
+        with self._lock:
+            interactions = sorted(self._recorded, key=lambda e: e["start"])
+        base = interactions[0]["start"] if interactions else 0.0
+        for entry in interactions:
+            entry["start"] = round(entry["start"] - base, 6)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": CASSETTE_VERSION,
+                "meta": self.meta,
+                "interactions": interactions,
+            }, f, ensure_ascii=False, indent=1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["mode"] = self.mode
+        stats["path"] = self.path
+        if self.mode == "replay":
+            stats["unused"] = sum(len(q) for q in self._queues.values())
+        return stats
+
+
+_active: Optional[Cassette] = None
+
+
+def get_cassette() -> Optional[Cassette]:
+    return _active
+
+
+@contextmanager
+def use_cassette(path: str, mode: str = "record", latency_scale: float = 1.0,
+                 meta: Optional[dict] = None):
+    """
+    在 with 块内开启录制或回放 (对整个进程生效)，录制模式在退出时写入文件。
+    用法:
+        with use_cassette("run.cassette.json", mode="replay", latency_scale=0):
+            run_tot(problem)
+    """
+    global _active
+    cassette = Cassette(path, mode, latency_scale, meta)
+    previous, _active = _active, cassette
+    try:
+        yield cassette
+    finally:
+        _active = previous
+        cassette.save()
+
+
+def recorded(kind: str, key: str, fn: Callable):
+    """没有开启 cassette 时直接调用 fn，否则经由 cassette 录制或回放。"""
+    cassette = _active
+    if cassette is None:
+        return fn()
+    return cassette.call(kind, key, fn)
+
+
+async def arecorded(kind: str, key: str, fn: Callable[[], Awaitable]):
+    """recorded() 的 async 版本。"""
+    cassette = _active
+    if cassette is None:
+        return await fn()
+    return await cassette.acall(kind, key, fn)
+
+
+def get_cassette_stats() -> Optional[dict]:
+    return _active.stats() if _active is not None else None
+
+
+def _http_key(request: httpx.Request) -> str:
+    body = request.read()
+    try:
+        body = json.loads(body) if body else None
+    except ValueError:
+        body = body.decode("utf-8", errors="replace")
+    return request_key("http", request.method, str(request.url), body)
+
+
+def _encode_chunks(chunks: list) -> tuple:
+    # 分块边界可能切开多字节字符，所以整体能按UTF-8解码时才存成文本
+    try:
+        for _, data in chunks:
+            data.decode("utf-8")
+        return "utf-8", [[offset, data.decode("utf-8")] for offset, data in chunks]
+    except UnicodeDecodeError:
+        return "base64", [[offset, base64.b64encode(data).decode("ascii")] for offset, data in chunks]
+
+
+def _decode_chunk(encoding: str, data: str) -> bytes:
+    if encoding == "base64":
+        return base64.b64decode(data)
+    return data.encode("utf-8")
+
+
+def _http_entry(request: httpx.Request, key: str, start: float, response: httpx.Response) -> dict:
+    return {
+        "kind": "http",
+        "key": key,
+        "method": request.method,
+        "url": str(request.url),
+        "start": start,
+        "latency": time.perf_counter() - start,
+        "status": response.status_code,
+        "headers": response.headers.multi_items(),
+    }
+
+
+class _RecordingStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """透传响应体，同时记下每个分块相对请求开始的到达时间。"""
+
+    def __init__(self, cassette: Cassette, entry: dict, response: httpx.Response):
+        self.cassette = cassette
+        self.entry = entry
+        self.response = response
+        self.chunks = []
+        self.saved = False
+
+    def _observe(self, data: bytes) -> bytes:
+        self.chunks.append((round(time.perf_counter() - self.entry["start"], 6), data))
+        return data
+
+    def _save(self):
+        if not self.saved:
+            self.saved = True
+            self.entry["encoding"], self.entry["chunks"] = _encode_chunks(self.chunks)
+            self.cassette.record(self.entry)
+
+    def __iter__(self):
+        for data in self.response.stream:
+            yield self._observe(data)
+
+    async def __aiter__(self):
+        async for data in self.response.stream:
+            yield self._observe(data)
+
+    def close(self):
+        self.response.close()
+        self._save()
+
+    async def aclose(self):
+        await self.response.aclose()
+        self._save()
+
+
+class _ReplayStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """按录制的到达时间 (乘以 latency_scale) 逐块重放响应体。"""
+
+    def __init__(self, cassette: Cassette, entry: dict):
+        self.cassette = cassette
+        self.entry = entry
+
+    def _gaps(self):
+        elapsed = self.entry["latency"]
+        for offset, data in self.entry["chunks"]:
+            yield offset - elapsed, _decode_chunk(self.entry["encoding"], data)
+            elapsed = max(elapsed, offset)
+
+    def __iter__(self):
+        for gap, data in self._gaps():
+            self.cassette.wait(gap)
+            yield data
+
+    async def __aiter__(self):
+        for gap, data in self._gaps():
+            await self.cassette.asleep(gap)
+            yield data
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """
+    httpx 传输层包装：开启 cassette 时录制或回放HTTP交互，否则直接透传。
+    放在 SchedulingTransport 内层；回放时调度器跳过令牌等待，录制下来的 429 退避按 latency_scale 缩放。
+    响应头与原始 (未解压的) 响应体一起保存，回放时由 httpx 照常解码。
+    """
+
+    def __init__(self, transport: Optional[httpx.BaseTransport] = None):
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        cassette = _active
+        if cassette is None:
+            return self.transport.handle_request(request)
+
+        key = _http_key(request)
+        if cassette.mode == "replay":
+            entry = cassette.next("http", key)
+            cassette.wait(entry["latency"])
+            return httpx.Response(
+                entry["status"],
+                headers=entry["headers"],
+                stream=_ReplayStream(cassette, entry),
+                request=request,
+            )
+
+        start = time.perf_counter()
+        response = self.transport.handle_request(request)
+        entry = _http_entry(request, key, start, response)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(cassette, entry, response),
+            request=request,
+            extensions=response.extensions,
+        )
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    """CassetteTransport 的 async 版本 (用于 AsyncOpenAI 与 ChatOpenAI 的 http_async_client)。"""
+
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        cassette = _active
+        if cassette is None:
+            return await self.transport.handle_async_request(request)
+
+        key = _http_key(request)
+        if cassette.mode == "replay":
+            entry = cassette.next("http", key)
+            await cassette.asleep(entry["latency"])
+            return httpx.Response(
+                entry["status"],
+                headers=entry["headers"],
+                stream=_ReplayStream(cassette, entry),
+                request=request,
+            )
+
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        entry = _http_entry(request, key, start, response)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(cassette, entry, response),
+            request=request,
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
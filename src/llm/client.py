@@ -0,0 +1,270 @@
+"""
+共享的LLM客户端
+所有模块都经由 complete() / chat_completion() 调用 OpenRouter，
+这样流式输出、耗时统计等横切逻辑只需要实现一次。
+acomplete() / achat_completion() 是基于 AsyncOpenAI 的 async 版本，
+与同步版本共用路由、限流调度、请求合并与录制/回放。
+"""
+import os
+import time
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+from dotenv import load_dotenv
+
+from src.observability import span
+from .cassette import AsyncCassetteTransport, CassetteTransport
+from .coalesce import llm_flight, request_key
+from .hedging import hedger
+from .routing import router
+from .scheduler import scheduler
+from .streaming import emit, get_stream_handler, record_call
+
+load_dotenv()
+
+client = OpenAI(
+    base_url=os.environ.get("OPENROUTER_API_BASE", "https://openrouter.ai/api/v1"),
+    api_key=os.environ.get("OPENROUTER_API_KEY"),
+    max_retries=0,  # 重试由 scheduler 统一负责
+    http_client=DefaultHttpxClient(transport=CassetteTransport()),  # 录制/回放 (见 cassette.py)
+)
+
+async_client = AsyncOpenAI(
+    base_url=os.environ.get("OPENROUTER_API_BASE", "https://openrouter.ai/api/v1"),
+    api_key=os.environ.get("OPENROUTER_API_KEY"),
+    max_retries=0,
+    http_client=DefaultAsyncHttpxClient(transport=AsyncCassetteTransport()),
+)
+
+
+def _usage_tokens(usage) -> tuple:
+    if usage is None:
+        return 0, 0
+    return usage.prompt_tokens or 0, usage.completion_tokens or 0
+
+
+def _stream_content(model: str, messages: list, role: str, label: str, start: float, **params):
+    """
+    以 stream=True 调用模型，逐个推送 token 事件。
+    返回 (完整文本, 首token时间, usage)。
+    """
+    stream = scheduler.run(
+        lambda: client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params
+        ),
+        model,
+        role,
+    )
+
+    parts = []
+    ttft = None
+    usage = None
+    for chunk in stream:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        if ttft is None:
+            ttft = time.perf_counter() - start
+        parts.append(delta)
+        emit({"type": "token", "source": label, "text": delta})
+
+    return "".join(parts), ttft, usage
+
+
+async def _astream_content(model: str, messages: list, role: str, label: str, start: float, **params):
+    """_stream_content() 的 async 版本。"""
+    stream = await scheduler.arun(
+        lambda: async_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params
+        ),
+        model,
+        role,
+    )
+
+    parts = []
+    ttft = None
+    usage = None
+    try:
+        async for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            parts.append(delta)
+            emit({"type": "token", "source": label, "text": delta})
+    finally:
+        # 被取消时立即关闭连接，而不是等服务器把剩下的token发完
+        await stream.close()
+
+    return "".join(parts), ttft, usage
+
+
+def _token_logprobs(response) -> list:
+    """
+    把 response 中的 logprobs 转成纯数据: [[(token, logprob), ...], ...]，
+    外层按输出token，内层是该位置的 top_logprobs。提供商不返回时为空列表。
+    """
+    logprobs = getattr(response.choices[0], "logprobs", None)
+    if logprobs is None or not logprobs.content:
+        return []
+    return [
+        [(top.token, top.logprob) for top in (item.top_logprobs or [])] or [(item.token, item.logprob)]
+        for item in logprobs.content
+    ]
+
+
+def _flight_key(model: str, messages: list, params: dict, allow_stream: bool) -> str:
+    # token 事件只会推送给 leader 所在上下文的回调，所以流式调用只与同一个回调下的相同请求合并
+    handler = get_stream_handler() if allow_stream else None
+    return request_key("chat", model, messages, params, id(handler) if handler is not None else None)
+
+
+def complete(messages: list, role: str = None, model: str = None, label: str = None,
+             allow_stream: bool = True, **params) -> dict:
+    """
+    调用一次 chat completion。
+    模型由 role 经路由表决定 (见 routing.py)，也可以直接用 model 指定。
+    与正在进行中的完全相同的请求 (模型、消息、参数) 会被合并，只发出一次 (见 coalesce.py)。
+    所有请求都经过 scheduler 的限流、优先级排队与重试；开启对冲时慢请求会被复制一份 (见 hedging.py)。
+    如果当前上下文开启了流式输出 (见 streaming())，则以流式方式调用并推送 token；
+    allow_stream=False 时总是非流式调用 (例如需要读取 logprobs 的打分请求)。
+    返回 {"content": str, "model": str, "ttft": float | None, "total_time": float, "logprobs": list}。
+    """
+    if model is None:
+        model = router.model_for(role)
+    label = label or role or "llm"
+    key = _flight_key(model, messages, params, allow_stream)
+    with span("llm.call", model=model, role=role, label=label):
+        return llm_flight.do(key, lambda: _complete(messages, role, model, label, allow_stream, **params))
+
+
+def _complete(messages: list, role: str, model: str, label: str, allow_stream: bool,
+              **params) -> dict:
+    start = time.perf_counter()
+    logprobs = []
+
+    hedged = False
+
+    if not allow_stream or get_stream_handler() is None:
+        def make_request(attempt_model: str):
+            def request():
+                with span("llm.request", model=attempt_model):
+                    return client.chat.completions.create(
+                        model=attempt_model,
+                        messages=messages,
+                        **params
+                    )
+            return request
+
+        # 开启对冲时，慢请求会被复制一份，模型可能换成备用模型 (见 hedging.py)
+        response, model, hedged = hedger.run(make_request, model, role)
+        content = response.choices[0].message.content
+        ttft = None
+        usage = response.usage
+        if params.get("logprobs"):
+            logprobs = _token_logprobs(response)
+    else:
+        with span("llm.stream", model=model) as stream_span:
+            content, ttft, usage = _stream_content(model, messages, role, label, start, **params)
+            stream_span.set_attribute("ttft", ttft)
+
+    return _finish(role, model, label, start, content, ttft, usage, logprobs, hedged)
+
+
+async def acomplete(messages: list, role: str = None, model: str = None, label: str = None,
+                    allow_stream: bool = True, **params) -> dict:
+    """
+    complete() 的 async 版本，参数与返回值相同。
+    排队、退避与网络等待都不占用线程；取消会传进正在进行的请求
+    (被合并的请求只有在所有等待者都取消后才会取消)。
+    """
+    if model is None:
+        model = router.model_for(role)
+    label = label or role or "llm"
+    key = _flight_key(model, messages, params, allow_stream)
+    with span("llm.call", model=model, role=role, label=label):
+        return await llm_flight.ado(key, lambda: _acomplete(messages, role, model, label, allow_stream, **params))
+
+
+async def _acomplete(messages: list, role: str, model: str, label: str, allow_stream: bool,
+                     **params) -> dict:
+    start = time.perf_counter()
+    logprobs = []
+
+    hedged = False
+
+    if not allow_stream or get_stream_handler() is None:
+        def make_request(attempt_model: str):
+            async def request():
+                with span("llm.request", model=attempt_model):
+                    return await async_client.chat.completions.create(
+                        model=attempt_model,
+                        messages=messages,
+                        **params
+                    )
+            return request
+
+        response, model, hedged = await hedger.arun(make_request, model, role)
+        content = response.choices[0].message.content
+        ttft = None
+        usage = response.usage
+        if params.get("logprobs"):
+            logprobs = _token_logprobs(response)
+    else:
+        with span("llm.stream", model=model) as stream_span:
+            content, ttft, usage = await _astream_content(model, messages, role, label, start, **params)
+            stream_span.set_attribute("ttft", ttft)
+
+    return _finish(role, model, label, start, content, ttft, usage, logprobs, hedged)
+
+
+def _finish(role: str, model: str, label: str, start: float, content: str, ttft, usage,
+            logprobs: list, hedged: bool = False) -> dict:
+    """记录路由统计与调用耗时，并组装返回值。"""
+    total_time = time.perf_counter() - start
+    prompt_tokens, completion_tokens = _usage_tokens(usage)
+    router.record(role or label, model, total_time, prompt_tokens, completion_tokens)
+    if hedged:
+        hedger.record_cost(model, prompt_tokens, completion_tokens)
+    record_call({
+        "label": label,
+        "model": model,
+        "streamed": ttft is not None,
+        "ttft": ttft,
+        "total_time": total_time,
+    })
+
+    return {
+        "content": content,
+        "model": model,
+        "ttft": ttft,
+        "total_time": total_time,
+        "logprobs": logprobs,
+    }
+
+
+def chat_completion(messages: list, role: str = None, model: str = None, label: str = None,
+                    **params) -> str:
+    """complete() 的简写，只返回回复文本。"""
+    return complete(messages, role=role, model=model, label=label, **params)["content"]
+
+
+async def achat_completion(messages: list, role: str = None, model: str = None, label: str = None,
+                           **params) -> str:
+    """acomplete() 的简写，只返回回复文本。"""
+    return (await acomplete(messages, role=role, model=model, label=label, **params))["content"]
@@ -0,0 +1,146 @@
+"""
+请求合并 (Single-flight Coalescing)
+并发的多个运行同时发出完全相同的请求 (相同模型、消息、参数，或相同的工具参数) 时，
+只有第一个 ("leader") 真正发出调用，其余 ("follower") 等待并共享它的结果。
+"""
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from src.observability import span
+
+
+def request_key(*parts: Any) -> str:
+    """把请求的各组成部分序列化为稳定的哈希键。"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _AsyncInFlight:
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    同一个 key 同时只允许一个调用在途。
+    leader 的异常同样会传给所有 follower。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, _InFlight] = {}
+        self._async_calls: Dict[Tuple[int, str], _AsyncInFlight] = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "saved": 0}
+
+    def do(self, key: str, fn: Callable):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InFlight()
+                self._calls[key] = call
+                self._stats["leaders"] += 1
+
+        if not is_leader:
+            with span("coalesce.wait", flight=self.name):
+                call.done.wait()
+            with self._lock:
+                self._stats["saved"] += 1
+            if call.error is not None:
+                raise call.error
+            return _copy(call.result)
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable]):
+        """
+        do() 的 async 版本 (只在同一个事件循环内合并)。
+        调用在一个共享的 task 中执行；某个等待者被取消不会影响其他等待者，
+        只有全部等待者都取消时才取消这个 task，从而取消正在进行的请求。
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        with self._lock:
+            call = self._async_calls.get(flight_key)
+            is_leader = call is None
+            if is_leader:
+                call = _AsyncInFlight(loop.create_task(fn()))
+                self._async_calls[flight_key] = call
+                self._stats["leaders"] += 1
+                call.task.add_done_callback(lambda _: self._forget(flight_key, call))
+            call.waiters += 1
+
+        try:
+            if is_leader:
+                result = await asyncio.shield(call.task)
+            else:
+                with span("coalesce.wait", flight=self.name):
+                    result = await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            with self._lock:
+                call.waiters -= 1
+                abandoned = call.waiters == 0
+                if abandoned and self._async_calls.get(flight_key) is call:
+                    # 之后到来的相同请求重新发起，而不是等一个正在取消的 task
+                    del self._async_calls[flight_key]
+            if abandoned:
+                call.task.cancel()
+            raise
+        except BaseException:
+            with self._lock:
+                call.waiters -= 1
+            raise
+
+        with self._lock:
+            call.waiters -= 1
+            if not is_leader:
+                self._stats["saved"] += 1
+        return result if is_leader else _copy(result)
+
+    def _forget(self, flight_key: Tuple[int, str], call: _AsyncInFlight):
+        with self._lock:
+            if self._async_calls.get(flight_key) is call:
+                del self._async_calls[flight_key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+def _copy(result):
+    # 防止 follower 修改 leader 返回的 dict / list
+    if isinstance(result, dict):
+        return dict(result)
+    if isinstance(result, list):
+        return list(result)
+    return result
+
+
+llm_flight = SingleFlight("llm")
+tool_flight = SingleFlight("tools")
+
+
+def get_coalescing_stats() -> dict:
+    """返回 {"llm": {...}, "tools": {...}}，其中 saved 是被省掉的调用次数。"""
+    return {flight.name: flight.stats() for flight in (llm_flight, tool_flight)}
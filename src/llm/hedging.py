@@ -0,0 +1,336 @@
+"""
+请求对冲 (Hedged Requests)
+免费模型的长尾延迟很不稳定：一次慢的评估会拖住整轮 ToT，一次慢的 generate_plan 会拖住规划。
+开启对冲后，如果一次调用在该模型近期延迟的某个分位数 (默认 p90) 内还没有返回，
+就向同一个模型 (或配置的备用模型) 再发一份相同的请求，先返回的获胜，另一个被取消
+(同步调用无法中断正在进行的HTTP请求，落败者的结果直接丢弃)。
+
+对冲预算限制额外请求的比例，从而限制额外花费；统计中给出 p99 的改善与对冲成本。
+流式调用不对冲 (首token已经推送给调用方)。
+
+可调的环境变量:
+    THINKFLOW_HEDGE               设为 1 时默认开启 (也可以用 --hedge 或 hedger.enable())
+    THINKFLOW_HEDGE_PERCENTILE    触发对冲的延迟分位数 (默认 0.9)
+    THINKFLOW_HEDGE_BUDGET        对冲请求最多占符合条件调用的比例 (默认 0.1)
+    THINKFLOW_HEDGE_ROLES         参与对冲的角色 (默认 generator,evaluator,evaluator_strong,planner,
+                                  orchestrator_generator,orchestrator_evaluator)
+    THINKFLOW_HEDGE_MODEL_<ROLE>  对冲请求使用的备用模型 (默认与原请求相同)
+"""
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from src.observability import span
+from .routing import estimate_cost
+from .scheduler import get_scheduler
+
+load_dotenv()
+
+HEDGE_ENABLED = os.environ.get("THINKFLOW_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("THINKFLOW_HEDGE_PERCENTILE", "0.9"))
+HEDGE_BUDGET = float(os.environ.get("THINKFLOW_HEDGE_BUDGET", "0.1"))
+HEDGE_ROLES = os.environ.get(
+    "THINKFLOW_HEDGE_ROLES",
+    "generator,evaluator,evaluator_strong,planner,orchestrator_generator,orchestrator_evaluator",
+)
+
+# 每个模型保留的近期延迟样本数；样本不足时不对冲
+HISTORY_SIZE = 200
+MIN_SAMPLES = 10
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """最近秩法求分位数，values 为空时返回 None。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    # 四舍五入到9位小数，避免 0.7 * 10 = 7.000000000000001 这样的浮点误差多进一位
+    index = min(len(ordered) - 1, max(0, math.ceil(round(p * len(ordered), 9)) - 1))
+    return ordered[index]
+
+
+class LatencyTracker:
+    """按模型记录近期的请求延迟 (不含排队时间)。"""
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self.size = size
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model: str, latency: float):
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.size)).append(latency)
+
+    def percentile(self, model: str, p: float, min_samples: int = MIN_SAMPLES) -> Optional[float]:
+        with self._lock:
+            samples = list(self._samples.get(model, ()))
+        if len(samples) < min_samples:
+            return None
+        return percentile(samples, p)
+
+
+class HedgeSuperseded(Exception):
+    """同步对冲中另一份请求已经获胜，这份请求不再发送"""
+
+
+class _Attempt:
+    """一次实际发出的请求：记下它真正开始发送 (排队结束) 的时间。"""
+
+    def __init__(self, model: str, hedge: bool):
+        self.model = model
+        self.hedge = hedge
+        self.start: Optional[float] = None
+        self.started = threading.Event()
+
+    def begin(self):
+        self.start = time.perf_counter()
+        self.started.set()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start if self.start is not None else 0.0
+
+
+def _hedge_span(state: _Attempt):
+    # 只为对冲请求单独记一个 span，主请求沿用外层的 llm.call
+    return span("llm.hedge", model=state.model) if state.hedge else nullcontext()
+
+
+class Hedger:
+    """
+    对冲策略本体。run() / arun() 接收 make_send(model)，它返回一个真正发出请求的函数；
+    每次尝试都经过限流调度器。返回 (response, 获胜的模型, 是否发出了对冲请求)。
+    """
+
+    def __init__(self, enabled: bool = HEDGE_ENABLED, percentile: float = HEDGE_PERCENTILE,
+                 budget: float = HEDGE_BUDGET, roles: str = HEDGE_ROLES):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.budget = budget
+        self.roles = {role.strip() for role in roles.split(",") if role.strip()}
+        self.latency = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+        self._lock = threading.Lock()
+        self._stats = {
+            "calls": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "budget_denied": 0,
+            "hedge_cost": 0.0,
+        }
+        # 符合条件的调用的端到端延迟 (对冲后)
+        self._latencies: deque = deque(maxlen=5000)
+        # 单个请求的延迟 (不对冲时每次调用就是一个请求)；被取消的请求记其已等待时间 (下界)
+        self._single: deque = deque(maxlen=5000)
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def fallback_model(self, role: Optional[str], model: str) -> str:
+        if role:
+            override = os.environ.get(f"THINKFLOW_HEDGE_MODEL_{role.upper()}")
+            if override:
+                return override
+        return model
+
+    def _eligible(self, role: Optional[str]) -> bool:
+        return self.enabled and role in self.roles
+
+    def _trigger(self, model: str) -> Optional[float]:
+        return self.latency.percentile(model, self.percentile)
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self._stats["hedged"] + 1 > self.budget * self._stats["calls"]:
+                self._stats["budget_denied"] += 1
+                return False
+            self._stats["hedged"] += 1
+            return True
+
+    def _count_call(self):
+        with self._lock:
+            self._stats["calls"] += 1
+
+    def _observe_attempt(self, state: _Attempt, completed: bool):
+        if state.start is None:
+            return
+        latency = state.elapsed()
+        if completed:
+            self.latency.observe(state.model, latency)
+        with self._lock:
+            self._single.append(latency)
+
+    def _finish(self, primary: _Attempt, winner: _Attempt):
+        with self._lock:
+            self._latencies.append(primary.elapsed())
+            if winner.hedge:
+                self._stats["hedge_wins"] += 1
+
+    def record_cost(self, model: str, prompt_tokens: int, completion_tokens: int):
+        """
+        估算一次对冲带来的额外花费：两份请求相同，按获胜响应的token数多计一份。
+        (被取消的请求实际只会按已生成的部分计费，所以这是上界。)
+        """
+        with self._lock:
+            self._stats["hedge_cost"] += estimate_cost(model, prompt_tokens, completion_tokens)
+
+    # --- 同步 ---
+
+    def run(self, make_send: Callable[[str], Callable], model: str, role: Optional[str] = None):
+        """在调度器的保护下发出请求；必要时对冲。"""
+        scheduler = get_scheduler()
+        if not self._eligible(role):
+            return scheduler.run(make_send(model), model, role), model, False
+
+        self._count_call()
+        # 一旦有请求获胜，其他请求不再发送，也不再重试
+        decided = threading.Event()
+
+        def attempt(state: _Attempt):
+            send = make_send(state.model)
+
+            def timed():
+                if decided.is_set():
+                    raise HedgeSuperseded(state.model)
+                state.begin()
+                response = send()
+                # 同步请求无法中断，落败者也会跑完，它的真实延迟照样记录
+                self._observe_attempt(state, completed=True)
+                return response
+
+            with _hedge_span(state):
+                return scheduler.run(timed, state.model, role, abandoned=decided.is_set)
+
+        primary = _Attempt(model, hedge=False)
+        primary_future = self._submit(attempt, primary)
+        futures = {primary_future: primary}
+
+        # 从真正发出请求 (排队结束) 开始计时
+        while not primary.started.wait(0.05):
+            if primary_future.done():
+                break
+
+        trigger = self._trigger(model)
+        if trigger is not None and not primary_future.done():
+            done, _ = wait([primary_future], timeout=max(0.0, trigger - primary.elapsed()))
+            if not done and self._take_budget():
+                hedge = _Attempt(self.fallback_model(role, model), hedge=True)
+                futures[self._submit(attempt, hedge)] = hedge
+
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                decided.set()
+                for loser in pending:
+                    loser.cancel()  # 还在排队的直接取消；已发出的请求结果被丢弃
+                winner = futures[future]
+                self._finish(primary, winner)
+                return response, winner.model, len(futures) > 1
+        raise error
+
+    def _submit(self, fn: Callable, state: _Attempt):
+        ctx = contextvars.copy_context()
+        return self._executor.submit(ctx.run, fn, state)
+
+    # --- async ---
+
+    async def arun(self, make_send: Callable[[str], Callable[[], Awaitable]], model: str,
+                   role: Optional[str] = None):
+        """run() 的 async 版本：落败的请求会被真正取消。"""
+        scheduler = get_scheduler()
+        if not self._eligible(role):
+            return await scheduler.arun(make_send(model), model, role), model, False
+
+        self._count_call()
+
+        async def attempt(state: _Attempt):
+            send = make_send(state.model)
+
+            async def timed():
+                state.begin()
+                try:
+                    response = await send()
+                except asyncio.CancelledError:
+                    self._observe_attempt(state, completed=False)
+                    raise
+                self._observe_attempt(state, completed=True)
+                return response
+
+            with _hedge_span(state):
+                return await scheduler.arun(timed, state.model, role)
+
+        primary = _Attempt(model, hedge=False)
+        primary_task = asyncio.ensure_future(attempt(primary))
+        tasks = {primary_task: primary}
+
+        try:
+            while not primary.started.is_set() and not primary_task.done():
+                await asyncio.sleep(0.01)
+
+            trigger = self._trigger(model)
+            if trigger is not None and not primary_task.done():
+                done, _ = await asyncio.wait({primary_task}, timeout=max(0.0, trigger - primary.elapsed()))
+                if not done and self._take_budget():
+                    hedge = _Attempt(self.fallback_model(role, model), hedge=True)
+                    tasks[asyncio.ensure_future(attempt(hedge))] = hedge
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    winner = tasks[task]
+                    self._finish(primary, winner)
+                    return task.result(), winner.model, len(tasks) > 1
+            raise error
+        finally:
+            # 获胜者已返回、出错或调用方被取消：取消所有仍在进行的请求
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        """
+        返回对冲统计。p99 是符合条件调用的端到端延迟 (从主请求发出算起)；
+        p99_without_hedging 用单个请求的延迟估计不对冲时的情况
+        (被取消的请求只知道下界，所以改善值偏保守)。
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            latencies = list(self._latencies)
+            single = list(self._single)
+        stats["enabled"] = self.enabled
+        stats["p50"] = percentile(latencies, 0.5)
+        stats["p99"] = percentile(latencies, 0.99)
+        stats["p99_without_hedging"] = percentile(single, 0.99)
+        if stats["p99"] is not None and stats["p99_without_hedging"] is not None:
+            stats["p99_improvement"] = stats["p99_without_hedging"] - stats["p99"]
+        else:
+            stats["p99_improvement"] = None
+        stats["hedge_rate"] = stats["hedged"] / stats["calls"] if stats["calls"] else 0.0
+        return stats
+
+
+hedger = Hedger()
+
+
+def get_hedge_stats() -> dict:
+    return hedger.stats()
@@ -0,0 +1,132 @@
+"""
+模型路由 (Model Routing)
+按"角色"而不是在各模块里硬编码模型名；并提供"先便宜、后升级"的评估升级策略。
+
+每个角色的模型可以用环境变量覆盖，例如:
+    THINKFLOW_MODEL_EVALUATOR=google/gemini-2.5-flash
+    THINKFLOW_MODEL_EVALUATOR_STRONG=openai/gpt-4o-mini
+    THINKFLOW_MODEL_ORCHESTRATOR_EVALUATOR=google/gemini-2.5-flash-lite-preview-09-2025
+没有指定角色 (也没有指定模型) 的调用使用 "default" 角色 (THINKFLOW_MODEL_DEFAULT)。
+"""
+import os
+import threading
+from typing import Dict, Optional, TypedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_ROLE_MODELS = {
+    "generator": "google/gemini-2.5-flash-lite-preview-09-2025",
+    "evaluator": "google/gemini-2.5-flash-lite-preview-09-2025",
+    "evaluator_strong": "google/gemini-2.5-flash",
+    "planner": "meta-llama/llama-4-maverick:free",
+    "deep_think": "meta-llama/llama-4-maverick:free",
+    "vision": "meta-llama/llama-4-maverick:free",
+    "agent": "meta-llama/llama-4-maverick:free",
+    # 协调器版本 (tot_orchestrator.py) 沿用原来的模型，与 LangGraph 版本分开配置
+    "orchestrator_generator": "nvidia/nemotron-nano-12b-v2-vl:free",
+    "orchestrator_evaluator": "nvidia/nemotron-nano-12b-v2-vl:free",
+    "default": "meta-llama/llama-4-maverick:free",
+}
+
+DEFAULT_ROLE = "default"
+
+# 每百万token的美元价格 (输入, 输出)；":free" 模型与未知模型按0计
+MODEL_PRICES = {
+    "google/gemini-2.5-flash-lite-preview-09-2025": (0.10, 0.40),
+    "google/gemini-2.5-flash": (0.30, 2.50),
+}
+
+# 分数距离质量阈值在此范围内 (含) 时，交给更强的模型复评
+ESCALATION_MARGIN = float(os.environ.get("THINKFLOW_ESCALATION_MARGIN", "1"))
+
+
+class RouteStats(TypedDict):
+    """单个 (角色, 模型) 路由的累计统计"""
+    role: str
+    model: str
+    calls: int
+    total_latency: float
+    prompt_tokens: int
+    completion_tokens: int
+    cost: float
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+class ModelRouter:
+    """
+    角色 -> 模型 的路由表，同时记录每条路由的延迟与成本。
+    """
+
+    def __init__(self, role_models: Optional[Dict[str, str]] = None,
+                 escalation_margin: float = ESCALATION_MARGIN):
+        self.role_models = dict(DEFAULT_ROLE_MODELS)
+        if role_models:
+            self.role_models.update(role_models)
+        self.escalation_margin = escalation_margin
+        self._stats: Dict[tuple, RouteStats] = {}
+        self._lock = threading.Lock()
+
+    def model_for(self, role: Optional[str]) -> str:
+        """返回角色对应的模型；环境变量 THINKFLOW_MODEL_<ROLE> 优先。role 为空时使用默认角色。"""
+        role = role or DEFAULT_ROLE
+        override = os.environ.get(f"THINKFLOW_MODEL_{role.upper()}")
+        if override:
+            return override
+        if role not in self.role_models:
+            raise KeyError(f"未知的模型角色: {role}")
+        return self.role_models[role]
+
+    def set_model(self, role: str, model: str):
+        self.role_models[role] = model
+
+    def should_escalate(self, score: float, threshold: float) -> bool:
+        """
+        分数落在阈值附近 (|score - threshold| <= margin) 时才需要强模型复评；
+        明显通过或明显不及格的留在便宜模型上。
+        """
+        return abs(score - threshold) <= self.escalation_margin
+
+    def record(self, role: str, model: str, latency: float,
+               prompt_tokens: int = 0, completion_tokens: int = 0):
+        key = (role, model)
+        with self._lock:
+            stats = self._stats.setdefault(key, {
+                "role": role,
+                "model": model,
+                "calls": 0,
+                "total_latency": 0.0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cost": 0.0,
+            })
+            stats["calls"] += 1
+            stats["total_latency"] += latency
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["cost"] += estimate_cost(model, prompt_tokens, completion_tokens)
+
+    def stats(self) -> list:
+        """返回每条路由的统计副本，附带平均延迟。"""
+        with self._lock:
+            result = []
+            for stats in self._stats.values():
+                item = dict(stats)
+                item["avg_latency"] = stats["total_latency"] / stats["calls"]
+                result.append(item)
+            return result
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+
+router = ModelRouter()
+
+
+def get_route_stats() -> list:
+    return router.stats()
@@ -0,0 +1,458 @@
+"""
+限流与重试调度器 (Rate Limit Scheduler)
+所有LLM调用都经由同一个调度器:
+  - 按模型、按提供商 (模型名 "/" 前的部分) 的令牌桶限流
+  - 按角色的优先级排队，生成者不会被评估者的突发请求饿死
+  - 遇到 429 / 5xx / 网络错误时重试: 优先遵守 Retry-After，否则指数退避 + 随机抖动
+  - 统计排队等待时间与被限流 (429) 次数
+  - 同步调用 (run) 与 async 调用 (arun) 共用同一组令牌桶和等待队列
+  - 回放 cassette 时 (见 cassette.py) 不访问网络，跳过令牌等待，重试退避按 latency_scale 缩放
+
+可调的环境变量:
+    THINKFLOW_RPM_PER_MODEL      每个模型每分钟请求数 (默认 20，OpenRouter免费模型的限额)
+    THINKFLOW_RPM_PER_PROVIDER   每个提供商每分钟请求数 (默认 60)
+    THINKFLOW_MAX_RETRIES        最多重试次数 (默认 5)
+"""
+import asyncio
+import bisect
+import email.utils
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import openai
+from dotenv import load_dotenv
+
+from src.observability import log, span
+
+from .cassette import Cassette, get_cassette
+
+load_dotenv()
+
+RPM_PER_MODEL = float(os.environ.get("THINKFLOW_RPM_PER_MODEL", "20"))
+RPM_PER_PROVIDER = float(os.environ.get("THINKFLOW_RPM_PER_PROVIDER", "60"))
+MAX_RETRIES = int(os.environ.get("THINKFLOW_MAX_RETRIES", "5"))
+
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# 排在别人后面时，最多等这么久就重新检查一次 (正常情况下由前面的等待者离开时唤醒)
+IDLE_RECHECK = 0.5
+
+# 数字越小越先被服务
+ROLE_PRIORITIES = {
+    "generator": 0,
+    "planner": 0,
+    "agent": 0,
+    "deep_think": 1,
+    "vision": 1,
+    "evaluator": 2,
+    "evaluator_strong": 2,
+    "orchestrator_generator": 0,
+    "orchestrator_evaluator": 2,
+}
+DEFAULT_PRIORITY = 1
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class RetryableResponse(Exception):
+    """HTTP层收到可重试的响应 (供 SchedulingTransport 使用)"""
+
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+        self.status_code = response.status_code
+
+
+class TokenBucket:
+    """
+    经典令牌桶：容量 capacity，每秒补充 rate 个令牌。
+    blocked_until 用于在收到 429 + Retry-After 后整体暂停。
+    """
+
+    def __init__(self, rpm: float, capacity: Optional[float] = None):
+        self.rate = rpm / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, rpm / 4)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """距离可以取到一个令牌还需要等待的秒数 (0 表示现在就可以)。"""
+        self._refill(now)
+        blocked = max(0.0, self.blocked_until - now)
+        if self.tokens >= 1:
+            return blocked
+        return max(blocked, (1 - self.tokens) / self.rate)
+
+    def consume(self):
+        self.tokens -= 1
+
+    def block(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+
+
+def provider_of(model: str) -> str:
+    return model.split("/", 1)[0] if "/" in model else model
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    return getattr(error, "status_code", None)
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return True
+    return _status_code(error) in RETRYABLE_STATUS
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """从 Retry-After (秒数或HTTP日期) 中解析需要等待的秒数。"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def _replaying() -> Optional[Cassette]:
+    """正在回放的 cassette；回放时响应来自本地文件，令牌桶限流没有意义。"""
+    cassette = get_cassette()
+    return cassette if cassette is not None and cassette.mode == "replay" else None
+
+
+def backoff_delay(attempt: int) -> float:
+    """指数退避 + 全抖动 (full jitter)。"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+class RateLimitScheduler:
+    """
+    调度器本体。run() 会阻塞直到取得令牌 (按优先级排队)，
+    然后执行调用，并在可重试的错误上自动重试。
+    """
+
+    def __init__(self, rpm_per_model: float = RPM_PER_MODEL,
+                 rpm_per_provider: float = RPM_PER_PROVIDER,
+                 max_retries: int = MAX_RETRIES):
+        self.rpm_per_model = rpm_per_model
+        self.rpm_per_provider = rpm_per_provider
+        self.max_retries = max_retries
+        self._model_buckets: Dict[str, TokenBucket] = {}
+        self._provider_buckets: Dict[str, TokenBucket] = {}
+        # 每个提供商的等待者，按 (优先级, 先来后到) 保持有序
+        self._waiters: Dict[str, List[tuple]] = {}
+        # async 等待者的唤醒函数 (线程安全地 set 它在事件循环里的 asyncio.Event)
+        self._wakers: Dict[tuple, Callable[[], None]] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stats = {
+            "calls": 0,
+            "throttled": 0,
+            "retries": 0,
+            "failures": 0,
+            "queue_wait_total": 0.0,
+            "queue_wait_max": 0.0,
+        }
+
+    def _buckets(self, model: str):
+        provider = provider_of(model)
+        if model not in self._model_buckets:
+            self._model_buckets[model] = TokenBucket(self.rpm_per_model)
+        if provider not in self._provider_buckets:
+            self._provider_buckets[provider] = TokenBucket(self.rpm_per_provider)
+        return self._model_buckets[model], self._provider_buckets[provider]
+
+    def _poll(self, entry: tuple) -> tuple:
+        """
+        检查 entry 现在能否取到令牌 (调用方需持有 self._cond)。
+        同一提供商的等待者按 (优先级, 先来后到) 排序；
+        排在前面的等待者只要自己的模型桶可用，就先于后面的等待者取令牌。
+        返回 (是否已取到令牌, 建议的等待秒数或 None)。
+        """
+        now = time.monotonic()
+        model, provider = entry[2], entry[3]
+        model_bucket, provider_bucket = self._buckets(model)
+
+        for waiter in self._waiters.get(provider, ()):
+            waiter_model_bucket, _ = self._buckets(waiter[2])
+            model_wait = waiter_model_bucket.wait_time(now)
+            if model_wait > 0:
+                if waiter is entry:
+                    return False, model_wait
+                continue
+            # 第一个模型桶可用的等待者有资格取令牌
+            if waiter is entry:
+                provider_wait = provider_bucket.wait_time(now)
+                if provider_wait <= 0:
+                    model_bucket.consume()
+                    provider_bucket.consume()
+                    self._remove_waiter(entry)
+                    return True, None
+                return False, provider_wait
+            break
+        return False, None
+
+    def _add_waiter(self, entry: tuple):
+        bisect.insort(self._waiters.setdefault(entry[3], []), entry)
+
+    def _remove_waiter(self, entry: tuple):
+        self._wakers.pop(entry, None)
+        waiters = self._waiters.get(entry[3], [])
+        index = bisect.bisect_left(waiters, entry)
+        if index < len(waiters) and waiters[index] == entry:
+            del waiters[index]
+            self._wake(entry[3])
+
+    def _wake(self, provider: str):
+        """排队情况变化后，唤醒该提供商下的同步与 async 等待者 (调用方需持有 self._cond)。"""
+        self._cond.notify_all()
+        for waiter in self._waiters.get(provider, ()):
+            wake = self._wakers.get(waiter)
+            if wake is not None:
+                wake()
+
+    def _record_wait(self, start: float) -> float:
+        waited = time.monotonic() - start
+        self._stats["queue_wait_total"] += waited
+        self._stats["queue_wait_max"] = max(self._stats["queue_wait_max"], waited)
+        return waited
+
+    def acquire(self, model: str, priority: int = DEFAULT_PRIORITY) -> float:
+        """
+        排队等待一个令牌，返回排队等待的秒数。
+        """
+        start = time.monotonic()
+        entry = (priority, next(self._seq), model, provider_of(model))
+
+        with self._cond:
+            self._add_waiter(entry)
+            while True:
+                acquired, timeout = self._poll(entry)
+                if acquired:
+                    return self._record_wait(start)
+                self._cond.wait(timeout if timeout is not None else IDLE_RECHECK)
+
+    async def aacquire(self, model: str, priority: int = DEFAULT_PRIORITY) -> float:
+        """
+        acquire() 的 async 版本：与线程共用同一个等待队列和令牌桶，
+        等待期间让出事件循环：令牌桶需要补充时按补充时间等待，排在别人后面时等前面的人离开队列的通知
+        (由离开的线程或协程经 call_soon_threadsafe 唤醒)；被取消时把自己移出队列。
+        """
+        start = time.monotonic()
+        entry = (priority, next(self._seq), model, provider_of(model))
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(woken.set)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+        with self._cond:
+            self._add_waiter(entry)
+            self._wakers[entry] = wake
+        try:
+            while True:
+                with self._cond:
+                    acquired, timeout = self._poll(entry)
+                    if acquired:
+                        return self._record_wait(start)
+                    woken.clear()
+                try:
+                    await asyncio.wait_for(woken.wait(), timeout if timeout is not None else IDLE_RECHECK)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                self._remove_waiter(entry)
+
+    def _penalize(self, model: str, delay: float):
+        """收到 429 后，让该模型的令牌桶整体暂停 delay 秒，避免其他调用继续撞墙。"""
+        with self._cond:
+            model_bucket, _ = self._buckets(model)
+            model_bucket.block(time.monotonic() + delay)
+            self._wake(provider_of(model))
+
+    def _retry_delay(self, error: Exception, model: str, attempt: int) -> Optional[float]:
+        """
+        调用失败后决定是否重试：返回需要等待的秒数，不应重试时返回 None。
+        """
+        if not is_retryable(error) or attempt >= self.max_retries:
+            with self._cond:
+                self._stats["failures"] += 1
+            return None
+
+        retry_after = retry_after_seconds(error)
+        delay = retry_after if retry_after is not None else backoff_delay(attempt)
+        with self._cond:
+            self._stats["retries"] += 1
+            if _status_code(error) == 429:
+                self._stats["throttled"] += 1
+        # 回放出来的 429 不代表真实的限流状态，不应让令牌桶暂停
+        if _status_code(error) == 429 and _replaying() is None:
+            self._penalize(model, delay)
+
+        log(f"--- [调度器] {model} 调用失败 ({error})，{delay:.1f}s 后第 {attempt + 1} 次重试 ---")
+        return delay
+
+    def run(self, fn: Callable, model: str, role: Optional[str] = None,
+            abandoned: Optional[Callable[[], bool]] = None):
+        """
+        在限流与重试的保护下执行 fn()。
+        重试耗尽后抛出最后一次的异常。
+        abandoned: 失败后检查，返回 True 时不再重试 (例如对冲中另一份请求已经获胜)。
+        """
+        priority = ROLE_PRIORITIES.get(role, DEFAULT_PRIORITY)
+        cassette = _replaying()
+        attempt = 0
+        while True:
+            if cassette is None:
+                with span("scheduler.queue", model=model, priority=priority, attempt=attempt) as queue_span:
+                    queue_span.set_attribute("wait", self.acquire(model, priority))
+            with self._cond:
+                self._stats["calls"] += 1
+            try:
+                return fn()
+            except Exception as e:
+                if abandoned is not None and abandoned():
+                    raise
+                delay = self._retry_delay(e, model, attempt)
+                if delay is None:
+                    raise
+                with span("scheduler.backoff", model=model, delay=delay, status=_status_code(e)):
+                    if cassette is None:
+                        time.sleep(delay)
+                    else:
+                        cassette.wait(delay)
+                # 退避期间被放弃的，不再为它取令牌
+                if abandoned is not None and abandoned():
+                    raise
+                attempt += 1
+
+    async def arun(self, fn: Callable[[], Awaitable], model: str, role: Optional[str] = None):
+        """
+        run() 的 async 版本：fn() 返回一个 awaitable。
+        排队与退避都不占用线程；取消会直接传进正在进行的请求。
+        """
+        priority = ROLE_PRIORITIES.get(role, DEFAULT_PRIORITY)
+        cassette = _replaying()
+        attempt = 0
+        while True:
+            if cassette is None:
+                with span("scheduler.queue", model=model, priority=priority, attempt=attempt) as queue_span:
+                    queue_span.set_attribute("wait", await self.aacquire(model, priority))
+            with self._cond:
+                self._stats["calls"] += 1
+            try:
+                return await fn()
+            except Exception as e:
+                delay = self._retry_delay(e, model, attempt)
+                if delay is None:
+                    raise
+                with span("scheduler.backoff", model=model, delay=delay, status=_status_code(e)):
+                    if cassette is None:
+                        await asyncio.sleep(delay)
+                    else:
+                        await cassette.asleep(delay)
+                attempt += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            return dict(self._stats)
+
+
+def _model_of(request: httpx.Request) -> str:
+    # 请求体在构造时已经完整写入，read() 不会发起IO
+    try:
+        return json.loads(request.read()).get("model", "unknown")
+    except Exception:
+        return "unknown"
+
+
+class SchedulingTransport(httpx.BaseTransport):
+    """
+    httpx 传输层包装：让不经过 complete() 的客户端 (如 LangChain 的 ChatOpenAI)
+    也走同一个调度器。模型名从请求体中读取。
+    """
+
+    def __init__(self, role: str, scheduler: Optional[RateLimitScheduler] = None,
+                 transport: Optional[httpx.BaseTransport] = None):
+        self.role = role
+        self.scheduler = scheduler or get_scheduler()
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        def send():
+            response = self.transport.handle_request(request)
+            if response.status_code in RETRYABLE_STATUS:
+                response.read()
+                raise RetryableResponse(response)
+            return response
+
+        try:
+            return self.scheduler.run(send, _model_of(request), self.role)
+        except RetryableResponse as e:
+            return e.response
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncSchedulingTransport(httpx.AsyncBaseTransport):
+    """SchedulingTransport 的 async 版本 (用于 ChatOpenAI 的 http_async_client)。"""
+
+    def __init__(self, role: str, scheduler: Optional[RateLimitScheduler] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.role = role
+        self.scheduler = scheduler or get_scheduler()
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        async def send():
+            response = await self.transport.handle_async_request(request)
+            if response.status_code in RETRYABLE_STATUS:
+                await response.aread()
+                raise RetryableResponse(response)
+            return response
+
+        try:
+            return await self.scheduler.arun(send, _model_of(request), self.role)
+        except RetryableResponse as e:
+            return e.response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+scheduler = RateLimitScheduler()
+
+
+def get_scheduler() -> RateLimitScheduler:
+    return scheduler
+
+
+def get_scheduler_stats() -> dict:
+    return scheduler.stats()
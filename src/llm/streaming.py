@@ -0,0 +1,168 @@
+"""
+流式输出 (Streaming)
+把LLM的增量token、LangGraph节点事件推送给调用方，并记录每次调用的首token时间(TTFT)与总耗时。
+
+使用方式:
+    with streaming(handler):          # 回调API
+        run_tot(problem)
+
+    for event in iter_events(run_tot, problem):   # 生成器API
+        ...
+
+    async for event in aiter_events(arun_tot, problem):   # async 生成器API
+        ...
+
+事件均为dict，用 "type" 区分:
+    {"type": "token",   "source": "tot.generate", "text": "..."}
+    {"type": "node",    "node": "evaluate", "update": {...}}
+    {"type": "metrics", "label": ..., "model": ..., "streamed": ..., "ttft": ..., "total_time": ...}
+    {"type": "result",  "value": ...}             # 仅 iter_events / aiter_events 产出
+"""
+import asyncio
+import contextvars
+import queue
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, Iterator, List, Optional, TypedDict
+
+StreamHandler = Callable[[dict], None]
+
+
+class CallMetrics(TypedDict):
+    """单次LLM调用的耗时记录 (单位: 秒)"""
+    label: str
+    model: str
+    streamed: bool
+    ttft: Optional[float]  # 非流式调用为 None
+    total_time: float
+
+
+_handler: contextvars.ContextVar[Optional[StreamHandler]] = contextvars.ContextVar(
+    "thinkflow_stream_handler", default=None
+)
+
+# 只保留最近的调用记录，长时间运行的进程 (批量运行、服务) 不会无限增长
+MAX_CALL_METRICS = 1000
+
+_call_metrics: Deque[CallMetrics] = deque(maxlen=MAX_CALL_METRICS)
+_metrics_lock = threading.Lock()
+
+
+def get_stream_handler() -> Optional[StreamHandler]:
+    """返回当前上下文中的事件回调；未开启流式时为 None。"""
+    return _handler.get()
+
+
+@contextmanager
+def streaming(handler: Optional[StreamHandler]):
+    """
+    在 with 块内开启流式输出，所有事件交给 handler。
+    handler 为 None 时不做任何改变，方便入口函数直接透传可选参数。
+    """
+    if handler is None:
+        yield
+        return
+    token = _handler.set(handler)
+    try:
+        yield
+    finally:
+        _handler.reset(token)
+
+
+def emit(event: dict):
+    """把事件交给当前回调 (如果有)。"""
+    handler = _handler.get()
+    if handler is not None:
+        handler(event)
+
+
+def record_call(metrics: CallMetrics):
+    """记录一次调用的耗时，并作为 "metrics" 事件推送。"""
+    with _metrics_lock:
+        _call_metrics.append(metrics)
+    emit({"type": "metrics", **metrics})
+
+
+def get_call_metrics() -> List[CallMetrics]:
+    """返回最近 MAX_CALL_METRICS 次调用的耗时记录。"""
+    with _metrics_lock:
+        return list(_call_metrics)
+
+
+def reset_call_metrics():
+    with _metrics_lock:
+        _call_metrics.clear()
+
+
+_DONE = object()
+
+
+def iter_events(func: Callable, *args, **kwargs) -> Iterator[dict]:
+    """
+    在后台线程中运行 func(*args, **kwargs)，并以生成器形式逐个产出其事件。
+    最后产出 {"type": "result", "value": 返回值}；func 抛出的异常会在这里重新抛出。
+    """
+    events: "queue.Queue" = queue.Queue()
+    outcome = {}
+
+    def worker():
+        try:
+            with streaming(events.put):
+                outcome["value"] = func(*args, **kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            events.put(_DONE)
+
+    ctx = contextvars.copy_context()
+    thread = threading.Thread(target=ctx.run, args=(worker,), daemon=True)
+    thread.start()
+
+    while True:
+        event = events.get()
+        if event is _DONE:
+            break
+        yield event
+
+    thread.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    yield {"type": "result", "value": outcome.get("value")}
+
+
+async def aiter_events(func: Callable[..., Awaitable], *args, **kwargs) -> AsyncIterator[dict]:
+    """
+    iter_events() 的 async 版本：在一个 task 中运行 await func(*args, **kwargs)，逐个产出其事件。
+    调用方提前退出 (或被取消) 时，运行中的 task 会被取消。
+    """
+    loop = asyncio.get_running_loop()
+    events: "asyncio.Queue" = asyncio.Queue()
+
+    def handler(event: dict):
+        # 事件也可能来自工作线程 (例如 LangChain 在线程池中执行的同步回调)
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    async def worker():
+        with streaming(handler):
+            return await func(*args, **kwargs)
+
+    task = asyncio.create_task(worker())
+    try:
+        while True:
+            getter = asyncio.ensure_future(events.get())
+            done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield getter.result()
+                continue
+            getter.cancel()
+            break
+
+        # 让已经排进事件循环的事件先入队
+        await asyncio.sleep(0)
+        while not events.empty():
+            yield events.get_nowait()
+        yield {"type": "result", "value": task.result()}
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,407 @@
+"""
+结构化输出 (Structured Output)
+在本地校验并修复模型返回的JSON，只有无法修复时才发起一次有针对性的重新请求。
+
+常见的可修复问题: Markdown代码块、JSON前后的说明文字、尾随逗号、单引号、
+Python字面量 (True/None)、被截断的数组/对象、"8/10" 形式的分数等。
+"""
+import json
+import re
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from src.observability import log, span
+from .client import achat_completion, chat_completion
+
+
+class StructuredOutputError(ValueError):
+    """模型输出无法解析或不符合约定的结构"""
+
+
+# --- 1. 本地修复 ---
+
+_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*(.*?)\s*(?:```|$)", re.DOTALL)
+_TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_PY_LITERAL_PATTERN = re.compile(r"True|False|None")
+
+
+def _strip_fences(text: str) -> str:
+    match = _FENCE_PATTERN.search(text)
+    return match.group(1) if match else text
+
+
+def _extract_block(text: str) -> str:
+    """从第一个 '{' 或 '[' 开始截取 (模型经常在JSON前后加说明文字)。"""
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        raise StructuredOutputError("回复中找不到JSON对象或数组")
+    return text[min(starts):]
+
+
+# 字符串之外出现的弯引号当作字符串定界符: 开引号 -> 可以结束该字符串的引号
+_CURLY_QUOTES = {"“": "”“", "”": "”“", "‘": "’‘", "’": "’‘"}
+
+
+def _normalize_quotes(text: str) -> str:
+    """
+    把单引号字符串与用弯引号 (“” ‘’) 定界的字符串改成双引号字符串，
+    并把字符串之外的 Python 字面量改成 JSON 字面量。
+    字符串内部的弯引号是内容 (例如 "考虑“预算”分配")，原样保留。
+    """
+    out = []
+    closers = None
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if closers:
+            if ch == "\\" and i + 1 < len(text):
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            if ch in closers:
+                closers = None
+                out.append('"')
+            elif ch == '"':
+                out.append('\\"')
+            else:
+                out.append(ch)
+        elif ch == '"':
+            # 标准的双引号字符串：原样复制到结束引号
+            end = _string_end(text, i)
+            out.append(text[i:end])
+            i = end
+            continue
+        elif ch == "'" or ch in _CURLY_QUOTES:
+            closers = "'" if ch == "'" else _CURLY_QUOTES[ch]
+            out.append('"')
+        else:
+            word = _PY_LITERAL_PATTERN.match(text, i)
+            if word and not (out and out[-1][-1:].isalnum()):
+                out.append(_PY_LITERALS[word.group(0)])
+                i += len(word.group(0))
+                continue
+            out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def _string_end(text: str, start: int) -> int:
+    """text[start] 是 '"'，返回结束引号之后的位置 (没有结束引号时返回文本末尾)。"""
+    i = start + 1
+    while i < len(text):
+        if text[i] == "\\":
+            i += 2
+        elif text[i] == '"':
+            return i + 1
+        else:
+            i += 1
+    return len(text)
+
+
+def _close_truncated(text: str) -> str:
+    """补全被截断的字符串、数组与对象。"""
+    stack = []
+    in_string = False
+    escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = text.rstrip().rstrip(",")
+    # 截断在 "key": 之后时丢掉这个不完整的键
+    text = re.sub(r',?\s*"[^"]*"\s*:\s*$', "", text)
+    return text + "".join(reversed(stack))
+
+
+def _cut_after_top_level(text: str) -> str:
+    """去掉完整顶层JSON之后的多余文字。"""
+    depth = 0
+    in_string = False
+    escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[:i + 1]
+    return text
+
+
+def repair_json(text: str) -> Tuple[object, bool]:
+    """
+    解析模型返回的JSON，必要时在本地修复。
+    返回 (数据, 是否经过修复)；无法修复时抛出 StructuredOutputError。
+    """
+    if text is None:
+        raise StructuredOutputError("回复为空")
+    try:
+        return json.loads(text), False
+    except (json.JSONDecodeError, TypeError):
+        pass
+
+    candidate = _extract_block(_strip_fences(text))
+    candidate = _normalize_quotes(candidate)
+    candidate = _cut_after_top_level(candidate)
+    candidate = _close_truncated(candidate)
+    candidate = _TRAILING_COMMA_PATTERN.sub(r"\1", candidate)
+    try:
+        return json.loads(candidate), True
+    except json.JSONDecodeError as e:
+        raise StructuredOutputError(f"JSON无法修复: {e}")
+
+
+# --- 2. 结构校验 (validator: 接收原始文本，返回规范化后的dict) ---
+
+_SCORE_PATTERN = re.compile(r"(-?\d+(?:\.\d+)?)\s*(?:/\s*10)?")
+_SCORE_FIELD_PATTERN = re.compile(r"[\"']?score[\"']?\s*[:=]\s*[\"']?(-?\d+(?:\.\d+)?)")
+_REASON_FIELD_PATTERN = re.compile(r"[\"']?reason[\"']?\s*[:=]\s*[\"']([^\"']*)")
+
+
+def _coerce_score(value) -> float:
+    if isinstance(value, bool):
+        raise StructuredOutputError("score 必须是0到10之间的数字")
+    if isinstance(value, list) and len(value) == 1:
+        value = value[0]
+    if isinstance(value, str):
+        match = _SCORE_PATTERN.search(value)
+        if not match:
+            raise StructuredOutputError(f"score 不是数字: {value!r}")
+        value = float(match.group(1))
+    if not isinstance(value, (int, float)):
+        raise StructuredOutputError(f"score 不是数字: {value!r}")
+    if not 0 <= value <= 10:
+        raise StructuredOutputError(f"score 超出0到10的范围: {value}")
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def _as_text(item) -> str:
+    if isinstance(item, str):
+        return item.strip()
+    if isinstance(item, dict):
+        for key in ("thought", "content", "step", "text", "task"):
+            if isinstance(item.get(key), str):
+                return item[key].strip()
+    return json.dumps(item, ensure_ascii=False)
+
+
+def thoughts_validator(k: int) -> Callable[[str], dict]:
+    """{"thoughts": [恰好 k 个字符串]}；多于 k 个时截断，少于 k 个时视为无法修复。"""
+
+    def validate(text: str) -> dict:
+        data, _ = repair_json(text)
+        thoughts = data.get("thoughts") if isinstance(data, dict) else data
+        if not isinstance(thoughts, list):
+            raise StructuredOutputError('缺少 "thoughts" 列表')
+        thoughts = [t for t in (_as_text(item) for item in thoughts) if t]
+        if len(thoughts) < k:
+            raise StructuredOutputError(f'"thoughts" 只有 {len(thoughts)} 个，需要恰好 {k} 个')
+        return {"thoughts": thoughts[:k]}
+
+    return validate
+
+
+_ANSWER_ID_PATTERN = re.compile(r"^(?:问题|question|q)?\s*[#＃]?\s*(\d+)\s*[.:：、]?$", re.IGNORECASE)
+
+
+def _answer_id(value) -> str:
+    """模型经常照抄题目里的 "问题 9"：带前缀的编号归一成纯数字。"""
+    text = str(value).strip()
+    match = _ANSWER_ID_PATTERN.match(text)
+    return match.group(1) if match else text
+
+
+def answers_validator(ids: List[str]) -> Callable[[str], dict]:
+    """
+    {"answers": {id: str, ...}} 或 {"answers": [{"id": ..., "answer": str}, ...]}，
+    返回 {"answers": {id: answer}}；"问题 9" 这样的编号按 "9" 处理。
+    只保留 ids 中的条目；允许缺少一部分 (由调用方单独补问)，一个都没有时视为无法修复。
+    """
+    wanted = {str(i) for i in ids}
+
+    def validate(text: str) -> dict:
+        data, _ = repair_json(text)
+        items = data.get("answers") if isinstance(data, dict) else data
+        if isinstance(items, dict):
+            items = [{"id": key, "answer": value} for key, value in items.items()]
+        if not isinstance(items, list):
+            raise StructuredOutputError('缺少 "answers" 列表')
+        answers = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            item_id = _answer_id(item.get("id", ""))
+            answer = _as_text(item.get("answer", ""))
+            if item_id in wanted and answer:
+                answers[item_id] = answer
+        if not answers:
+            raise StructuredOutputError(f'"answers" 中没有可用的回答 (需要的id: {sorted(wanted)})')
+        return {"answers": answers}
+
+    return validate
+
+
+def validate_score(text: str) -> dict:
+    """{"score": 0-10, "reason": str}；JSON 完全损坏时从文本中提取 score 字段。"""
+    try:
+        data, _ = repair_json(text)
+    except StructuredOutputError:
+        match = _SCORE_FIELD_PATTERN.search(text or "")
+        if not match:
+            raise
+        reason = _REASON_FIELD_PATTERN.search(text)
+        data = {"score": match.group(1), "reason": reason.group(1) if reason else ""}
+
+    if isinstance(data, (int, float, str)) and not isinstance(data, bool):
+        data = {"score": data}
+    if not isinstance(data, dict) or "score" not in data:
+        raise StructuredOutputError('缺少 "score" 字段')
+    result = dict(data)
+    result["score"] = _coerce_score(data["score"])
+    result["reason"] = str(data.get("reason", "")).strip()
+    return result
+
+
+def validate_plan(text: str) -> dict:
+    """{"plan": [非空的字符串任务列表]}"""
+    data, _ = repair_json(text)
+    plan = data.get("plan") if isinstance(data, dict) else data
+    if not isinstance(plan, list):
+        raise StructuredOutputError('缺少 "plan" 列表')
+    plan = [t for t in (_as_text(item) for item in plan) if t]
+    if not plan:
+        raise StructuredOutputError('"plan" 为空')
+    return {"plan": plan}
+
+
+# --- 3. 调用 + 校验 + 有针对性的重新请求 ---
+
+_stats = {"calls": 0, "clean": 0, "repaired": 0, "rerequested": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def _changed(raw, value) -> bool:
+    """
+    校验结果中的值是否是从原始值改动而来。只比较校验器产出的字段：
+    补上的默认值 (原始回复里没有的键)、被丢弃的多余键与多余列表项都不算改动。
+    """
+    if isinstance(value, dict):
+        if not isinstance(raw, dict):
+            return True
+        return any(key in raw and _changed(raw[key], item) for key, item in value.items())
+    if isinstance(value, list):
+        if not isinstance(raw, list) or len(raw) < len(value):
+            return True
+        return any(_changed(r, v) for r, v in zip(raw, value))
+    if isinstance(value, str):
+        return not isinstance(raw, str) or raw.strip() != value
+    return isinstance(raw, bool) != isinstance(value, bool) or raw != value
+
+
+def _was_repaired(text: str, result: dict) -> bool:
+    """原始回复无法直接解析，或校验时不得不改动其中的值 (例如 "8/10" 被转成 8)，才算修复。"""
+    try:
+        raw = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return True
+    return _changed(raw, result)
+
+
+def complete_structured(messages: List[dict], validator: Callable[[str], dict],
+                        max_rerequests: int = 1, **params) -> dict:
+    """
+    调用模型并用 validator 校验/修复回复。
+    只有本地无法修复时，才把错误原因告诉模型并重新请求 (最多 max_rerequests 次)。
+    其余参数原样传给 chat_completion()；仍然失败时抛出 StructuredOutputError。
+    """
+    _count("calls")
+    messages = list(messages)
+    error: Optional[StructuredOutputError] = None
+
+    for attempt in range(max_rerequests + 1):
+        if attempt > 0:
+            _count("rerequested")
+            log(f"    (结构化输出无法修复: {error}，重新请求...)")
+        content = chat_completion(messages, **params)
+        try:
+            return _accept(content, validator, attempt)
+        except StructuredOutputError as e:
+            error = e
+            messages = _with_correction(messages, content, e)
+
+    _count("failed")
+    raise error
+
+
+async def acomplete_structured(messages: List[dict], validator: Callable[[str], dict],
+                               max_rerequests: int = 1, **params) -> dict:
+    """complete_structured() 的 async 版本，其余参数原样传给 achat_completion()。"""
+    _count("calls")
+    messages = list(messages)
+    error: Optional[StructuredOutputError] = None
+
+    for attempt in range(max_rerequests + 1):
+        if attempt > 0:
+            _count("rerequested")
+            log(f"    (结构化输出无法修复: {error}，重新请求...)")
+        content = await achat_completion(messages, **params)
+        try:
+            return _accept(content, validator, attempt)
+        except StructuredOutputError as e:
+            error = e
+            messages = _with_correction(messages, content, e)
+
+    _count("failed")
+    raise error
+
+
+def _accept(content: str, validator: Callable[[str], dict], attempt: int) -> dict:
+    with span("json.validate", attempt=attempt):
+        result = validator(content)
+    _count("repaired" if _was_repaired(content, result) else "clean")
+    return result
+
+
+def _with_correction(messages: List[dict], content: str, error: StructuredOutputError) -> List[dict]:
+    """把无法修复的回复和错误原因追加到对话中，供重新请求使用。"""
+    return messages + [
+        {"role": "assistant", "content": content or ""},
+        {"role": "user", "content": f"你的上一条回复不符合要求: {error}。请只输出符合要求格式的JSON，不要包含任何其他文字。"},
+    ]
+
+
+def get_structured_stats() -> dict:
+    """返回结构化输出的统计，附带修复率与重新请求率。"""
+    with _stats_lock:
+        stats = dict(_stats)
+    calls = stats["calls"] or 1
+    stats["repair_rate"] = stats["repaired"] / calls
+    stats["rerequest_rate"] = stats["rerequested"] / calls
+    return stats
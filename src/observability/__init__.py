@@ -0,0 +1,42 @@
+"""可观测性模块：分层延迟追踪与紧凑运行事件"""
+from .tracing import (
+    span,
+    start_span,
+    traced,
+    enable_tracing,
+    disable_tracing,
+    is_tracing_enabled,
+    export_chrome_trace,
+    get_trace_records,
+    reset_trace
+)
+from .events import (
+    emit_event,
+    configure_events,
+    close_events,
+    run_scope,
+    log,
+    is_quiet,
+    ConsoleSink,
+    JsonlSink
+)
+
+__all__ = [
+    "span",
+    "start_span",
+    "traced",
+    "enable_tracing",
+    "disable_tracing",
+    "is_tracing_enabled",
+    "export_chrome_trace",
+    "get_trace_records",
+    "reset_trace",
+    "emit_event",
+    "configure_events",
+    "close_events",
+    "run_scope",
+    "log",
+    "is_quiet",
+    "ConsoleSink",
+    "JsonlSink"
+]
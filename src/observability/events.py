@@ -0,0 +1,173 @@
+"""
+紧凑的运行事件 (Run Events)
+代替每一步打印完整状态：每个事件只携带发生变化的部分
+(新增的思想id、分数更新、步骤切换、路由决策等)，交给一个或多个 sink 处理。
+
+    configure_events(quiet=True, jsonl_path="run.jsonl")
+
+- 默认: ConsoleSink，每个事件一行摘要
+- quiet: 不再向终端输出事件，也关闭引擎里的逐步日志 (log())
+- jsonl_path: JsonlSink，事件进入内存队列，由后台线程批量写入，调用方不会被磁盘I/O阻塞
+
+没有任何 sink 时 emit_event() 立即返回。
+"""
+import contextvars
+import json
+import queue
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+# 事件类型
+RUN_START = "run_start"
+RUN_END = "run_end"
+STEP = "step"
+THOUGHTS_ADDED = "thoughts_added"
+SCORE = "score"
+DECISION = "decision"
+SELECTED = "selected"
+PLAN = "plan"
+PLAN_STEP = "plan_step"
+
+_run_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "thinkflow_run_id", default=None
+)
+
+
+class ConsoleSink:
+    """每个事件打印一行紧凑摘要"""
+
+    MAX_TEXT = 60
+
+    def handle(self, event: dict):
+        fields = []
+        for key, value in event.items():
+            if key in ("type", "ts", "run"):
+                continue
+            if isinstance(value, list):
+                value = f"[{len(value)}项]"
+            elif isinstance(value, str) and len(value) > self.MAX_TEXT:
+                value = value[:self.MAX_TEXT] + "…"
+            fields.append(f"{key}={value}")
+        print(f"  · [{event['type']}] " + " ".join(fields))
+
+    def close(self):
+        pass
+
+
+class JsonlSink:
+    """
+    缓冲、非阻塞的 JSONL 写入器。
+    队列满时丢弃事件并计数，而不是阻塞调用方。
+    """
+
+    _CLOSE = object()
+
+    def __init__(self, path: str, max_queue: int = 10000, batch_size: int = 256):
+        self.path = path
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._file = open(path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._writer, name="thinkflow-events", daemon=True)
+        self._thread.start()
+
+    def handle(self, event: dict):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def _writer(self):
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = any(e is self._CLOSE for e in batch)
+            lines = [json.dumps(e, ensure_ascii=False, default=str) for e in batch if e is not self._CLOSE]
+            if lines:
+                self._file.write("\n".join(lines) + "\n")
+                self._file.flush()
+            if closing:
+                return
+
+    def close(self):
+        self._queue.put(self._CLOSE)
+        self._thread.join()
+        self._file.close()
+
+
+_sinks: List = [ConsoleSink()]
+_quiet = False
+
+
+def configure_events(quiet: bool = False, jsonl_path: Optional[str] = None):
+    """
+    重新配置事件输出。quiet=True 时不使用 ConsoleSink 并关闭逐步日志。
+    """
+    global _sinks, _quiet
+    close_events()
+    _quiet = quiet
+    _sinks = [] if quiet else [ConsoleSink()]
+    if jsonl_path:
+        _sinks.append(JsonlSink(jsonl_path))
+
+
+def close_events():
+    """刷新并关闭所有 sink (JSONL 写入器会写完队列中剩余的事件)。"""
+    for sink in _sinks:
+        sink.close()
+
+
+def is_quiet() -> bool:
+    return _quiet
+
+
+def log(message: str = ""):
+    """引擎内部的逐步日志；quiet 模式下不输出。"""
+    if not _quiet:
+        print(message)
+
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex[:8]
+
+
+class run_scope:
+    """
+    with run_scope("tot"): ...
+    为块内的事件设置 run id，并发出 run_start / run_end。
+    """
+
+    def __init__(self, mode: str, **fields):
+        self.mode = mode
+        self.fields = fields
+        self.run_id = new_run_id()
+        self._token = None
+        self._start = 0.0
+
+    def __enter__(self):
+        self._token = _run_id.set(self.run_id)
+        self._start = time.perf_counter()
+        emit_event(RUN_START, mode=self.mode, **self.fields)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        emit_event(RUN_END, mode=self.mode, ok=exc is None,
+                   elapsed=round(time.perf_counter() - self._start, 3))
+        _run_id.reset(self._token)
+        return False
+
+
+def emit_event(event_type: str, **fields):
+    """发出一个紧凑事件。没有 sink 时不做任何格式化。"""
+    if not _sinks:
+        return
+    event = {"type": event_type, "ts": round(time.time(), 3), "run": _run_id.get(), **fields}
+    for sink in _sinks:
+        sink.handle(event)
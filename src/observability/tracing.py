@@ -0,0 +1,192 @@
+"""
+分层延迟追踪 (Tracing)
+把 LangGraph 节点、LLM调用 (含排队与网络等待)、JSON解析、工具调用 (搜索、FAISS、嵌入、图像分析)
+以及 AgentExecutor 的循环记录为嵌套的 span，并导出为 Chrome Trace 格式
+(可直接在 chrome://tracing 或 https://ui.perfetto.dev 中打开)。
+
+未开启时 span() 返回一个共享的空对象，traced() 只多一次布尔判断，开销可以忽略。
+"""
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+
+_enabled = False
+_records: List[dict] = []
+_records_lock = threading.Lock()
+_ids = itertools.count(1)
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "thinkflow_current_span", default=None
+)
+_epoch_ns = time.perf_counter_ns()
+
+
+class _NoopSpan:
+    """追踪关闭时使用的空 span"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def end(self):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """
+    一个计时区间。可以用作 with 上下文 (自动成为子 span 的父节点)，
+    也可以用 start_span() / end() 显式开始和结束 (用于回调式的API)。
+    """
+
+    def __init__(self, name: str, attributes: dict, parent: Optional["Span"] = None):
+        self.name = name
+        self.attributes = attributes
+        self.span_id = next(_ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.thread_id = threading.get_ident()
+        self.start_ns = time.perf_counter_ns()
+        self._token = None
+        self._ended = False
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        parent = _current.get()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = time.perf_counter_ns()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        _current.reset(self._token)
+        self.end()
+        return False
+
+    def end(self):
+        if self._ended:
+            return
+        self._ended = True
+        duration_ns = time.perf_counter_ns() - self.start_ns
+        record = {
+            "name": self.name,
+            "cat": self.name.split(".", 1)[0],
+            "ph": "X",
+            "ts": (self.start_ns - _epoch_ns) / 1000,
+            "dur": duration_ns / 1000,
+            "pid": os.getpid(),
+            "tid": self.thread_id,
+            "args": {
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                **{k: _jsonable(v) for k, v in self.attributes.items()},
+            },
+        }
+        with _records_lock:
+            _records.append(record)
+
+
+def _jsonable(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    text = str(value)
+    return text if len(text) <= 200 else text[:200] + "..."
+
+
+def is_tracing_enabled() -> bool:
+    return _enabled
+
+
+def enable_tracing():
+    global _enabled
+    _enabled = True
+
+
+def disable_tracing():
+    global _enabled
+    _enabled = False
+
+
+def span(name: str, **attributes):
+    """
+    with span("llm.call", model=...): ...
+    追踪关闭时返回空对象。
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def start_span(name: str, **attributes):
+    """
+    显式开始一个 span (不改变当前上下文)，之后调用 .end() 结束。
+    父节点是开始时的当前 span。
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes, parent=_current.get())
+
+
+def traced(name: Optional[str] = None):
+    """
+    装饰器：把函数的每次调用记录为一个 span。保留原函数签名 (LangGraph / LangChain 依赖它)。
+    同样适用于 async 函数，span 覆盖整个 await 过程。
+    """
+    def decorator(func: Callable):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await func(*args, **kwargs)
+                with Span(span_name, {}):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(span_name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def get_trace_records() -> List[dict]:
+    with _records_lock:
+        return list(_records)
+
+
+def reset_trace():
+    with _records_lock:
+        _records.clear()
+
+
+def export_chrome_trace(path: str) -> int:
+    """
+    把已记录的 span 写入 Chrome Trace (JSON Object Format) 文件，返回 span 数量。
+    """
+    records = get_trace_records()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": records, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+    return len(records)
@@ -2,12 +2,16 @@
 from .tot_prompts import (
     GENERATOR_SYSTEM_PROMPT,
     EVALUATOR_SYSTEM_PROMPT,
+    SCORE_ONLY_EVALUATOR_PROMPT,
+    SCORE_REASON_PROMPT,
     PLANNER_SYSTEM_PROMPT
 )
 
 __all__ = [
     "GENERATOR_SYSTEM_PROMPT",
     "EVALUATOR_SYSTEM_PROMPT",
+    "SCORE_ONLY_EVALUATOR_PROMPT",
+    "SCORE_REASON_PROMPT",
     "PLANNER_SYSTEM_PROMPT"
 ]
 
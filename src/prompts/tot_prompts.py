@@ -37,12 +37,36 @@ EVALUATOR_SYSTEM_PROMPT = """
 }
 """
 
+SCORE_ONLY_EVALUATOR_PROMPT = """
+[R - 角色]
+你是一个严谨的逻辑评估器。你的任务是评估一个"提议的思考步骤"在解决一个"原始问题"时的有效性。
+
+[C - 背景与任务]
+你必须评估这个思考步骤是否：
+1. 偏离了主题？
+2. 是否是一个死胡同？
+3. 是否比其他路径更有可能导向最终答案？
+
+[O - 输出格式]
+请按照0到10的整数给"靠谱程度"打分。
+你的输出必须*只*包含这个整数，不要包含理由、标点、JSON或任何其他文字。
+"""
+
+SCORE_REASON_PROMPT = """
+[R - 角色]
+你是一个严谨的逻辑评估器。一个"提议的思考步骤"已经被打出了"靠谱程度"分数 (0到10)。
+
+[T - 任务]
+请用一句话简短说明给出这个分数的理由。只输出这一句话。
+"""
+
 PLANNER_SYSTEM_PROMPT = """
 你是一个专业的项目规划师。你的任务是将一个复杂的用户请求分解为一个详细的、可执行的、按逻辑顺序排列的"子任务"列表。
 
 你必须考虑任务之间的依赖关系。例如，"预订酒店"必须在"搜索酒店"之后。
 
 你可用的"执行者"工具包括：`search`（用于网络搜索）和`calculator`（用于计算）。
+`calculator` 能一次计算完整的算术表达式（支持括号、优先级、百分数、多个用 ';' 分隔的表达式），不要把一个计算拆成多个步骤。
 
 你的输出必须是一个JSON对象，其中包含一个名为 "plan" 的列表，列表中的每一项都是一个描述清晰的字符串任务。
 
@@ -51,8 +75,7 @@ PLANNER_SYSTEM_PROMPT = """
 输出:
 {
 "plan": [
-"使用 calculator 计算 '5 * 10'",
-"使用 calculator 将上一步的结果与 '20' 相加"
+"使用 calculator 计算 '5 * 10 + 20'"
 ]
 }
 
@@ -5,7 +5,11 @@ from .tools import (
     real_search,
     query_local_knowledge,
     image_analyzer,
-    ask_about_image
+    batch_image_analyzer,
+    ask_about_image,
+    aask_about_image,
+    ask_about_images,
+    aask_about_images
 )
 
 __all__ = [
@@ -14,6 +18,10 @@ __all__ = [
     "real_search",
     "query_local_knowledge",
     "image_analyzer",
-    "ask_about_image"
+    "batch_image_analyzer",
+    "ask_about_image",
+    "aask_about_image",
+    "ask_about_images",
+    "aask_about_images"
 ]
 
@@ -0,0 +1,168 @@
+"""
+安全的算术表达式求值器
+只遍历白名单内的AST节点，不使用 eval()。
+支持: 运算符优先级、括号、一元正负号、乘方 (** 或 ^)、百分数 (20%)、
+常用数学函数 (sqrt, round, min, max ...)，以及用 ';' 或换行分隔的多个表达式。
+"""
+import ast
+import math
+import operator
+import re
+import sys
+from typing import List, Tuple, Union
+
+Number = Union[int, float]
+
+# --- 防滥用限制 ---
+MAX_EXPRESSION_LENGTH = 500
+MAX_EXPRESSIONS = 20
+MAX_EXPONENT = 100
+MAX_RESULT_DIGITS = 100
+
+_BINARY_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+_UNARY_OPS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+_FUNCTIONS = {
+    "abs": abs,
+    "round": round,
+    "min": min,
+    "max": max,
+    "sqrt": math.sqrt,
+    "floor": math.floor,
+    "ceil": math.ceil,
+    "log": math.log,
+    "log10": math.log10,
+    "log2": math.log2,
+    "exp": math.exp,
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+}
+
+_CONSTANTS = {
+    "pi": math.pi,
+    "e": math.e,
+}
+
+# "20%" 后面没有紧跟操作数时视为百分数 (0.2)；"7 % 3" 仍然是取模。
+# 与数字隔开的 "%" 后面跟带符号的操作数 ("10 %-3") 也是取模；紧贴数字的 "80%-5" 是百分数减5
+_PERCENT_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(?:%|\s+%(?!\s*[-+][\d.(a-zA-Z]))(?!\s*[\d.(a-zA-Z])")
+
+
+def _check_number(value: Number) -> Number:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError("结果不是数字")
+    if isinstance(value, int) and len(str(abs(value))) > MAX_RESULT_DIGITS:
+        raise ValueError(f"结果超过 {MAX_RESULT_DIGITS} 位数字")
+    if isinstance(value, float) and math.isinf(value):
+        raise ValueError("结果溢出")
+    return value
+
+
+def _check_power(base: Number, exponent: Number):
+    """在计算乘方之前按 exponent * log10(|base|) 估算结果的位数，不先算出巨大的整数或溢出的浮点数。"""
+    if abs(exponent) > MAX_EXPONENT:
+        raise ValueError(f"指数过大 (上限 {MAX_EXPONENT})")
+    if base == 0:
+        return
+    digits = exponent * math.log10(abs(base))
+    if isinstance(base, int) and isinstance(exponent, int) and digits > MAX_RESULT_DIGITS:
+        raise ValueError(f"结果超过 {MAX_RESULT_DIGITS} 位数字")
+    if digits > sys.float_info.max_10_exp:
+        raise ValueError("结果溢出")
+
+
+def _eval_node(node: ast.AST) -> Number:
+    if isinstance(node, ast.Expression):
+        return _eval_node(node.body)
+
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ValueError(f"不支持的常量: {node.value!r}")
+        return node.value
+
+    if isinstance(node, ast.Name):
+        if node.id not in _CONSTANTS:
+            raise ValueError(f"未知的名称: {node.id}")
+        return _CONSTANTS[node.id]
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        return _UNARY_OPS[type(node.op)](_eval_node(node.operand))
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+        left = _eval_node(node.left)
+        right = _eval_node(node.right)
+        if isinstance(node.op, ast.Pow):
+            _check_power(left, right)
+        try:
+            return _check_number(_BINARY_OPS[type(node.op)](left, right))
+        except OverflowError:
+            raise ValueError("结果溢出")
+
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in _FUNCTIONS:
+            raise ValueError("不支持的函数调用")
+        if node.keywords:
+            raise ValueError("函数不支持关键字参数")
+        args = [_eval_node(arg) for arg in node.args]
+        try:
+            return _check_number(_FUNCTIONS[node.func.id](*args))
+        except OverflowError:
+            raise ValueError("结果溢出")
+
+    raise ValueError(f"不支持的语法: {type(node).__name__}")
+
+
+def _normalize(expression: str) -> str:
+    expression = expression.replace("^", "**")
+    expression = expression.replace("×", "*").replace("÷", "/")
+    return _PERCENT_PATTERN.sub(r"(\1/100)", expression)
+
+
+def evaluate_expression(expression: str) -> Number:
+    """
+    安全地计算单个算术表达式。
+    表达式非法或超出限制时抛出 ValueError；除以零时抛出 ZeroDivisionError。
+    """
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise ValueError(f"表达式过长 (上限 {MAX_EXPRESSION_LENGTH} 个字符)")
+    try:
+        tree = ast.parse(_normalize(expression).strip(), mode="eval")
+    except SyntaxError:
+        raise ValueError(f"无法解析表达式: {expression}")
+    return _eval_node(tree)
+
+
+def evaluate_expressions(text: str) -> List[Tuple[str, Number]]:
+    """
+    计算用 ';' 或换行分隔的多个表达式，返回 [(表达式, 结果), ...]。
+    """
+    if len(text) > MAX_EXPRESSION_LENGTH:
+        raise ValueError(f"输入过长 (上限 {MAX_EXPRESSION_LENGTH} 个字符)")
+    expressions = [part.strip() for part in re.split(r"[;\n]", text) if part.strip()]
+    if not expressions:
+        raise ValueError("没有可计算的表达式")
+    if len(expressions) > MAX_EXPRESSIONS:
+        raise ValueError(f"表达式数量过多 (上限 {MAX_EXPRESSIONS} 个)")
+    return [(expr, evaluate_expression(expr)) for expr in expressions]
+
+
+def format_number(value: Number) -> str:
+    """整数值去掉多余的 '.0'，浮点数保留最多10位有效小数。"""
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e16:
+            return str(int(value))
+        return f"{value:.10g}"
+    return str(value)
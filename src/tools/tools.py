@@ -1,26 +1,28 @@
 # 文件名: tools.py
-import operator
-import re
+import asyncio
 import json
 import os
-from openai import OpenAI
+import threading
+from typing import List
 from googleapiclient.discovery import build
 from langchain_core.tools import tool
 from langchain_community.vectorstores import FAISS
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from dotenv import load_dotenv
 
+from src.llm import achat_completion, chat_completion
+from src.llm.cassette import arecorded, recorded
+from src.llm.coalesce import request_key, tool_flight
+from src.observability import log, span
+from .safe_eval import evaluate_expressions, format_number
+from .vision_batch import aask_about_images, ask_about_images, format_answers, pair_items
+
 load_dotenv()
 
 os.environ.setdefault("LANGCHAIN_TRACING_V2", "false")
 os.environ.pop("LANGCHAIN_API_KEY", None)
 os.environ.pop("LANGSMITH_ENDPOINT", None)
 
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.environ.get("OPENROUTER_API_KEY"),
-)
-
 # --- "图书馆"会员卡  ---
 Custom_Google_Search_API = os.environ.get("Custom_Google_Search_API")
 GOOGLE_CSE_ID = os.environ.get("GOOGLE_CSE_ID")
@@ -43,51 +45,63 @@ def deep_think(query: str) -> str:
     或者任何不需要实时搜索、但需要深度思考才能回答的问题时，
     你必须使用此工具。
     """
-    print("--- 正在调用 'Deep Thinker' 工具... ---")
+    log("--- 正在调用 'Deep Thinker' 工具... ---")
     try:
-        response = client.chat.completions.create(
-            model="meta-llama/llama-4-maverick:free",
-            messages=[
-                {"role": "system", "content": DEEP_THINK_SYSTEM_PROMPT},
-                {"role": "user", "content": query},
-            ],
-            temperature=0.1,
-        )
-        return response.choices[0].message.content
+        with span("tool.deep_think"):
+            return chat_completion(**_deep_think_request(query))
+    except Exception as e:
+        return f"调用Deep Think API时出错: {e}"
+
+
+async def _adeep_think(query: str) -> str:
+    log("--- 正在调用 'Deep Thinker' 工具... ---")
+    try:
+        with span("tool.deep_think"):
+            return await achat_completion(**_deep_think_request(query))
     except Exception as e:
         return f"调用Deep Think API时出错: {e}"
 
 
+def _deep_think_request(query: str) -> dict:
+    return {
+        "role": "deep_think",
+        "messages": [
+            {"role": "system", "content": DEEP_THINK_SYSTEM_PROMPT},
+            {"role": "user", "content": query},
+        ],
+        "temperature": 0.1,
+    }
+
+
 @tool
 def simple_calculator(expression: str) -> str:
     """
-    一个安全的计算器。只能用于简单的二元运算，例如 '10 + 5' 或 '20 * 3'。
-    (A safe calculator. Use for simple math operations like '10 + 5' or '20 * 3'.)
+    一个安全的计算器。支持完整的算术表达式：运算符优先级、括号、负数、乘方 (** 或 ^)、
+    百分数 (如 '5000 * 15%')，以及 sqrt/round/min/max/abs/floor/ceil/log 等函数。
+    可以一次计算多个表达式，用 ';' 分隔，例如 '5*10+20; 5000/5/3'。
+    (A safe calculator. Supports full arithmetic expressions, e.g. '(5000 - 1200) / 5 / 3'.
+    Separate multiple expressions with ';'.)
     """
-    print(f"--- [Tool]: 正在调用 'simple_calculator'，表达式: {expression} ---")
+    log(f"--- [Tool]: 正在调用 'simple_calculator'，表达式: {expression} ---")
 
-    ops = {
-        "+": operator.add,
-        "-": operator.sub,
-        "*": operator.mul,
-        "/": operator.truediv,
-    }
-    pattern = r"^\s*([\d\.]+)\s*([+\-*/])\s*([\d\.]+)\s*$"
-    match = re.match(pattern, expression)
-    if not match:
-        return f"Error: 表达式格式无效。请输入如 '10 + 5' 的简单运算。"
     try:
-        num1_str, op_str, num2_str = match.groups()
-        num1 = float(num1_str)
-        num2 = float(num2_str)
-        op_func = ops[op_str]
-        result = op_func(num1, num2)
-        return str(result)
+        results = evaluate_expressions(expression)
     except ZeroDivisionError:
         return "Error: 不能除以零。"
+    except ValueError as e:
+        return f"Error: 表达式无效: {e}"
     except Exception as e:
         return f"Error: 计算时出错: {e}"
 
+    if len(results) == 1:
+        return format_number(results[0][1])
+    return "\n".join(f"{expr} = {format_number(value)}" for expr, value in results)
+
+
+async def _asimple_calculator(expression: str) -> str:
+    # 纯本地计算，直接在事件循环中执行
+    return simple_calculator.func(expression)
+
 
 @tool
 def real_search(query: str, num_results: int = 3) -> str:
@@ -96,8 +110,28 @@ def real_search(query: str, num_results: int = 3) -> str:
     用于查询当前天气、体育赛事结果、新闻、或你不认识的人或事物的最新信息。
     (A real-time internet search engine. Use for current events like weather, sports, news, etc.)
     """
-    print(f"--- [Tool]: 正在调用 'real_search'，查询: {query} ---")
+    log(f"--- [Tool]: 正在调用 'real_search'，查询: {query} ---")
+    # 并发的相同查询只发出一次搜索请求；开启 cassette 时结果会被录制/回放
+    key = request_key("real_search", query, num_results)
+    with span("tool.real_search", query=query):
+        return tool_flight.do(
+            key,
+            lambda: recorded("search", key, lambda: _google_search(query, num_results)),
+        )
 
+
+async def _areal_search(query: str, num_results: int = 3) -> str:
+    log(f"--- [Tool]: 正在调用 'real_search'，查询: {query} ---")
+    # googleapiclient 是阻塞的，放到线程中执行
+    key = request_key("real_search", query, num_results)
+    with span("tool.real_search", query=query):
+        return await tool_flight.ado(
+            key,
+            lambda: arecorded("search", key, lambda: asyncio.to_thread(_google_search, query, num_results)),
+        )
+
+
+def _google_search(query: str, num_results: int) -> str:
     if not Custom_Google_Search_API or not GOOGLE_CSE_ID:
         return "Error: Google Search API key or CSE ID not configured."
     try:
@@ -120,23 +154,70 @@ def query_local_knowledge(question: str) -> str:
     查询本地知识库（RAG）。
     用于问项目内部信息、秘密代号、规则、文档内容等。
     """
-    print(f"--- [Tool]: 正在调用 'query_local_knowledge'，问题: {question} ---")
+    log(f"--- [Tool]: 正在调用 'query_local_knowledge'，问题: {question} ---")
+    key = request_key("query_local_knowledge", question)
+    with span("tool.query_local_knowledge"):
+        return tool_flight.do(
+            key,
+            lambda: recorded("knowledge", key, lambda: _search_local_knowledge(question)),
+        )
+
+
+async def _aquery_local_knowledge(question: str) -> str:
+    log(f"--- [Tool]: 正在调用 'query_local_knowledge'，问题: {question} ---")
+    # 嵌入计算与 FAISS 检索是CPU密集的阻塞调用，放到线程中执行
+    key = request_key("query_local_knowledge", question)
+    with span("tool.query_local_knowledge"):
+        return await tool_flight.ado(
+            key,
+            lambda: arecorded("knowledge", key, lambda: asyncio.to_thread(_search_local_knowledge, question)),
+        )
+
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def set_embeddings(embeddings):
+    """
+    替换 query_local_knowledge 使用的嵌入模型 (批量运行时换成共享嵌入进程的客户端)。
+    传入 None 恢复为按需加载本地模型。
+    """
+    global _embeddings
+    with _embeddings_lock:
+        _embeddings = embeddings
+
+
+def _get_embeddings():
+    # 本地模型只加载一次，之后的查询复用
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            embed_model_name = os.environ.get("EMBED_MODEL", "BAAI/bge-small-zh-v1.5")
+            with span("rag.load_embeddings", model=embed_model_name):
+                _embeddings = HuggingFaceEmbeddings(
+                    model_name=embed_model_name,
+                    model_kwargs={"device": "cpu"},
+                    encode_kwargs={"normalize_embeddings": True},
+                )
+        return _embeddings
+
+
+def _search_local_knowledge(question: str) -> str:
     try:
         if not os.path.exists("faiss_index"):
             return "Error: 本地知识库未构建！请先运行 build_rag_hf.py 重建索引（见下方脚本）。"
 
-        embed_model_name = os.environ.get("EMBED_MODEL", "BAAI/bge-small-zh-v1.5")
-        embeddings = HuggingFaceEmbeddings(
-            model_name=embed_model_name,
-            model_kwargs={"device": "cpu"},
-            encode_kwargs={"normalize_embeddings": True},
-        )
+        embeddings = _get_embeddings()
 
-        db = FAISS.load_local(
-            "faiss_index", embeddings, allow_dangerous_deserialization=True
-        )
+        with span("rag.load_index"):
+            db = FAISS.load_local(
+                "faiss_index", embeddings, allow_dangerous_deserialization=True
+            )
 
-        docs = db.similarity_search(question, k=2)
+        # 包含问题的嵌入计算与 FAISS 检索
+        with span("rag.similarity_search", k=2):
+            docs = db.similarity_search(question, k=2)
         if not docs:
             return "本地知识库中未找到相关信息。"
         context = "\n\n".join([doc.page_content.strip() for doc in docs])
@@ -151,30 +232,41 @@ def ask_about_image(image_url: str, question: str) -> str:
     向多模态模型发送一张图片和一个问题。
     """
     try:
-        response = client.chat.completions.create(
-            model="meta-llama/llama-4-maverick:free",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": question
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": image_url}
-                        }
-                    ]
-                }
-            ],
-            max_tokens=500
-        )
-        return response.choices[0].message.content
+        return chat_completion(**_image_request(image_url, question))
+    except Exception as e:
+        return f"调用API时出错: {e}"
+
+
+async def aask_about_image(image_url: str, question: str) -> str:
+    """ask_about_image() 的 async 版本。"""
+    try:
+        return await achat_completion(**_image_request(image_url, question))
     except Exception as e:
         return f"调用API时出错: {e}"
 
 
+def _image_request(image_url: str, question: str) -> dict:
+    return {
+        "role": "vision",
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": question
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": image_url}
+                    }
+                ]
+            }
+        ],
+        "max_tokens": 500
+    }
+
+
 @tool
 def image_analyzer(question: str, image_url: str) -> str:
     """
@@ -183,9 +275,63 @@ def image_analyzer(question: str, image_url: str) -> str:
     'question' 参数是用户关于图片的问题。
     'image_url' 参数是图片在互联网上的链接(URL)地址。
     """
-    print(f"--- [工具被调用：image_analyzer] ---")
-    print(f"   问题: {question}")
-    print(f"   URL: {image_url}")
-    print(f"---------------------------------")
-    return ask_about_image(image_url, question)
+    _print_image_call(question, image_url)
+    with span("tool.image_analyzer", image_url=image_url):
+        return ask_about_image(image_url, question)
+
+
+async def _aimage_analyzer(question: str, image_url: str) -> str:
+    _print_image_call(question, image_url)
+    with span("tool.image_analyzer", image_url=image_url):
+        return await aask_about_image(image_url, question)
+
+
+def _print_image_call(question: str, image_url: str):
+    log(f"--- [工具被调用：image_analyzer] ---")
+    log(f"   问题: {question}")
+    log(f"   URL: {image_url}")
+    log(f"---------------------------------")
+
+
+@tool
+def batch_image_analyzer(questions: List[str], image_urls: List[str]) -> str:
+    """
+    批量视觉分析工具。需要对比多张图片、对同一张图片问多个问题，或对多张图片问同一个问题时，
+    优先调用此工具 (一次调用代替多次 image_analyzer)。
+    'questions' 参数是问题列表，'image_urls' 参数是图片URL列表。
+    一张图片配多个问题、多张图片配一个问题，或者两个列表等长按顺序一一对应。
+    """
+    try:
+        items = pair_items(image_urls, questions)
+    except ValueError as e:
+        return f"Error: {e}"
+    _print_batch_image_call(items)
+    with span("tool.batch_image_analyzer", items=len(items)):
+        return format_answers(items, ask_about_images(items))
+
+
+async def _abatch_image_analyzer(questions: List[str], image_urls: List[str]) -> str:
+    try:
+        items = pair_items(image_urls, questions)
+    except ValueError as e:
+        return f"Error: {e}"
+    _print_batch_image_call(items)
+    with span("tool.batch_image_analyzer", items=len(items)):
+        return format_answers(items, await aask_about_images(items))
+
+
+def _print_batch_image_call(items: list):
+    log(f"--- [工具被调用：batch_image_analyzer] ---")
+    log(f"   图片数: {len({item['image_url'] for item in items})}  问题数: {len(items)}")
+    log(f"---------------------------------")
+
+
+# async 实现：AgentExecutor.ainvoke / tool.ainvoke 会直接 await 这些协程，
+# 不再把同步函数丢进线程池
+deep_think.coroutine = _adeep_think
+simple_calculator.coroutine = _asimple_calculator
+real_search.coroutine = _areal_search
+query_local_knowledge.coroutine = _aquery_local_knowledge
+image_analyzer.coroutine = _aimage_analyzer
+batch_image_analyzer.coroutine = _abatch_image_analyzer
 
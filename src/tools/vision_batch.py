@@ -0,0 +1,232 @@
+"""
+批量视觉分析 (Batched Vision)
+把多张图片、多个问题打包进同一个多模态请求，而不是每个 (图片, 问题) 各发一次。
+打包时遵守模型的限制 (每个请求的图片数、问题数、图片大小)，超出限制时拆成多个批次并发执行；
+模型按编号返回每个问题的回答，缺失的条目再并发地单独补问。
+
+可调的环境变量:
+    THINKFLOW_VISION_MAX_IMAGES       每个请求最多的图片数 (默认 5)
+    THINKFLOW_VISION_MAX_QUESTIONS    每个请求最多的问题数 (默认 8)
+    THINKFLOW_VISION_MAX_IMAGE_MB     单张内联图片 (data URL) 的大小上限 (默认 20)
+    THINKFLOW_VISION_MAX_REQUEST_MB   每个请求内联图片的总大小上限 (默认 20)
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, TypedDict
+
+from dotenv import load_dotenv
+
+from src.llm.structured import (
+    StructuredOutputError,
+    acomplete_structured,
+    answers_validator,
+    complete_structured
+)
+from src.observability import log, span
+
+load_dotenv()
+
+MAX_IMAGES_PER_REQUEST = int(os.environ.get("THINKFLOW_VISION_MAX_IMAGES", "5"))
+MAX_QUESTIONS_PER_REQUEST = int(os.environ.get("THINKFLOW_VISION_MAX_QUESTIONS", "8"))
+MAX_IMAGE_BYTES = int(float(os.environ.get("THINKFLOW_VISION_MAX_IMAGE_MB", "20")) * 1024 * 1024)
+MAX_REQUEST_BYTES = int(float(os.environ.get("THINKFLOW_VISION_MAX_REQUEST_MB", "20")) * 1024 * 1024)
+
+# 每个回答预留的输出token (单个问题时与 ask_about_image 相同)，以及整个请求的上限
+TOKENS_PER_ANSWER = 500
+MAX_TOKENS_PER_REQUEST = 3000
+
+VISION_BATCH_PROMPT = """
+你会看到若干张按顺序编号的图片，以及若干个按编号列出的问题，每个问题都注明了它针对哪一张图片。
+请逐一回答每个问题，只根据对应的图片作答。
+
+只输出一个JSON对象，键是问题编号 (只写数字)，不要包含任何其他文字:
+{"answers": {"1": "回答", "2": "回答", ...}}
+"""
+
+_vision_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="vision-batch")
+# 补问使用独立的线程池：补问由 _vision_executor 中的批次发起，共用同一个池可能互相等待而死锁
+_retry_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="vision-retry")
+
+
+class VisionItem(TypedDict):
+    """一个 (图片, 问题) 对"""
+    image_url: str
+    question: str
+
+
+# 一个批次: [(条目在输入中的序号, 条目), ...]
+Batch = List[Tuple[int, VisionItem]]
+
+
+def pair_items(image_urls: List[str], questions: List[str]) -> List[VisionItem]:
+    """
+    把图片列表与问题列表配对:
+    一张图片 + 多个问题 -> 每个问题都针对这张图片；
+    多张图片 + 一个问题 -> 对每张图片提同一个问题；
+    数量相同 -> 按顺序一一对应。
+    """
+    image_urls = [url.strip() for url in image_urls if url and url.strip()]
+    questions = [q.strip() for q in questions if q and q.strip()]
+    if not image_urls or not questions:
+        raise ValueError("至少需要一张图片和一个问题")
+    if len(image_urls) == 1:
+        return [{"image_url": image_urls[0], "question": q} for q in questions]
+    if len(questions) == 1:
+        return [{"image_url": url, "question": questions[0]} for url in image_urls]
+    if len(image_urls) == len(questions):
+        return [{"image_url": url, "question": q} for url, q in zip(image_urls, questions)]
+    raise ValueError(f"图片数 ({len(image_urls)}) 与问题数 ({len(questions)}) 无法配对")
+
+
+def image_size(image_url: str) -> int:
+    """内联图片 (data URL) 的字节数；远程URL由提供商下载，按0计。"""
+    if not image_url.startswith("data:"):
+        return 0
+    payload = image_url.split(",", 1)[-1]
+    return len(payload) * 3 // 4
+
+
+def plan_batches(items: List[VisionItem]) -> Tuple[List[Batch], Dict[int, str]]:
+    """
+    按图片分组后贪心装箱，每个批次不超过图片数、问题数与总大小的限制。
+    同一张图片的问题尽量放在同一个批次；问题太多时这张图片会出现在多个批次中。
+    返回 (批次列表, {序号: 错误信息})，超过单张大小上限的图片不会被发送。
+    """
+    errors: Dict[int, str] = {}
+    by_image: Dict[str, Batch] = {}
+    for index, item in enumerate(items):
+        size = image_size(item["image_url"])
+        if size > MAX_IMAGE_BYTES:
+            errors[index] = f"Error: 图片大小 {size / 1024 / 1024:.1f}MB 超过上限 {MAX_IMAGE_BYTES / 1024 / 1024:.0f}MB"
+            continue
+        by_image.setdefault(item["image_url"], []).append((index, item))
+
+    batches: List[Batch] = []
+    current: Batch = []
+    images, size = set(), 0
+    for url, entries in by_image.items():
+        for entry in entries:
+            new_image = url not in images
+            if current and (
+                len(current) >= MAX_QUESTIONS_PER_REQUEST
+                or (new_image and len(images) >= MAX_IMAGES_PER_REQUEST)
+                or (new_image and size + image_size(url) > MAX_REQUEST_BYTES)
+            ):
+                batches.append(current)
+                current, images, size = [], set(), 0
+                new_image = True
+            if new_image:
+                images.add(url)
+                size += image_size(url)
+            current.append(entry)
+    if current:
+        batches.append(current)
+    return batches, errors
+
+
+def _batch_request(batch: Batch) -> dict:
+    image_numbers: Dict[str, int] = {}
+    content = [{"type": "text", "text": VISION_BATCH_PROMPT}]
+    for _, item in batch:
+        url = item["image_url"]
+        if url not in image_numbers:
+            image_numbers[url] = len(image_numbers) + 1
+            content.append({"type": "text", "text": f"[图片 {image_numbers[url]}]"})
+            content.append({"type": "image_url", "image_url": {"url": url}})
+
+    questions = "\n".join(
+        f"问题 {index + 1} (图片 {image_numbers[item['image_url']]}): {item['question']}"
+        for index, item in batch
+    )
+    content.append({"type": "text", "text": f"[问题列表]\n{questions}"})
+
+    return {
+        "role": "vision",
+        "messages": [{"role": "user", "content": content}],
+        "validator": answers_validator([str(index + 1) for index, _ in batch]),
+        "label": "vision.batch",
+        "max_tokens": min(MAX_TOKENS_PER_REQUEST, TOKENS_PER_ANSWER * len(batch)),
+    }
+
+
+def _run_batch(batch: Batch) -> Dict[int, str]:
+    # 延迟导入：tools.py 会导入本模块
+    from .tools import ask_about_image
+
+    if len(batch) == 1:
+        index, item = batch[0]
+        return {index: ask_about_image(item["image_url"], item["question"])}
+
+    with span("vision.batch", images=len({item["image_url"] for _, item in batch}), questions=len(batch)):
+        try:
+            answers = complete_structured(**_batch_request(batch))["answers"]
+        except StructuredOutputError as e:
+            log(f"--- [批量视觉] 无法解析批量回答 ({e})，改为逐个提问 ---")
+            answers = {}
+        except Exception as e:
+            return {index: f"调用API时出错: {e}" for index, _ in batch}
+
+    missing = [(index, item) for index, item in batch if str(index + 1) not in answers]
+    retried = [
+        _retry_executor.submit(contextvars.copy_context().run, ask_about_image, item["image_url"], item["question"])
+        for _, item in missing
+    ]
+    results = {index: answers[str(index + 1)] for index, _ in batch if str(index + 1) in answers}
+    results.update({index: future.result() for (index, _), future in zip(missing, retried)})
+    return results
+
+
+async def _arun_batch(batch: Batch) -> Dict[int, str]:
+    from .tools import aask_about_image
+
+    if len(batch) == 1:
+        index, item = batch[0]
+        return {index: await aask_about_image(item["image_url"], item["question"])}
+
+    with span("vision.batch", images=len({item["image_url"] for _, item in batch}), questions=len(batch)):
+        try:
+            answers = (await acomplete_structured(**_batch_request(batch)))["answers"]
+        except StructuredOutputError as e:
+            log(f"--- [批量视觉] 无法解析批量回答 ({e})，改为逐个提问 ---")
+            answers = {}
+        except Exception as e:
+            return {index: f"调用API时出错: {e}" for index, _ in batch}
+
+    missing = [(index, item) for index, item in batch if str(index + 1) not in answers]
+    retried = await asyncio.gather(*(aask_about_image(item["image_url"], item["question"]) for _, item in missing))
+    results = {index: answers[str(index + 1)] for index, _ in batch if str(index + 1) in answers}
+    results.update({index: answer for (index, _), answer in zip(missing, retried)})
+    return results
+
+
+def ask_about_images(items: List[VisionItem]) -> List[str]:
+    """
+    批量回答 (图片, 问题) 对，返回与 items 顺序一致的回答列表。
+    多个批次在线程池中并发执行。
+    """
+    batches, results = plan_batches(items)
+    futures = []
+    for batch in batches:
+        ctx = contextvars.copy_context()
+        futures.append(_vision_executor.submit(ctx.run, _run_batch, batch))
+    for future in futures:
+        results.update(future.result())
+    return [results[index] for index in range(len(items))]
+
+
+async def aask_about_images(items: List[VisionItem]) -> List[str]:
+    """ask_about_images() 的 async 版本，多个批次在同一个事件循环中并发执行。"""
+    batches, results = plan_batches(items)
+    for batch_results in await asyncio.gather(*(_arun_batch(batch) for batch in batches)):
+        results.update(batch_results)
+    return [results[index] for index in range(len(items))]
+
+
+def format_answers(items: List[VisionItem], answers: List[str]) -> str:
+    """把批量回答整理成给Agent看的文本。"""
+    return "\n\n".join(
+        f"[{i + 1}] 图片: {item['image_url']}\n问题: {item['question']}\n回答: {answer}"
+        for i, (item, answer) in enumerate(zip(items, answers))
+    )
@@ -1,11 +1,32 @@
 """Tree of Thought (思维树) 模块"""
-from .langgraph_tot import ToTState, create_tot_workflow, run_tot
-from .tot_orchestrator import run_tot_orchestrator
+from .langgraph_tot import (
+    ToTState,
+    create_tot_workflow,
+    create_async_tot_workflow,
+    run_tot,
+    arun_tot,
+    SpeculativeGenerator,
+    AsyncSpeculativeGenerator,
+    speculation_config,
+    get_speculation_stats
+)
+from .tot_orchestrator import run_tot_orchestrator, arun_tot_orchestrator
+from .eval_memo import EvalMemo, eval_memo, get_eval_memo_stats
 
 __all__ = [
     "ToTState",
     "create_tot_workflow",
+    "create_async_tot_workflow",
     "run_tot",
-    "run_tot_orchestrator"
+    "arun_tot",
+    "SpeculativeGenerator",
+    "AsyncSpeculativeGenerator",
+    "speculation_config",
+    "get_speculation_stats",
+    "run_tot_orchestrator",
+    "arun_tot_orchestrator",
+    "EvalMemo",
+    "eval_memo",
+    "get_eval_memo_stats"
 ]
 
@@ -0,0 +1,347 @@
+"""
+跨运行的评估备忘录 (Evaluation Memo)
+同一类问题 (团队静修会、旅行规划……) 反复出现时，生成者经常提出相同的思想，每次都重新打分是浪费。
+这里把 (问题指纹, 思想指纹) -> 分数/理由 持久化到本地 sqlite，evaluate 与 evaluate_thought 在调用
+评估模型之前先查备忘录：完全相同 (规范化后) 的直接复用，相似度不低于阈值的近似匹配也复用。
+
+缓存按"评估版本"隔离：版本由评估提示词、评估模型与打分模式 (完整评估 / 快速打分) 算出，
+任何一项变化都会让旧分数自然失效；超过最长保存时间的记录视为过期，打开数据库时清理。
+评估失败 (没有分数) 的结果不入库。
+
+规划类问题里数字就是问题本身 (预算、人数、天数)：规范化时保留数字及其中的小数点、负号与范围符号，
+近似匹配还要求两边出现的数字完全相同，5000 美元与 50000 美元不会被当作"近似"。
+
+可调的环境变量:
+    THINKFLOW_EVAL_MEMO               设为 1 时默认开启 (也可以用 --eval-memo 或 eval_memo.enable())
+    THINKFLOW_EVAL_MEMO_PATH          数据库文件 (默认 eval_memo.sqlite3)
+    THINKFLOW_EVAL_MEMO_THRESHOLD     近似匹配的相似度阈值，0~1 (默认 0.95，设为 1 只复用完全相同的)
+    THINKFLOW_EVAL_MEMO_MAX_AGE_DAYS  记录的最长保存天数 (默认 30，0 表示不过期)
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Awaitable, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from src.llm import router
+from src.observability import log
+from src.prompts import EVALUATOR_SYSTEM_PROMPT, SCORE_ONLY_EVALUATOR_PROMPT
+
+load_dotenv()
+
+EVAL_MEMO_ENABLED = os.environ.get("THINKFLOW_EVAL_MEMO", "0") == "1"
+EVAL_MEMO_PATH = os.environ.get("THINKFLOW_EVAL_MEMO_PATH", "eval_memo.sqlite3")
+EVAL_MEMO_THRESHOLD = float(os.environ.get("THINKFLOW_EVAL_MEMO_THRESHOLD", "0.95"))
+EVAL_MEMO_MAX_AGE_DAYS = float(os.environ.get("THINKFLOW_EVAL_MEMO_MAX_AGE_DAYS", "30"))
+
+# 记录格式变化时递增，让旧数据库中的记录全部失效
+MEMO_SCHEMA_VERSION = 2
+
+_PROMPTS = {
+    "full": EVALUATOR_SYSTEM_PROMPT,
+    "fast": SCORE_ONLY_EVALUATOR_PROMPT,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS evaluations (
+    version     TEXT NOT NULL,
+    problem_key TEXT NOT NULL,
+    thought_key TEXT NOT NULL,
+    problem     TEXT NOT NULL,
+    thought     TEXT NOT NULL,
+    result      TEXT NOT NULL,
+    created     REAL NOT NULL,
+    hits        INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (version, problem_key, thought_key)
+);
+CREATE INDEX IF NOT EXISTS evaluations_created ON evaluations (created);
+"""
+
+_PUNCTUATION = re.compile(r"[\s\W_]+", re.UNICODE)
+
+# 数字 (含千分位、小数、负号、百分号) 以及 "3-5"、"3~5" 这样的范围
+_NUMERAL = r"[-+]?(?:\d{1,3}(?:,\d{3})+|\d+)(?:[.:/]\d+)*%?"
+_NUMBER = re.compile(rf"{_NUMERAL}(?:\s*[-~]\s*{_NUMERAL})?")
+
+
+def _numbers(text: str) -> List[str]:
+    # 千分位逗号不影响数值，去掉后 5,000 与 5000 相同
+    return [re.sub(r"\s+", "", match.group(0)).replace(",", "") for match in _NUMBER.finditer(text)]
+
+
+def normalize(text: str) -> str:
+    """规范化文本：全角转半角、小写、去掉空白与标点，数字 (含小数点、负号、范围) 原样保留。"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    parts = []
+    last = 0
+    for match, number in zip(_NUMBER.finditer(text), _numbers(text)):
+        parts.append(_PUNCTUATION.sub("", text[last:match.start()]))
+        # 数字两侧加分隔符，避免 "5" + "5万" 这样的拼接与 "55万" 混淆
+        parts.append(f"<{number}>")
+        last = match.end()
+    parts.append(_PUNCTUATION.sub("", text[last:]))
+    return "".join(parts)
+
+
+def numbers(text: str) -> FrozenSet[str]:
+    """文本中出现的数字集合，近似匹配要求两边完全相同。"""
+    return frozenset(_numbers(unicodedata.normalize("NFKC", text or "").lower()))
+
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()[:32]
+
+
+def _similar(a: str, b: str, threshold: float) -> Optional[float]:
+    # 先用长度上界快速排除，再算精确的相似度
+    if not a or not b or 2 * min(len(a), len(b)) / (len(a) + len(b)) < threshold:
+        return None
+    matcher = SequenceMatcher(None, a, b, autojunk=False)
+    if matcher.quick_ratio() < threshold:
+        return None
+    ratio = matcher.ratio()
+    return ratio if ratio >= threshold else None
+
+
+def evaluator_version(role: str, mode: str) -> str:
+    """评估版本：评估提示词 + 该角色当前路由到的模型 + 打分模式。"""
+    raw = f"{MEMO_SCHEMA_VERSION}|{mode}|{router.model_for(role)}|{_PROMPTS[mode]}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class EvalMemo:
+    """
+    评估备忘录本体。数据库在第一次使用时才打开；多个线程共用一个连接 (加锁)，
+    多个进程 (批量运行) 可以共用同一个数据库文件。
+    """
+
+    def __init__(self, path: str = EVAL_MEMO_PATH, enabled: bool = EVAL_MEMO_ENABLED,
+                 threshold: float = EVAL_MEMO_THRESHOLD, max_age_days: float = EVAL_MEMO_MAX_AGE_DAYS):
+        self.path = path
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_age = max_age_days * 86400
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        # 每个评估版本下已知的问题 {version: (已读到的 rowid, {problem_key: (规范化问题, 数字集合)})}，
+        # 用于近似匹配；每次近似查询前按 rowid 增量读入新记录，包括其他进程 (批量运行) 写入的问题
+        self._problems: Dict[str, Tuple[int, Dict[str, Tuple[str, FrozenSet[str]]]]] = {}
+        self._stats = {"lookups": 0, "exact_hits": 0, "near_hits": 0, "misses": 0, "stored": 0, "expired": 0}
+
+    def enable(self, enabled: bool = True, path: Optional[str] = None):
+        with self._lock:
+            if path and path != self.path:
+                self._close()
+                self.path = path
+            self.enabled = enabled
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self._problems.clear()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            if self.max_age > 0:
+                removed = conn.execute("DELETE FROM evaluations WHERE created < ?",
+                                       (time.time() - self.max_age,)).rowcount
+                self._stats["expired"] += removed
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _fresh_after(self) -> float:
+        return time.time() - self.max_age if self.max_age > 0 else 0.0
+
+    def _known_problems(self, conn: sqlite3.Connection,
+                        version: str) -> List[Tuple[str, Tuple[str, FrozenSet[str]]]]:
+        """
+        该版本下已知问题的快照。只读入上次之后新增的记录 (rowid 更大)；
+        数据库被清空过 (最大 rowid 回退) 时整体重新加载。调用方持有 self._lock。
+        """
+        seen, problems = self._problems.get(version, (0, {}))
+        latest = conn.execute("SELECT MAX(rowid) FROM evaluations").fetchone()[0] or 0
+        if latest < seen:
+            seen, problems = 0, {}
+        rows = conn.execute(
+            "SELECT rowid, problem_key, problem FROM evaluations WHERE version = ? AND rowid > ? AND created >= ?",
+            (version, seen, self._fresh_after()),
+        )
+        for rowid, key, problem in rows:
+            latest = max(latest, rowid)
+            if key not in problems:
+                problems[key] = (normalize(problem), numbers(problem))
+        self._problems[version] = (latest, problems)
+        return list(problems.items())
+
+    def _candidates(self, known_problems: List[Tuple[str, Tuple[str, FrozenSet[str]]]], problem: str,
+                    problem_key: str) -> List[str]:
+        """与当前问题相同或足够相似 (且数字完全相同) 的已知问题，最相似的在前。"""
+        wanted = numbers(problem)
+        problem = normalize(problem)
+        scored = []
+        for key, (known, known_numbers) in known_problems:
+            if key != problem_key and known_numbers != wanted:
+                continue
+            ratio = 1.0 if key == problem_key else _similar(problem, known, self.threshold)
+            if ratio is not None:
+                scored.append((ratio, key))
+        return [key for _, key in sorted(scored, reverse=True)]
+
+    def lookup(self, problem: str, thought: str, role: str, mode: str) -> Optional[dict]:
+        """
+        查找可复用的评估结果。返回结果的副本，附带 "cached": "exact" 或 "near"；没有时返回 None。
+        """
+        if not self.enabled:
+            return None
+        version = evaluator_version(role, mode)
+        problem_key, thought_key = fingerprint(problem), fingerprint(thought)
+
+        known_problems = []
+        with self._lock:
+            self._stats["lookups"] += 1
+            conn = self._connect()
+            fresh_after = self._fresh_after()
+            row = conn.execute(
+                "SELECT result FROM evaluations WHERE version = ? AND problem_key = ? AND thought_key = ? "
+                "AND created >= ?",
+                (version, problem_key, thought_key, fresh_after),
+            ).fetchone()
+            match = (problem_key, thought_key, row[0], "exact") if row else None
+            if match is None and self.threshold < 1:
+                known_problems = self._known_problems(conn, version)
+
+        # 相似度扫描不持有锁，其他线程的查询与写入不必排队等待
+        if match is None and known_problems:
+            match = self._near_match(version, problem, problem_key, thought, known_problems, fresh_after)
+
+        with self._lock:
+            if match is None:
+                self._stats["misses"] += 1
+                return None
+            matched_problem, matched_thought, result, kind = match
+            conn = self._connect()
+            conn.execute(
+                "UPDATE evaluations SET hits = hits + 1 WHERE version = ? AND problem_key = ? AND thought_key = ?",
+                (version, matched_problem, matched_thought),
+            )
+            conn.commit()
+            self._stats[f"{kind}_hits"] += 1
+
+        log(f"    (评估备忘录命中 [{kind}]，复用历史分数)")
+        result = json.loads(result)
+        result["cached"] = kind
+        return result
+
+    def _near_match(self, version: str, problem: str, problem_key: str, thought: str,
+                    known_problems: List[Tuple[str, Tuple[str, FrozenSet[str]]]],
+                    fresh_after: float) -> Optional[Tuple[str, str, str, str]]:
+        """近似匹配；只在读取候选记录时持有锁，相似度计算在锁外进行。"""
+        candidates = self._candidates(known_problems, problem, problem_key)
+        if not candidates:
+            return None
+        with self._lock:
+            conn = self._connect()
+            rows = [
+                (candidate, row)
+                for candidate in candidates
+                for row in conn.execute(
+                    "SELECT thought_key, thought, result FROM evaluations "
+                    "WHERE version = ? AND problem_key = ? AND created >= ?",
+                    (version, candidate, fresh_after),
+                )
+            ]
+
+        best = None
+        wanted = numbers(thought)
+        thought = normalize(thought)
+        for candidate, (key, known, result) in rows:
+            if numbers(known) != wanted:
+                continue
+            ratio = _similar(thought, normalize(known), self.threshold)
+            if ratio is not None and (best is None or ratio > best[0]):
+                best = (ratio, (candidate, key, result, "near"))
+        return best[1] if best else None
+
+    def store(self, problem: str, thought: str, role: str, mode: str, result: dict):
+        """保存一次成功的评估 (失败、没有分数的结果会被忽略)。"""
+        if not self.enabled or result.get("failed") or result.get("score") is None:
+            return
+        version = evaluator_version(role, mode)
+        problem_key = fingerprint(problem)
+        saved = {key: value for key, value in result.items() if key not in ("cached", "thought", "id")}
+
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO evaluations "
+                "(version, problem_key, thought_key, problem, thought, result, created, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (version, problem_key, fingerprint(thought), problem, thought,
+                 json.dumps(saved, ensure_ascii=False), time.time()),
+            )
+            conn.commit()
+            self._stats["stored"] += 1
+
+    def call(self, problem: str, thought: str, role: str, mode: str, fn: Callable[[], dict]) -> dict:
+        """先查备忘录，没有命中时调用 fn() 评估并入库；fn 抛出的异常原样传出。"""
+        cached = self.lookup(problem, thought, role, mode)
+        if cached is not None:
+            return cached
+        result = fn()
+        self.store(problem, thought, role, mode, result)
+        return result
+
+    async def acall(self, problem: str, thought: str, role: str, mode: str,
+                    fn: Callable[[], Awaitable[dict]]) -> dict:
+        """
+        call() 的 async 版本：fn() 返回一个 awaitable。
+        查询 (sqlite + 近似匹配扫描) 与写入放到线程中执行，不阻塞事件循环。
+        """
+        if not self.enabled:
+            return await fn()
+        cached = await asyncio.to_thread(self.lookup, problem, thought, role, mode)
+        if cached is not None:
+            return cached
+        result = await fn()
+        await asyncio.to_thread(self.store, problem, thought, role, mode, result)
+        return result
+
+    def clear(self):
+        """删除所有记录。"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM evaluations")
+            conn.commit()
+            self._problems.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        hits = stats["exact_hits"] + stats["near_hits"]
+        stats["enabled"] = self.enabled
+        stats["path"] = self.path
+        stats["hit_rate"] = hits / stats["lookups"] if stats["lookups"] else 0.0
+        return stats
+
+
+eval_memo = EvalMemo()
+
+
+def get_eval_memo_stats() -> dict:
+    return eval_memo.stats()
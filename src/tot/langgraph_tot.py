@@ -1,18 +1,23 @@
-from typing import List, TypedDict
-import json
-from openai import OpenAI
-import os
+from typing import List, Optional, TypedDict
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, END
-from dotenv import load_dotenv
 
-from src.prompts import GENERATOR_SYSTEM_PROMPT, EVALUATOR_SYSTEM_PROMPT
-
-load_dotenv()
-
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.environ.get("OPENROUTER_API_KEY"),
+from src.llm import emit, router, streaming
+from src.llm.structured import (
+    StructuredOutputError,
+    acomplete_structured,
+    complete_structured,
+    thoughts_validator,
+    validate_score
 )
+from src.observability import emit_event, events, log, run_scope, traced
+from src.prompts import GENERATOR_SYSTEM_PROMPT, EVALUATOR_SYSTEM_PROMPT
+from .eval_memo import eval_memo
+from .scoring import aexplain_score, afast_score, explain_score, fast_score
 
 
 # --- 1. 定义"状态" (State) ---
@@ -35,117 +40,508 @@ class ToTState(TypedDict):
     
     # 循环次数限制
     retries: int
+    
+    # 快速打分模式 (只输出分数，理由按需获取)
+    fast_scoring: bool
+
+
+def _generator_request(problem: str, label: str) -> dict:
+    user_prompt = f"[原始问题]:\n{problem}\n\n[需要生成的思想数量]:\n{NUM_THOUGHTS}"
+    return {
+        "role": "generator",
+        "messages": [
+            {"role": "system", "content": GENERATOR_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ],
+        "validator": thoughts_validator(NUM_THOUGHTS),
+        "label": label,
+        "temperature": 0.7,
+        "response_format": {"type": "json_object"}
+    }
+
+
+def _generate_thoughts(problem: str, label: str = "tot.generate") -> List[str]:
+    """
+    调用"生成者"产出 NUM_THOUGHTS 个思想；输出无法解析时返回空列表。
+    """
+    try:
+        return complete_structured(**_generator_request(problem, label))["thoughts"]
+    except StructuredOutputError as e:
+        # 本轮作废，由 decide_next_step 决定是否返工
+        log(f"    生成者输出无法解析: {e}")
+        return []
+
+
+async def _agenerate_thoughts(problem: str, label: str = "tot.generate") -> List[str]:
+    """_generate_thoughts() 的 async 版本。"""
+    try:
+        return (await acomplete_structured(**_generator_request(problem, label)))["thoughts"]
+    except StructuredOutputError as e:
+        log(f"    生成者输出无法解析: {e}")
+        return []
+
+
+def _speculate(problem: str, dropped: threading.Event) -> List[str]:
+    """推测批次的线程入口：排队期间已被丢弃的批次不再发出LLM请求。"""
+    if dropped.is_set():
+        return []
+    return _generate_thoughts(problem, "tot.generate.speculative")
 
 
-def generate(state: ToTState):
+@traced("node.generate")
+def generate(state: ToTState, speculator: Optional["SpeculativeGenerator"] = None):
     """
     (节点 1) 指挥 "生成者Agent" 生成 K 个思想。
+    开启推测模式时，优先采用上一轮评估期间已在后台生成好的思想。
     """
-    print(f"--- 节点: 'generate' (生成者) ---")
-    problem = state["problem"]
+    log(f"--- 节点: 'generate' (生成者) ---")
+    thoughts = speculator.commit(state) if speculator is not None else None
+    if thoughts is None:
+        thoughts = _generate_thoughts(state["problem"])
+    return _generated(state, thoughts)
+
+
+@traced("node.generate")
+async def agenerate(state: ToTState, speculator: Optional["AsyncSpeculativeGenerator"] = None):
+    """generate() 的 async 版本。"""
+    log(f"--- 节点: 'generate' (生成者) ---")
+    thoughts = await speculator.acommit(state) if speculator is not None else None
+    if thoughts is None:
+        thoughts = await _agenerate_thoughts(state["problem"])
+    return _generated(state, thoughts)
+
+
+def _generated(state: ToTState, thoughts: List[str]) -> dict:
     retries = state["retries"]
-    
-    user_prompt = f"[原始问题]:\n{problem}\n\n[需要生成的思想数量]:\n{6}"
-    response = client.chat.completions.create(
-        model="google/gemini-2.5-flash-lite-preview-09-2025",
-        messages=[
-            {"role": "system", "content": GENERATOR_SYSTEM_PROMPT},
-            {"role": "user", "content": user_prompt}
-        ],
-        temperature=0.7,
-        response_format={"type": "json_object"}
-    )
-    
-    print(f"    (第 {retries + 1} 次尝试...)")
+    log(f"    (第 {retries + 1} 次尝试...)")
+    emit_event(events.THOUGHTS_ADDED, round=retries + 1,
+               ids=[_thought_id(retries + 1, i) for i in range(len(thoughts))],
+               thoughts=thoughts)
 
-    result = json.loads(response.choices[0].message.content)
     return {
-        "generated_thoughts": result["thoughts"],
+        "generated_thoughts": thoughts,
         "retries": retries + 1
     }
 
 
-def evaluate(state: ToTState):
+@traced("tot.score_thought")
+def _score_thought(problem: str, thought: str, role: str, fast: bool = False) -> dict:
+    """
+    让指定角色的"批评家"给单个思想打分。
+    fast=True 时只请求分数 (见 scoring.py)；快速打分的回复无法解析时退回到完整评估。
+    开启评估备忘录时，先复用历史上相同或近似思想的分数 (见 eval_memo.py)。
+    """
+    if fast:
+        try:
+            return eval_memo.call(problem, thought, role, "fast", lambda: fast_score(problem, thought, role))
+        except StructuredOutputError as e:
+            log(f"    快速打分失败，改用完整评估: {e}")
+    return eval_memo.call(problem, thought, role, "full",
+                          lambda: complete_structured(**_evaluator_request(problem, thought, role)))
+
+
+@traced("tot.score_thought")
+async def _ascore_thought(problem: str, thought: str, role: str, fast: bool = False) -> dict:
+    """_score_thought() 的 async 版本。"""
+    if fast:
+        try:
+            return await eval_memo.acall(problem, thought, role, "fast", lambda: afast_score(problem, thought, role))
+        except StructuredOutputError as e:
+            log(f"    快速打分失败，改用完整评估: {e}")
+    return await eval_memo.acall(problem, thought, role, "full",
+                                 lambda: acomplete_structured(**_evaluator_request(problem, thought, role)))
+
+
+def _evaluator_request(problem: str, thought: str, role: str) -> dict:
+    user_prompt = f"[原始问题]:\n{problem}\n\n[提议的思考步骤]:\n{thought}"
+    return {
+        "role": role,
+        "messages": [
+            {"role": "system", "content": EVALUATOR_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ],
+        "validator": validate_score,
+        "label": "tot.evaluate",
+        "temperature": 0,
+        "response_format": {"type": "json_object"}
+    }
+
+
+@traced("node.evaluate")
+def evaluate(state: ToTState, speculator: Optional["SpeculativeGenerator"] = None):
     """
     (节点 2) 指挥 "批评家Agent" 评估所有 K 个思想。
+    先用便宜的评估模型打分；分数落在 MIN_QUALITY_SCORE 附近的，
+    再交给更强的模型复评 (见 src.llm.routing)。
+    开启推测模式时，每打完一个分都会检查是否需要提前生成下一轮。
     """
-    print(f"--- 节点: 'evaluate' (批评家) ---")
+    log(f"--- 节点: 'evaluate' (批评家) ---")
     problem = state["problem"]
     thoughts = state["generated_thoughts"]
+    fast = state.get("fast_scoring", False)
     
     evaluations = []
-    for thought in thoughts:
-        user_prompt = f"[原始问题]:\n{problem}\n\n[提议的思考步骤]:\n{thought}"
-        response = client.chat.completions.create(
-            model="google/gemini-2.5-flash-lite-preview-09-2025",
-            messages=[
-                {"role": "system", "content": EVALUATOR_SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0,
-            response_format={"type": "json_object"}
-        )
-        eval_result = json.loads(response.choices[0].message.content)
-        eval_result["thought"] = thought
-        evaluations.append(eval_result)
+    for i, thought in enumerate(thoughts):
+        try:
+            eval_result = _score_thought(problem, thought, "evaluator", fast)
+        except Exception as e:
+            eval_result = _failed_evaluation(e)
+        else:
+            if router.should_escalate(eval_result["score"], MIN_QUALITY_SCORE):
+                eval_result = _escalate(problem, thought, fast, eval_result)
+        evaluations.append(_scored_thought(eval_result, thought, _thought_id(state["retries"], i)))
+        if speculator is not None:
+            speculator.observe(state, evaluations, len(thoughts))
         
     return {"evaluated_thoughts": evaluations}
 
 
-def select_best(state: ToTState):
+@traced("node.evaluate")
+async def aevaluate(state: ToTState, speculator: Optional["AsyncSpeculativeGenerator"] = None):
+    """
+    evaluate() 的 async 版本：K 个思想并发评估 (总并发仍受调度器限流)，
+    结果按思想原来的顺序返回。
+    """
+    log(f"--- 节点: 'evaluate' (批评家) ---")
+    problem = state["problem"]
+    thoughts = state["generated_thoughts"]
+    fast = state.get("fast_scoring", False)
+    finished = []
+
+    async def score(i: int, thought: str) -> dict:
+        try:
+            eval_result = await _ascore_thought(problem, thought, "evaluator", fast)
+        except Exception as e:
+            eval_result = _failed_evaluation(e)
+        else:
+            if router.should_escalate(eval_result["score"], MIN_QUALITY_SCORE):
+                eval_result = await _aescalate(problem, thought, fast, eval_result)
+        eval_result = _scored_thought(eval_result, thought, _thought_id(state["retries"], i))
+        finished.append(eval_result)
+        if speculator is not None:
+            speculator.observe(state, finished, len(thoughts))
+        return eval_result
+
+    evaluations = await asyncio.gather(*(score(i, thought) for i, thought in enumerate(thoughts)))
+    return {"evaluated_thoughts": list(evaluations)}
+
+
+def _escalate(problem: str, thought: str, fast: bool, cheap: dict) -> dict:
+    """分数接近阈值时交给强模型复评；复评失败时保留便宜模型的分数。"""
+    log(f"    (分数 {cheap['score']} 接近阈值，升级到强模型复评...)")
+    try:
+        eval_result = _score_thought(problem, thought, "evaluator_strong", fast)
+    except Exception as e:
+        return _escalation_failed(cheap, e)
+    eval_result["escalated"] = True
+    return eval_result
+
+
+async def _aescalate(problem: str, thought: str, fast: bool, cheap: dict) -> dict:
+    """_escalate() 的 async 版本。"""
+    log(f"    (分数 {cheap['score']} 接近阈值，升级到强模型复评...)")
+    try:
+        eval_result = await _ascore_thought(problem, thought, "evaluator_strong", fast)
+    except Exception as e:
+        return _escalation_failed(cheap, e)
+    eval_result["escalated"] = True
+    return eval_result
+
+
+def _escalation_failed(cheap: dict, error: Exception) -> dict:
+    # 已经有一个有效分数：不要因为复评失败就把这个思想当作"未评估"剪掉
+    log(f"    强模型复评失败，保留原分数 {cheap['score']}: {error}")
+    cheap["escalation_failed"] = True
+    return cheap
+
+
+def _failed_evaluation(error: Exception) -> dict:
+    # 调度器重试耗尽后仍失败：标记为"未评估"，而不是当作0分剪掉
+    log(f"    评估失败: {error}")
+    return {"score": None, "reason": f"评估失败: {error}", "failed": True}
+
+
+def _scored_thought(eval_result: dict, thought: str, thought_id: str) -> dict:
+    eval_result["thought"] = thought
+    eval_result["id"] = thought_id
+    emit_event(events.SCORE, id=thought_id, score=eval_result["score"],
+               escalated=eval_result.get("escalated", False))
+    return eval_result
+
+
+def _thought_id(round_number: int, index: int) -> str:
+    """思想的稳定id: "轮次.序号"，供紧凑事件引用。"""
+    return f"{round_number}.{index + 1}"
+
+
+def _scored(evaluations: List[dict]) -> List[dict]:
+    """过滤掉评估失败 (没有分数) 的思想。"""
+    return [e for e in evaluations if not e.get("failed")]
+
+
+@traced("node.select_best")
+def select_best(state: ToTState, speculator: Optional["SpeculativeGenerator"] = None):
     """
     (节点 3) "剪枝"：从评估中选出最好的一个。
     这是一个*非LLM*的"工具节点"(Tool Node)。
+    走到这里说明不会再返工，未被采用的推测批次在此丢弃。
+    快速打分模式下，只为最终选中的思想补齐理由。
     """
-    print(f"--- 节点: 'select_best' (选择者) ---")
-    evaluations = state["evaluated_thoughts"]
+    best_thought = _pick_best(state, speculator)
+    if best_thought is None:
+        return {"best_thought": {}}
     
-    best_thought = max(evaluations, key=lambda x: x["score"])
+    if best_thought.get("reason") is None:
+        best_thought["reason"] = explain_score(state["problem"], best_thought["thought"], best_thought["score"])
+    emit_event(events.SELECTED, id=best_thought.get("id"), score=best_thought["score"])
     
     return {"best_thought": best_thought}
 
 
+@traced("node.select_best")
+async def aselect_best(state: ToTState, speculator: Optional["AsyncSpeculativeGenerator"] = None):
+    """select_best() 的 async 版本。"""
+    best_thought = _pick_best(state, speculator)
+    if best_thought is None:
+        return {"best_thought": {}}
+
+    if best_thought.get("reason") is None:
+        best_thought["reason"] = await aexplain_score(state["problem"], best_thought["thought"], best_thought["score"])
+    emit_event(events.SELECTED, id=best_thought.get("id"), score=best_thought["score"])
+
+    return {"best_thought": best_thought}
+
+
+def _pick_best(state: ToTState, speculator) -> Optional[dict]:
+    log(f"--- 节点: 'select_best' (选择者) ---")
+    if speculator is not None:
+        speculator.discard()
+    evaluations = _scored(state["evaluated_thoughts"])
+    if not evaluations:
+        log("    没有成功评估的思想。")
+        return None
+    return dict(max(evaluations, key=lambda x: x["score"]))
+
+
+NUM_THOUGHTS = 6
 MIN_QUALITY_SCORE = 7
 MAX_RETRIES = 3
 
 
+# --- 推测式生成 (Speculative Generation) ---
+
+# 进程级共享的推测线程池：所有并发的 run_tot 共用这 2 个线程，
+# 同时在跑的推测批次最多 2 个，其余排队 (排队期间被丢弃的批次不会发出请求)。
+_speculation_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tot-speculate")
+_speculation_stats = {"launched": 0, "committed": 0, "discarded": 0}
+_speculation_lock = threading.Lock()
+
+
+def get_speculation_stats() -> dict:
+    """推测批次的累计统计：发起 / 被采用 / 被丢弃。"""
+    with _speculation_lock:
+        return dict(_speculation_stats)
+
+
+def _count_speculation(key: str):
+    with _speculation_lock:
+        _speculation_stats[key] += 1
+
+
+class SpeculativeGenerator:
+    """
+    推测式生成：第 N 轮还在评估时，如果已评估的一半思想里最高分仍低于 MIN_QUALITY_SCORE，
+    就在后台提前生成第 N+1 轮的思想。
+    decide_next_step 路由回 'generate' 时直接采用 (commit)，路由到 'select' 时丢弃 (discard)。
+    每次运行使用自己的实例 (经由 LangGraph 的 config 传给节点，见 speculation_config)；
+    推测批次还记下它所属的 (问题, 轮次)，commit 时对不上的一律丢弃。
+    """
+
+    def __init__(self):
+        # ((问题, 轮次), future/task, 丢弃标记)
+        self._pending = None
+
+    def observe(self, state: ToTState, evaluations: List[dict], total: int):
+        if self._pending is not None or state["retries"] >= MAX_RETRIES:
+            return
+        scored = _scored(evaluations)
+        if len(evaluations) * 2 < total or not scored:
+            return
+        best_so_far = max(e["score"] for e in scored)
+        if best_so_far >= MIN_QUALITY_SCORE:
+            return
+
+        log(f"    (前 {len(evaluations)}/{total} 个思想最高分仅 {best_so_far}，后台推测生成下一轮...)")
+        dropped = threading.Event()
+        self._pending = ((state["problem"], state["retries"]), self._launch(state["problem"], dropped), dropped)
+        _count_speculation("launched")
+
+    def _launch(self, problem: str, dropped: threading.Event):
+        ctx = contextvars.copy_context()
+        return _speculation_executor.submit(ctx.run, _speculate, problem, dropped)
+
+    @staticmethod
+    def _cancel(pending):
+        """
+        丢弃推测批次。future.cancel() 只能撤下还在排队的批次；已经开始执行的，
+        靠丢弃标记在发出LLM请求前退出。已经发出的请求无法中途收回，只是结果不再被采用。
+        """
+        _, future, dropped = pending
+        dropped.set()
+        future.cancel()
+
+    def _take(self, state: ToTState):
+        """取出属于当前问题、当前轮次的推测批次。"""
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return None
+        if pending[0] != (state["problem"], state["retries"]):
+            log("    (推测批次不属于当前问题/轮次，丢弃)")
+            self._cancel(pending)
+            _count_speculation("discarded")
+            return None
+        return pending[1]
+
+    def commit(self, state: ToTState) -> Optional[List[str]]:
+        """取出推测批次；没有推测批次、批次不属于当前轮次或推测失败时返回 None。"""
+        pending = self._take(state)
+        if pending is None:
+            return None
+        try:
+            thoughts = pending.result()
+        except Exception as e:
+            return self._rejected(e)
+        return self._accepted(thoughts)
+
+    def _rejected(self, error: Exception) -> None:
+        log(f"    推测批次失败，改为正常生成: {error}")
+        _count_speculation("discarded")
+        return None
+
+    def _accepted(self, thoughts: List[str]) -> Optional[List[str]]:
+        if not thoughts:
+            _count_speculation("discarded")
+            return None
+        log("    (采用推测生成的思想)")
+        _count_speculation("committed")
+        return thoughts
+
+    def discard(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            self._cancel(pending)
+            _count_speculation("discarded")
+
+
+class AsyncSpeculativeGenerator(SpeculativeGenerator):
+    """
+    SpeculativeGenerator 的 async 版本：推测批次是同一事件循环中的一个 task，
+    被丢弃时直接取消 (连同正在进行的LLM请求)。
+    """
+
+    def _launch(self, problem: str, dropped: threading.Event):
+        return asyncio.ensure_future(_agenerate_thoughts(problem, "tot.generate.speculative"))
+
+    @staticmethod
+    def _cancel(pending):
+        pending[1].cancel()
+
+    async def acommit(self, state: ToTState) -> Optional[List[str]]:
+        pending = self._take(state)
+        if pending is None:
+            return None
+        try:
+            thoughts = await pending
+        except Exception as e:
+            return self._rejected(e)
+        return self._accepted(thoughts)
+
+
+@traced("router.decide_next_step")
 def decide_next_step(state: ToTState):
     """
     (决策者 - "扳道工")
     这不是一个"节点",它是一个"路由函数"。
     它检查"评估"节点的分数,并决定下一步是"返工"还是"通过"。
     """
-    print(f"--- 决策者 (Router): 检查品控 ---")
+    log(f"--- 决策者 (Router): 检查品控 ---")
     
-    evaluations = state["evaluated_thoughts"]
+    evaluations = _scored(state["evaluated_thoughts"])
     retries = state["retries"]
     
-    best_score = max(evaluation["score"] for evaluation in evaluations)
-    print(f"    最高分: {best_score}/10 (阈值: {MIN_QUALITY_SCORE})")
-    print(f"    重试次数: {retries}/{MAX_RETRIES}")
+    best_score = max((evaluation["score"] for evaluation in evaluations), default=0)
+    log(f"    最高分: {best_score}/10 (阈值: {MIN_QUALITY_SCORE})")
+    log(f"    重试次数: {retries}/{MAX_RETRIES}")
 
     if best_score < MIN_QUALITY_SCORE and state["retries"] < MAX_RETRIES:
-        print(f"--- 决策: 质量不佳 (最高分 {best_score} < 7)，正在返工... ---")
+        log(f"--- 决策: 质量不佳 (最高分 {best_score} < 7)，正在返工... ---")
+        emit_event(events.DECISION, route="generate", best_score=best_score, retries=retries)
         return "generate"
 
     else:
         if state["retries"] >= MAX_RETRIES:
-            print(f"--- 决策: 已达最大返工次数 {MAX_RETRIES}。---")
-        print("--- 决策: 质量达标 (或已放弃)，进入最终选择... ---")
+            log(f"--- 决策: 已达最大返工次数 {MAX_RETRIES}。---")
+        log("--- 决策: 质量达标 (或已放弃)，进入最终选择... ---")
+        emit_event(events.DECISION, route="select", best_score=best_score, retries=retries)
         return "select"
 
 
-def create_tot_workflow():
+def speculation_config(speculator: SpeculativeGenerator) -> RunnableConfig:
+    """把一次运行专用的推测生成器放进 LangGraph 的 config (推测模式的工作流从这里取)。"""
+    return {"configurable": {"speculator": speculator}}
+
+
+def _speculator(config: Optional[RunnableConfig]):
+    return ((config or {}).get("configurable") or {}).get("speculator")
+
+
+def create_tot_workflow(speculative: bool = False):
     """
     创建并编译Tree of Thought工作流
+    speculative: 开启推测式生成，在评估期间提前生成下一轮思想 (见 SpeculativeGenerator)。
+        编译出的工作流可以重复使用，每次运行通过 config=speculation_config(SpeculativeGenerator())
+        传入自己的推测生成器；不传时不做推测。
+    """
+    log("\n--- 正在构建工作流 (Graph) ---")
+
+    if speculative:
+        return _compile_workflow(
+            lambda state, config: generate(state, _speculator(config)),
+            lambda state, config: evaluate(state, _speculator(config)),
+            lambda state, config: select_best(state, _speculator(config)),
+        )
+    return _compile_workflow(generate, evaluate, select_best)
+
+
+def create_async_tot_workflow(speculative: bool = False):
+    """
+    create_tot_workflow() 的 async 版本：节点都是 async 函数，供 ainvoke / astream 使用。
+    推测模式下每次运行传入自己的 AsyncSpeculativeGenerator。
     """
-    print("\n--- 正在构建工作流 (Graph) ---")
+    log("\n--- 正在构建工作流 (Graph, async) ---")
 
+    if not speculative:
+        return _compile_workflow(agenerate, aevaluate, aselect_best)
+
+    # LangGraph 根据函数本身判断是否为 async，所以这里不能用 lambda
+    async def generate_node(state: ToTState, config: RunnableConfig):
+        return await agenerate(state, _speculator(config))
+
+    async def evaluate_node(state: ToTState, config: RunnableConfig):
+        return await aevaluate(state, _speculator(config))
+
+    async def select_node(state: ToTState, config: RunnableConfig):
+        return await aselect_best(state, _speculator(config))
+
+    return _compile_workflow(generate_node, evaluate_node, select_node)
+
+
+def _compile_workflow(generate_node, evaluate_node, select_node):
     workflow = StateGraph(ToTState)
 
-    workflow.add_node("generate", generate)
-    workflow.add_node("evaluate", evaluate)
-    workflow.add_node("select_best", select_best)
+    workflow.add_node("generate", generate_node)
+    workflow.add_node("evaluate", evaluate_node)
+    workflow.add_node("select_best", select_node)
 
     workflow.set_entry_point("generate")
 
@@ -164,41 +560,94 @@ def create_tot_workflow():
 
     app = workflow.compile()
 
-    print("--- 工作流已编译! ---")
+    log("--- 工作流已编译! ---")
     return app
 
 
-def run_tot(problem: str):
+@traced("run.tot")
+def run_tot(problem: str, on_event=None, speculative: bool = False, fast_scoring: bool = False):
     """
     运行Tree of Thought流程
+    on_event: 可选的事件回调，传入后开启流式输出 (token / 节点事件，见 src.llm.streaming)
+    speculative: 开启推测式生成
+    fast_scoring: 评估时只请求分数，理由只为最终选中的思想获取 (见 scoring.py)
     """
-    app = create_tot_workflow()
+    app = create_tot_workflow(speculative=speculative)
     
-    print("\n--- 启动 LangGraph 流程... ---")
+    log("\n--- 启动 LangGraph 流程... ---")
     
     initial_input = {
         "problem": problem,
-        "retries": 0
+        "retries": 0,
+        "fast_scoring": fast_scoring
     }
     
     final_state = None
+    speculator = SpeculativeGenerator() if speculative else None
+    config = speculation_config(speculator) if speculative else None
     
-    for s in app.stream(initial_input):
-        print(f"\n--- 状态更新 (来自节点: {list(s.keys())[0]}) ---")
-        print(s[list(s.keys())[0]])
-        
-        final_state = s[list(s.keys())[0]]
+    with streaming(on_event), run_scope("tot", speculative=speculative, fast_scoring=fast_scoring):
+        try:
+            for s in app.stream(initial_input, config=config):
+                final_state = _on_step(s)
+        finally:
+            # 运行结束或异常中断时丢弃推测批次：尚未发出请求的不再发出，
+            # 已经在途的请求会跑完，但结果不再被采用
+            if speculator is not None:
+                speculator.discard()
 
-    print("\n" + "="*30)
-    print("--- 流程执行完毕 (END) ---")
-    
-    print("最终的 'State' 内容:")
-    print(final_state)
+    return _report(final_state)
+
+
+@traced("run.tot")
+async def arun_tot(problem: str, on_event=None, speculative: bool = False, fast_scoring: bool = False):
+    """
+    run_tot() 的 async 版本 (基于 LangGraph 的 astream)。
+    同一个事件循环上可以同时运行大量 arun_tot；取消会传进正在进行的LLM请求。
+    """
+    app = create_async_tot_workflow(speculative=speculative)
+
+    log("\n--- 启动 LangGraph 流程 (async)... ---")
+
+    initial_input = {
+        "problem": problem,
+        "retries": 0,
+        "fast_scoring": fast_scoring
+    }
+
+    final_state = None
+    speculator = AsyncSpeculativeGenerator() if speculative else None
+    config = speculation_config(speculator) if speculative else None
+
+    with streaming(on_event), run_scope("tot", speculative=speculative, fast_scoring=fast_scoring):
+        try:
+            async for s in app.astream(initial_input, config=config):
+                final_state = _on_step(s)
+        finally:
+            if speculator is not None:
+                speculator.discard()
+
+    return _report(final_state)
+
+
+def _on_step(s: dict) -> dict:
+    node = list(s.keys())[0]
+    # 只发出"步骤切换"这一增量，节点各自发出自己的变化 (新思想、分数、决策)
+    emit_event(events.STEP, node=node)
+    emit({"type": "node", "node": node, "update": s[node]})
+    return s[node]
+
+
+def _report(final_state: dict) -> dict:
+    log("\n" + "="*30)
+    log("--- 流程执行完毕 (END) ---")
     
     best_thought = final_state.get("best_thought", {})
     
-    print("\n--- 最终选择的思考 (来自 'best_thought') ---")
-    print(best_thought)
+    log("\n--- 最终选择的思考 (来自 'best_thought') ---")
+    log(f"分数: {best_thought.get('score')}/10")
+    log(f"思想: {best_thought.get('thought')}")
+    log(f"理由: {best_thought.get('reason')}")
     
     return final_state
 
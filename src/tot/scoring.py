@@ -0,0 +1,182 @@
+"""
+快速打分 (Fast Scoring)
+decide_next_step 与 select_best 只用到分数，所以评估时可以只让模型输出一个整数
+(max_tokens 很小)；提供商返回 logprobs 时，用0~10各数字token的概率算出期望分数，
+得到比单个整数更平滑的分数。理由只在最终选中的思想上按需补齐 (explain_score)。
+"""
+import math
+import re
+from typing import List, Optional
+
+import openai
+
+from src.llm import achat_completion, acomplete, chat_completion, complete, router
+from src.llm.structured import StructuredOutputError
+from src.observability import traced
+from src.prompts import SCORE_ONLY_EVALUATOR_PROMPT, SCORE_REASON_PROMPT
+
+# "10" 可能被切成两个token
+FAST_SCORE_MAX_TOKENS = 2
+TOP_LOGPROBS = 10
+
+_SCORE_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+
+# 请求 logprobs 被拒绝过的模型，之后不再请求
+_no_logprobs_models = set()
+
+
+def expected_score(token_logprobs: List[list]) -> Optional[float]:
+    """
+    根据输出token的 top_logprobs 计算期望分数。
+    只统计 "0"~"10" 这些数字token，并按它们的概率归一化；没有数字token时返回 None。
+    "10" 常被切成 "1" + "0"，所以第一个token上 "1" 的概率不能直接当作1分：
+    贪心结果以 "1" 开头时，用第二个token的分布把它拆成 "10" 与 "1"；
+    否则第二个token的分布与 "1" 无关，这部分概率无法区分，直接丢弃。
+    """
+    if not token_logprobs:
+        return None
+    first = token_logprobs[0]
+    probs = {}
+    for token, logprob in first:
+        token = token.strip()
+        if token.isdigit() and int(token) <= 10:
+            probs[int(token)] = probs.get(int(token), 0.0) + math.exp(logprob)
+
+    one = probs.pop(1, 0.0)
+    greedy = max(first, key=lambda item: item[1])[0].strip() if first else ""
+    if one > 0 and greedy == "1":
+        if len(token_logprobs) > 1:
+            zero = sum(math.exp(logprob) for token, logprob in token_logprobs[1] if token.strip() == "0")
+            probs[10] = probs.get(10, 0.0) + one * zero
+            probs[1] = one * (1 - zero)
+        else:
+            # 回复在 "1" 之后就结束了
+            probs[1] = one
+
+    total = sum(probs.values())
+    if total <= 0:
+        return None
+    return sum(value * p for value, p in probs.items()) / total
+
+
+def _parse_score(content: str) -> float:
+    match = _SCORE_PATTERN.search(content or "")
+    if not match:
+        raise StructuredOutputError(f"快速打分的回复中没有数字: {content!r}")
+    score = float(match.group(0))
+    if not 0 <= score <= 10:
+        raise StructuredOutputError(f"score 超出0到10的范围: {score}")
+    return score
+
+
+def _score_messages(problem: str, thought: str) -> list:
+    return [
+        {"role": "system", "content": SCORE_ONLY_EVALUATOR_PROMPT},
+        {"role": "user", "content": f"[原始问题]:\n{problem}\n\n[提议的思考步骤]:\n{thought}"}
+    ]
+
+
+def _score_params(model: str) -> dict:
+    params = {"temperature": 0, "max_tokens": FAST_SCORE_MAX_TOKENS}
+    if model not in _no_logprobs_models:
+        params.update(logprobs=True, top_logprobs=TOP_LOGPROBS)
+    return params
+
+
+def _logprobs_rejected(error: openai.BadRequestError) -> bool:
+    # 只有确实是 logprobs 参数被拒绝时才退回；其他 400 错误原样抛出
+    return "logprob" in str(error).lower()
+
+
+def _without_logprobs(model: str, params: dict) -> dict:
+    # 该模型/提供商不支持 logprobs：记住并退回到只读整数
+    _no_logprobs_models.add(model)
+    return {k: v for k, v in params.items() if k not in ("logprobs", "top_logprobs")}
+
+
+def _fast_result(result: dict) -> dict:
+    greedy = _parse_score(result["content"])
+    expected = expected_score(result["logprobs"])
+    if expected is None:
+        score = greedy
+    else:
+        score = round(expected, 2)
+    if float(score).is_integer():
+        score = int(score)
+    return {"score": score, "reason": None, "fast": True}
+
+
+@traced("tot.fast_score")
+def fast_score(problem: str, thought: str, role: str = "evaluator") -> dict:
+    """
+    只让模型输出分数。返回 {"score": 分数, "reason": None, "fast": True}；
+    回复中没有合法分数时抛出 StructuredOutputError。
+    """
+    messages = _score_messages(problem, thought)
+    model = router.model_for(role)
+    params = _score_params(model)
+
+    try:
+        result = complete(messages, role=role, label="tot.evaluate.fast", allow_stream=False, **params)
+    except openai.BadRequestError as e:
+        if "logprobs" not in params or not _logprobs_rejected(e):
+            raise
+        params = _without_logprobs(model, params)
+        result = complete(messages, role=role, label="tot.evaluate.fast", allow_stream=False, **params)
+
+    return _fast_result(result)
+
+
+@traced("tot.fast_score")
+async def afast_score(problem: str, thought: str, role: str = "evaluator") -> dict:
+    """fast_score() 的 async 版本。"""
+    messages = _score_messages(problem, thought)
+    model = router.model_for(role)
+    params = _score_params(model)
+
+    try:
+        result = await acomplete(messages, role=role, label="tot.evaluate.fast", allow_stream=False, **params)
+    except openai.BadRequestError as e:
+        if "logprobs" not in params or not _logprobs_rejected(e):
+            raise
+        params = _without_logprobs(model, params)
+        result = await acomplete(messages, role=role, label="tot.evaluate.fast", allow_stream=False, **params)
+
+    return _fast_result(result)
+
+
+def _reason_messages(problem: str, thought: str, score) -> list:
+    return [
+        {"role": "system", "content": SCORE_REASON_PROMPT},
+        {"role": "user", "content": f"[原始问题]:\n{problem}\n\n[提议的思考步骤]:\n{thought}\n\n[分数]:\n{score}/10"}
+    ]
+
+
+@traced("tot.explain_score")
+def explain_score(problem: str, thought: str, score, role: str = "evaluator") -> str:
+    """为已经打好分的思想补一句理由 (只对最终选中的思想调用)。"""
+    try:
+        return chat_completion(
+            role=role,
+            messages=_reason_messages(problem, thought, score),
+            label="tot.explain",
+            temperature=0,
+            max_tokens=120
+        ).strip()
+    except Exception as e:
+        return f"理由获取失败: {e}"
+
+
+@traced("tot.explain_score")
+async def aexplain_score(problem: str, thought: str, score, role: str = "evaluator") -> str:
+    """explain_score() 的 async 版本。"""
+    try:
+        return (await achat_completion(
+            role=role,
+            messages=_reason_messages(problem, thought, score),
+            label="tot.explain",
+            temperature=0,
+            max_tokens=120
+        )).strip()
+    except Exception as e:
+        return f"理由获取失败: {e}"
@@ -1,60 +1,128 @@
-from openai import OpenAI
-import json
-import os
-from dotenv import load_dotenv
+import asyncio
 
+from src.llm import emit, streaming
+from src.llm.structured import (
+    StructuredOutputError,
+    acomplete_structured,
+    complete_structured,
+    thoughts_validator,
+    validate_score
+)
+from src.observability import emit_event, events, log, run_scope, traced
 from src.prompts import GENERATOR_SYSTEM_PROMPT, EVALUATOR_SYSTEM_PROMPT
+from .eval_memo import eval_memo
+from .scoring import aexplain_score, afast_score, explain_score, fast_score
 
-load_dotenv()
-
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.environ.get("OPENROUTER_API_KEY"),
-)
+# 协调器版本的模型角色 (默认模型见 src.llm.routing)
+GENERATOR_ROLE = "orchestrator_generator"
+EVALUATOR_ROLE = "orchestrator_evaluator"
 
-print("--- '协调器' (Orchestrator) 已启动 ---")
-print("已成功加载 '生成者' 和 '批评家' 的Prompts。")
+log("--- '协调器' (Orchestrator) 已启动 ---")
+log("已成功加载 '生成者' 和 '批评家' 的Prompts。")
 
 
+@traced("orchestrator.generate_thoughts")
 def generate_thoughts(problem_description, k):
     """
     指挥 "生成者Agent" 进行发散思维，生成 k 个不同的思考步骤。
     """
-    print(f"\n--- 正在调用 '生成者Agent' 生成 {k} 个思想 ---")
+    log(f"\n--- 正在调用 '生成者Agent' 生成 {k} 个思想 ---")
     
-    user_prompt = f"""
-[原始问题]:
-{problem_description}
+    try:
+        result = complete_structured(**_generator_request(problem_description, k))
+        return result["thoughts"]
+
+    except Exception as e:
+        log(f"调用 '生成者Agent' 时出错: {e}")
+        return []
 
-[需要生成的思想数量]:
-{k}
-"""
+
+@traced("orchestrator.generate_thoughts")
+async def agenerate_thoughts(problem_description, k):
+    """generate_thoughts() 的 async 版本。"""
+    log(f"\n--- 正在调用 '生成者Agent' 生成 {k} 个思想 ---")
 
     try:
-        response = client.chat.completions.create(
-            model="nvidia/nemotron-nano-12b-v2-vl:free",
-            messages=[
-                {"role": "system", "content": GENERATOR_SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-            response_format={"type": "json_object"}
-        )
-        
-        result = json.loads(response.choices[0].message.content)
+        result = await acomplete_structured(**_generator_request(problem_description, k))
         return result["thoughts"]
 
     except Exception as e:
-        print(f"调用 '生成者Agent' 时出错: {e}")
+        log(f"调用 '生成者Agent' 时出错: {e}")
         return []
 
 
-def evaluate_thought(problem_description, thought_step):
+def _generator_request(problem_description, k) -> dict:
+    user_prompt = f"""
+[原始问题]:
+{problem_description}
+
+[需要生成的思想数量]:
+{k}
+"""
+    return {
+        "role": GENERATOR_ROLE,
+        "messages": [
+            {"role": "system", "content": GENERATOR_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ],
+        "validator": thoughts_validator(k),
+        "label": "tot.generate",
+        "temperature": 0.7,
+        "response_format": {"type": "json_object"}
+    }
+
+
+@traced("orchestrator.evaluate_thought")
+def evaluate_thought(problem_description, thought_step, fast: bool = False):
     """
     指挥 "批评家Agent" 进行收敛思维，评估单个思想的价值。
+    fast=True 时只请求分数 (见 scoring.py)，理由为 None。
+    开启评估备忘录时，先复用历史上相同或近似思想的分数 (见 eval_memo.py)。
     """
-    print(f"--- 正在调用 '批评家Agent' 评估: '{thought_step}' ---")
+    log(f"--- 正在调用 '批评家Agent' 评估: '{thought_step}' ---")
     
+    if fast:
+        try:
+            return eval_memo.call(problem_description, thought_step, EVALUATOR_ROLE, "fast",
+                                  lambda: fast_score(problem_description, thought_step, EVALUATOR_ROLE))
+        except StructuredOutputError as e:
+            log(f"快速打分失败，改用完整评估: {e}")
+        except Exception as e:
+            # 调度器重试耗尽等错误：不要再花钱做一次完整评估
+            return _failed_evaluation(e)
+
+    try:
+        return eval_memo.call(problem_description, thought_step, EVALUATOR_ROLE, "full",
+                              lambda: complete_structured(**_evaluator_request(problem_description, thought_step)))
+
+    except Exception as e:
+        return _failed_evaluation(e)
+
+
+@traced("orchestrator.evaluate_thought")
+async def aevaluate_thought(problem_description, thought_step, fast: bool = False):
+    """evaluate_thought() 的 async 版本。"""
+    log(f"--- 正在调用 '批评家Agent' 评估: '{thought_step}' ---")
+
+    if fast:
+        try:
+            return await eval_memo.acall(problem_description, thought_step, EVALUATOR_ROLE, "fast",
+                                         lambda: afast_score(problem_description, thought_step, EVALUATOR_ROLE))
+        except StructuredOutputError as e:
+            log(f"快速打分失败，改用完整评估: {e}")
+        except Exception as e:
+            # 调度器重试耗尽等错误：不要再花钱做一次完整评估
+            return _failed_evaluation(e)
+
+    try:
+        return await eval_memo.acall(problem_description, thought_step, EVALUATOR_ROLE, "full",
+                                     lambda: acomplete_structured(**_evaluator_request(problem_description, thought_step)))
+
+    except Exception as e:
+        return _failed_evaluation(e)
+
+
+def _evaluator_request(problem_description, thought_step) -> dict:
     user_prompt = f"""
 [原始问题]:
 {problem_description}
@@ -62,75 +130,166 @@ def evaluate_thought(problem_description, thought_step):
 [提议的思考步骤]:
 {thought_step}
 """
+    return {
+        "role": EVALUATOR_ROLE,
+        "messages": [
+            {"role": "system", "content": EVALUATOR_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ],
+        "validator": validate_score,
+        "label": "tot.evaluate",
+        "temperature": 0,
+        "response_format": {"type": "json_object"}
+    }
 
-    try:
-        response = client.chat.completions.create(
-            model="nvidia/nemotron-nano-12b-v2-vl:free",
-            messages=[
-                {"role": "system", "content": EVALUATOR_SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0,
-            response_format={"type": "json_object"}
-        )
-        
-        return json.loads(response.choices[0].message.content)
 
-    except Exception as e:
-        print(f"调用 '批评家Agent' 时出错: {e}")
-        return {"score": 0, "reason": f"评估失败: {e}"}
+def _failed_evaluation(error: Exception) -> dict:
+    # 调度器重试耗尽后仍失败：不要伪装成0分，否则好的思想会被错误地剪掉
+    log(f"调用 '批评家Agent' 时出错: {error}")
+    return {"score": None, "reason": f"评估失败: {error}", "failed": True}
 
 
-def run_tot_orchestrator(problem: str, k: int = 6):
+@traced("run.tot_orchestrator")
+def run_tot_orchestrator(problem: str, k: int = 6, on_event=None, fast_scoring: bool = False):
     """
     运行Tree of Thought协调器版本
+    on_event: 可选的事件回调，传入后开启流式输出 (见 src.llm.streaming)
+    fast_scoring: 评估时只请求分数，理由只为最终选中的思想获取
+    """
+    with streaming(on_event), run_scope("tot-orchestrator", k=k, fast_scoring=fast_scoring):
+        return _run_tot_orchestrator(problem, k, fast_scoring)
+
+
+@traced("run.tot_orchestrator")
+async def arun_tot_orchestrator(problem: str, k: int = 6, on_event=None, fast_scoring: bool = False):
+    """
+    run_tot_orchestrator() 的 async 版本：k 个思想并发评估，取消会传进正在进行的LLM请求。
     """
-    print(f"--- 启动ToT单步循环 (k={k}) ---")
-    print(f"问题: {problem}\n")
+    with streaming(on_event), run_scope("tot-orchestrator", k=k, fast_scoring=fast_scoring):
+        return await _arun_tot_orchestrator(problem, k, fast_scoring)
+
+
+def _run_tot_orchestrator(problem: str, k: int, fast_scoring: bool = False):
+    """
+    协调器主循环：发散 -> 收敛 -> 剪枝与选择
+    """
+    _log_start(problem, k)
 
     # 1. --- 发散 (Diverge) ---
     try:
-        generated_thoughts = generate_thoughts(problem, k)
+        generated_thoughts = _generated(generate_thoughts(problem, k))
     except Exception as e:
-        print(f"主循环中 '生成' 步骤失败: {e}")
+        log(f"主循环中 '生成' 步骤失败: {e}")
         generated_thoughts = []
 
     # 2. --- 收敛 (Converge) ---
     evaluated_thoughts = []
     
     if generated_thoughts:
-        print("\n--- '协调器' 正在将任务分发给 '批评家' ---")
+        log("\n--- '协调器' 正在将任务分发给 '批评家' ---")
         
-        for thought in generated_thoughts:
-            evaluation = evaluate_thought(problem, thought)
-            
-            evaluated_thoughts.append({
-                "thought": thought,
-                "score": evaluation.get("score", 0),
-                "reason": evaluation.get("reason", "N/A")
-            })
-
-        print("\n--- 所有思想已评估完毕 ---")
-        print(json.dumps(evaluated_thoughts, indent=2, ensure_ascii=False))
+        for i, thought in enumerate(generated_thoughts):
+            evaluation = evaluate_thought(problem, thought, fast_scoring)
+            evaluated_thoughts.append(_evaluated(i, thought, evaluation))
+
+        log("\n--- 所有思想已评估完毕 ---")
     else:
-        print("--- '生成者' 未能产生任何思想 ---")
+        log("--- '生成者' 未能产生任何思想 ---")
 
     # --- 4. 剪枝与选择 (Prune & Select) ---
-    if evaluated_thoughts:
-        best_thought_data = max(evaluated_thoughts, key=lambda x: x["score"])
-
-        print("\n" + "="*30)
-        print("--- 最终选择 (Best Thought) ---")
-        print(f"最佳思考路径 (分数: {best_thought_data['score']}/10):")
-        print(f"  思想: {best_thought_data['thought']}")
-        print(f"  理由: {best_thought_data['reason']}")
-        print("="*30)
-        
-        return best_thought_data
+    best_thought_data = _pick_best(evaluated_thoughts)
+    if best_thought_data is None:
+        return None
+    if best_thought_data["reason"] is None:
+        best_thought_data["reason"] = explain_score(
+            problem, best_thought_data["thought"], best_thought_data["score"], EVALUATOR_ROLE
+        )
+    return _report_best(best_thought_data)
+
+
+async def _arun_tot_orchestrator(problem: str, k: int, fast_scoring: bool = False):
+    """_run_tot_orchestrator() 的 async 版本。"""
+    _log_start(problem, k)
+
+    try:
+        generated_thoughts = _generated(await agenerate_thoughts(problem, k))
+    except Exception as e:
+        log(f"主循环中 '生成' 步骤失败: {e}")
+        generated_thoughts = []
+
+    evaluated_thoughts = []
+
+    if generated_thoughts:
+        log("\n--- '协调器' 正在将任务分发给 '批评家' ---")
+
+        async def evaluate(i: int, thought: str) -> dict:
+            return _evaluated(i, thought, await aevaluate_thought(problem, thought, fast_scoring))
+
+        evaluated_thoughts = list(await asyncio.gather(
+            *(evaluate(i, thought) for i, thought in enumerate(generated_thoughts))
+        ))
+
+        log("\n--- 所有思想已评估完毕 ---")
     else:
-        print("\n--- 最终选择 ---")
-        print("没有可供选择的思想。")
+        log("--- '生成者' 未能产生任何思想 ---")
+
+    best_thought_data = _pick_best(evaluated_thoughts)
+    if best_thought_data is None:
+        return None
+    if best_thought_data["reason"] is None:
+        best_thought_data["reason"] = await aexplain_score(
+            problem, best_thought_data["thought"], best_thought_data["score"], EVALUATOR_ROLE
+        )
+    return _report_best(best_thought_data)
+
+
+def _log_start(problem: str, k: int):
+    log(f"--- 启动ToT单步循环 (k={k}) ---")
+    log(f"问题: {problem}\n")
+
+
+def _generated(generated_thoughts: list) -> list:
+    emit({"type": "node", "node": "generate", "update": {"generated_thoughts": generated_thoughts}})
+    emit_event(events.THOUGHTS_ADDED, round=1,
+               ids=[str(i + 1) for i in range(len(generated_thoughts))],
+               thoughts=generated_thoughts)
+    return generated_thoughts
+
+
+def _evaluated(i: int, thought: str, evaluation: dict) -> dict:
+    evaluated = {
+        "id": str(i + 1),
+        "thought": thought,
+        "score": evaluation.get("score", 0),
+        "reason": evaluation.get("reason", "N/A"),
+        "failed": evaluation.get("failed", False)
+    }
+    emit({"type": "node", "node": "evaluate", "update": evaluated})
+    emit_event(events.SCORE, id=evaluated["id"], score=evaluated["score"])
+    return evaluated
+
+
+def _pick_best(evaluated_thoughts: list):
+    scored_thoughts = [e for e in evaluated_thoughts if not e["failed"]]
+    if not scored_thoughts:
+        log("\n--- 最终选择 ---")
+        log("没有可供选择的思想。")
         return None
+    return max(scored_thoughts, key=lambda x: x["score"])
+
+
+def _report_best(best_thought_data: dict) -> dict:
+    emit({"type": "node", "node": "select_best", "update": {"best_thought": best_thought_data}})
+    emit_event(events.SELECTED, id=best_thought_data["id"], score=best_thought_data["score"])
+
+    log("\n" + "="*30)
+    log("--- 最终选择 (Best Thought) ---")
+    log(f"最佳思考路径 (分数: {best_thought_data['score']}/10):")
+    log(f"  思想: {best_thought_data['thought']}")
+    log(f"  理由: {best_thought_data['reason']}")
+    log("="*30)
+    
+    return best_thought_data
 
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+"""批量运行：任务文件解析与各进程统计的汇总"""
+import os
+
+import pytest
+
+pytest.importorskip("openai")
+
+from src.batch.runner import _restore_env, _split_rate_limits, load_jobs, merge_stats  # noqa: E402
+
+
+def test_load_jobs_jsonl(tmp_path):
+    path = tmp_path / "jobs.jsonl"
+    path.write_text(
+        '# 注释\n'
+        '{"problem": "问题一"}\n'
+        '\n'
+        '{"problem": "问题二", "mode": "planner", "k": 4}\n',
+        encoding="utf-8",
+    )
+    assert load_jobs(str(path)) == [
+        {"problem": "问题一", "mode": "tot"},
+        {"problem": "问题二", "mode": "planner", "k": 4},
+    ]
+
+
+def test_load_jobs_plain_text(tmp_path):
+    path = tmp_path / "jobs.txt"
+    path.write_text("问题一\n# 跳过\n问题二\n", encoding="utf-8")
+    assert [job["problem"] for job in load_jobs(str(path), default_mode="planner")] == ["问题一", "问题二"]
+
+
+@pytest.mark.parametrize("line", ['{"mode": "tot"}', '{"problem": "x", "mode": "unknown"}'])
+def test_load_jobs_rejects_invalid_lines(tmp_path, line):
+    path = tmp_path / "jobs.jsonl"
+    path.write_text(line + "\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="jobs.jsonl:1"):
+        load_jobs(str(path))
+
+
+def _snapshot(calls: int, latency: float, wait_max: float, repaired: int) -> dict:
+    return {
+        "routes": [{"role": "generator", "model": "m", "calls": calls, "total_latency": latency,
+                    "prompt_tokens": 10, "completion_tokens": 5, "cost": 0.0}],
+        "scheduler": {"calls": calls, "queue_wait_total": latency, "queue_wait_max": wait_max},
+        "structured": {"calls": calls, "repaired": repaired, "rerequested": 0, "repair_rate": 0.9},
+        "eval_memo": {"enabled": False},
+    }
+
+
+def test_merge_stats():
+    merged = merge_stats([_snapshot(2, 1.0, 0.5, 1), _snapshot(3, 2.0, 0.2, 0)])
+    route, = merged["routes"]
+    assert route["calls"] == 5 and route["avg_latency"] == pytest.approx(0.6)
+    assert merged["scheduler"] == {"calls": 5, "queue_wait_total": 3.0, "queue_wait_max": 0.5}
+    assert merged["structured"]["repair_rate"] == pytest.approx(0.2)
+    assert merged["eval_memo"] == {}
+
+
+def test_rate_limits_split_and_restored(monkeypatch):
+    monkeypatch.setenv("THINKFLOW_RPM_PER_MODEL", "30")
+    monkeypatch.delenv("THINKFLOW_RPM_PER_PROVIDER", raising=False)
+    previous = _split_rate_limits(3)
+    assert float(os.environ["THINKFLOW_RPM_PER_MODEL"]) == 10
+    assert float(os.environ["THINKFLOW_RPM_PER_PROVIDER"]) == 20
+    _restore_env(previous)
+    assert os.environ["THINKFLOW_RPM_PER_MODEL"] == "30"
+    assert "THINKFLOW_RPM_PER_PROVIDER" not in os.environ
@@ -0,0 +1,35 @@
+"""录制/回放：录下的交互可以原样回放"""
+import pytest
+
+pytest.importorskip("openai")
+httpx = pytest.importorskip("httpx")
+
+from src.llm.cassette import CassetteMiss, CassetteTransport, recorded, use_cassette  # noqa: E402
+
+
+def test_function_round_trip(tmp_path):
+    path = str(tmp_path / "run.cassette.json")
+    with use_cassette(path, mode="record"):
+        assert recorded("search", "q1", lambda: {"hits": ["a", "b"]}) == {"hits": ["a", "b"]}
+
+    with use_cassette(path, mode="replay", latency_scale=0) as cassette:
+        assert recorded("search", "q1", lambda: pytest.fail("回放时不应调用")) == {"hits": ["a", "b"]}
+        with pytest.raises(CassetteMiss):
+            recorded("search", "q2", lambda: None)
+        assert cassette.stats()["replayed"] == 1
+
+
+def test_http_round_trip(tmp_path):
+    path = str(tmp_path / "run.cassette.json")
+    upstream = httpx.MockTransport(lambda request: httpx.Response(200, json={"reply": "你好"}))
+    with use_cassette(path, mode="record"):
+        with httpx.Client(transport=CassetteTransport(upstream)) as client:
+            recorded_response = client.post("https://api.example/v1/chat", json={"prompt": "hi"})
+
+    offline = httpx.MockTransport(lambda request: pytest.fail("回放时不应访问网络"))
+    with use_cassette(path, mode="replay", latency_scale=0):
+        with httpx.Client(transport=CassetteTransport(offline)) as client:
+            replayed = client.post("https://api.example/v1/chat", json={"prompt": "hi"})
+
+    assert replayed.status_code == recorded_response.status_code == 200
+    assert replayed.json() == recorded_response.json() == {"reply": "你好"}
@@ -0,0 +1,72 @@
+"""请求合并：follower 共享 leader 的结果或异常"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("openai")
+
+from src.llm.coalesce import SingleFlight  # noqa: E402
+
+
+def _leader_and_follower(flight: SingleFlight, leader_fn):
+    """leader 在途时发起一个相同 key 的 follower，返回两者的 (结果或异常)。"""
+    release = threading.Event()
+    outcomes = {}
+
+    def call(name, fn):
+        try:
+            outcomes[name] = flight.do("key", fn)
+        except Exception as e:
+            outcomes[name] = e
+
+    def leader():
+        release.wait(5)
+        return leader_fn()
+
+    leader_thread = threading.Thread(target=call, args=("leader", leader))
+    leader_thread.start()
+    while "key" not in flight._calls:
+        time.sleep(0.005)
+    follower_thread = threading.Thread(target=call, args=("follower", lambda: pytest.fail("follower 不应发出调用")))
+    follower_thread.start()
+    time.sleep(0.05)
+    release.set()
+    leader_thread.join(5)
+    follower_thread.join(5)
+    return outcomes["leader"], outcomes["follower"]
+
+
+def test_follower_receives_leader_result():
+    flight = SingleFlight("test")
+    leader, follower = _leader_and_follower(flight, lambda: {"answer": 42})
+    assert leader == follower == {"answer": 42}
+    assert follower is not leader
+    assert flight.stats() == {"leaders": 1, "saved": 1}
+
+
+def test_follower_receives_leader_exception():
+    flight = SingleFlight("test")
+
+    def fail():
+        raise ValueError("boom")
+
+    leader, follower = _leader_and_follower(flight, fail)
+    assert isinstance(leader, ValueError) and follower is leader
+
+
+def test_async_followers_share_one_call():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return ["result"]
+
+    async def main():
+        return await asyncio.gather(*(flight.ado("key", fetch) for _ in range(3)))
+
+    assert asyncio.run(main()) == [["result"]] * 3
+    assert len(calls) == 1
@@ -0,0 +1,53 @@
+"""评估备忘录：数字敏感的规范化与近似匹配"""
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("langgraph")
+
+from src.tot.eval_memo import EvalMemo, fingerprint, normalize  # noqa: E402
+
+PROBLEM = "我需要为一个5人的团队规划一次为期3天的技术静修会，预算是5000美元。"
+THOUGHT = "选择一个离城市较近的度假村，人均预算控制在1000美元以内，并且安排两次团建活动和一次晚宴"
+
+
+@pytest.fixture
+def memo(tmp_path):
+    memo = EvalMemo(path=str(tmp_path / "memo.sqlite3"), enabled=True)
+    memo.store(PROBLEM, THOUGHT, "evaluator", "full", {"score": 6, "reason": "ok"})
+    return memo
+
+
+@pytest.mark.parametrize("a, b", [
+    ("预算是5.5万美元", "预算是55万美元"),
+    ("把温度设为-5度", "把温度设为5度"),
+    ("行程3-5天", "行程35天"),
+])
+def test_numbers_survive_normalization(a, b):
+    assert fingerprint(a) != fingerprint(b)
+
+
+def test_thousands_separator_ignored():
+    assert normalize("预算 5,000 美元") == normalize("预算5000美元")
+
+
+def test_near_match_reused(memo):
+    thought = THOUGHT.replace("两次", "两场")
+    assert memo.lookup(PROBLEM, thought, "evaluator", "full")["cached"] == "near"
+
+
+@pytest.mark.parametrize("problem, thought", [
+    (PROBLEM.replace("5000", "50000"), THOUGHT),
+    (PROBLEM.replace("5人", "50人"), THOUGHT),
+    (PROBLEM, THOUGHT.replace("1000", "10000")),
+])
+def test_near_match_requires_same_numbers(memo, problem, thought):
+    assert memo.lookup(problem, thought, "evaluator", "full") is None
+
+
+def test_problems_from_other_processes_are_seen(memo, tmp_path):
+    other = EvalMemo(path=str(tmp_path / "memo.sqlite3"), enabled=True)
+    problem = PROBLEM.replace("。", "，地点在山区。")
+    assert other.lookup(problem, THOUGHT, "evaluator", "full") is None
+    # 另一个进程 (这里用另一个实例代替) 在 other 加载问题列表之后写入相似问题
+    memo.store(problem.replace("山区", "山里"), THOUGHT, "evaluator", "full", {"score": 4, "reason": "ok"})
+    assert other.lookup(problem, THOUGHT, "evaluator", "full")["cached"] == "near"
@@ -0,0 +1,24 @@
+"""对冲用到的分位数计算"""
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+
+from src.llm.hedging import percentile  # noqa: E402
+
+
+@pytest.mark.parametrize("p, expected", [
+    (0.5, 5),
+    (0.7, 7),
+    (0.9, 9),
+    (0.91, 10),
+    (0.99, 10),
+    (0.0, 1),
+    (1.0, 10),
+])
+def test_nearest_rank(p, expected):
+    assert percentile([float(i) for i in range(10, 0, -1)], p) == expected
+
+
+def test_empty():
+    assert percentile([], 0.9) is None
@@ -0,0 +1,30 @@
+"""安全算术求值：百分数与取模的区分、乘方的大小限制"""
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("googleapiclient")
+
+from src.tools.safe_eval import evaluate_expression  # noqa: E402
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("20%", 0.2),
+    ("100*80%-5", 75),
+    ("100 * 80% - 5", 75),
+    ("7 % 3", 1),
+    ("10 %-3", -2),
+    ("10 % -3", -2),
+])
+def test_percent_and_modulo(expression, expected):
+    assert evaluate_expression(expression) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("expression", ["(10**99)**100", "10**100", "1e308**2", "1e-300**-2", "exp(1000)"])
+def test_power_limits_raise_value_error(expression):
+    with pytest.raises(ValueError):
+        evaluate_expression(expression)
+
+
+def test_small_powers_still_work():
+    assert evaluate_expression("2^10") == 1024
+    assert evaluate_expression("0.5**-10") == 1024
@@ -0,0 +1,99 @@
+"""限流调度器：争用时的优先级、Retry-After、被取消的等待者"""
+import asyncio
+import importlib
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+
+from src.llm.scheduler import RateLimitScheduler, retry_after_seconds  # noqa: E402
+
+# src.llm 导出的 scheduler 是调度器实例，模块本身从 importlib 取
+scheduler_module = importlib.import_module("src.llm.scheduler")
+
+MODEL = "provider/model"
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after: str):
+        super().__init__("HTTP 429")
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after}})()
+
+
+def _drained(rpm: float = 600) -> RateLimitScheduler:
+    """令牌已经用完的调度器：每 60/rpm 秒补充一个令牌。"""
+    scheduler = RateLimitScheduler(rpm_per_model=rpm, rpm_per_provider=rpm, max_retries=3)
+    model_bucket, _ = scheduler._buckets(MODEL)
+    model_bucket.tokens = 0
+    return scheduler
+
+
+def _wait_for_waiters(scheduler: RateLimitScheduler, count: int):
+    deadline = time.monotonic() + 2
+    while len(scheduler._waiters.get("provider", [])) < count:
+        assert time.monotonic() < deadline, "等待者没有进入队列"
+        time.sleep(0.005)
+
+
+def test_higher_priority_served_first_under_contention():
+    # 每 0.5 秒补充一个令牌，两个等待者都进入队列后才会有令牌
+    scheduler = _drained(rpm=120)
+    order = []
+
+    def acquire(priority):
+        scheduler.acquire(MODEL, priority)
+        order.append(priority)
+
+    low = threading.Thread(target=acquire, args=(2,))
+    low.start()
+    _wait_for_waiters(scheduler, 1)
+    high = threading.Thread(target=acquire, args=(0,))
+    high.start()
+    low.join(5)
+    high.join(5)
+    assert order == [0, 2]
+
+
+def test_retry_after_is_honored(monkeypatch):
+    monkeypatch.setattr(scheduler_module, "backoff_delay", lambda attempt: pytest.fail("不应使用指数退避"))
+    scheduler = RateLimitScheduler(rpm_per_model=600, rpm_per_provider=600, max_retries=3)
+    attempts = []
+
+    def call():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RateLimited("0.3")
+        return "ok"
+
+    assert scheduler.run(call, MODEL) == "ok"
+    assert attempts[1] - attempts[0] >= 0.3
+    stats = scheduler.stats()
+    assert stats["retries"] == 1 and stats["throttled"] == 1
+
+
+def test_retry_after_http_date():
+    when = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30))
+    assert 25 < retry_after_seconds(RateLimited(when)) <= 30
+
+
+def test_cancelled_waiter_leaves_queue():
+    scheduler = _drained()
+    _, provider_bucket = scheduler._buckets(MODEL)
+    provider_bucket.block(time.monotonic() + 60)
+
+    async def main():
+        waiter = asyncio.ensure_future(scheduler.aacquire(MODEL))
+        while not scheduler._waiters.get("provider"):
+            await asyncio.sleep(0.005)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(main())
+    assert scheduler._waiters["provider"] == []
+    assert scheduler._wakers == {}
@@ -0,0 +1,35 @@
+"""快速打分的期望分数计算"""
+import math
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("langgraph")
+
+from src.tot.scoring import _fast_result, expected_score  # noqa: E402
+
+
+def _top(**probs):
+    return [(token, math.log(p)) for token, p in probs.items()]
+
+
+def test_greedy_nine_with_mass_on_ten():
+    # 贪心 "9"，40% 的概率落在 "10" 的开头 "1" 上：不能当作1分拉低分数
+    logprobs = [_top(**{"9": 0.6, "1": 0.4}), _top(**{"<end>": 0.99})]
+    assert expected_score(logprobs) == pytest.approx(9.0)
+    assert _fast_result({"content": "9", "logprobs": logprobs})["score"] == 9
+
+
+def test_greedy_ten_split_into_one_zero():
+    logprobs = [_top(**{"1": 0.7, "9": 0.3}), _top(**{"0": 0.9, "<end>": 0.1})]
+    # "1" 的0.7拆成 10 (0.63) 与 1 (0.07)
+    expected = (10 * 0.63 + 1 * 0.07 + 9 * 0.3) / 1.0
+    assert expected_score(logprobs) == pytest.approx(expected)
+
+
+def test_single_token_one():
+    assert expected_score([_top(**{"1": 0.8, "2": 0.2})]) == pytest.approx(1.2)
+
+
+def test_no_digits():
+    assert expected_score([_top(**{"好": 1.0})]) is None
@@ -0,0 +1,55 @@
+"""推测式生成：只采用属于当前问题/轮次的批次，被丢弃的批次不再发出请求"""
+import threading
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("langgraph")
+
+from src.tot import langgraph_tot  # noqa: E402
+from src.tot.langgraph_tot import SpeculativeGenerator  # noqa: E402
+
+STATE = {"problem": "规划一次团建", "retries": 1}
+LOW_SCORES = [{"score": 3}]
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def generate(problem, label="tot.generate"):
+        calls.append(problem)
+        return [f"{problem}-思想"]
+
+    monkeypatch.setattr(langgraph_tot, "_generate_thoughts", generate)
+    return calls
+
+
+def test_commit_adopts_batch_of_same_round(calls):
+    speculator = SpeculativeGenerator()
+    speculator.observe(STATE, LOW_SCORES, 2)
+    assert speculator.commit(STATE) == ["规划一次团建-思想"]
+
+
+@pytest.mark.parametrize("state", [
+    {"problem": "另一个问题", "retries": 1},
+    {"problem": "规划一次团建", "retries": 2},
+])
+def test_commit_rejects_batch_of_other_round(calls, state):
+    speculator = SpeculativeGenerator()
+    speculator.observe(STATE, LOW_SCORES, 2)
+    assert speculator.commit(state) is None
+
+
+def test_no_speculation_when_round_is_good_enough(calls):
+    speculator = SpeculativeGenerator()
+    speculator.observe(STATE, [{"score": 8}], 2)
+    assert speculator.commit(STATE) is None
+    assert calls == []
+
+
+def test_discarded_batch_skips_llm_call(calls):
+    dropped = threading.Event()
+    dropped.set()
+    assert langgraph_tot._speculate(STATE["problem"], dropped) == []
+    assert calls == []
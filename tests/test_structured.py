@@ -0,0 +1,72 @@
+"""JSON 本地修复与结构校验"""
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("httpx")
+
+from src.llm.structured import (  # noqa: E402
+    _was_repaired,
+    answers_validator,
+    repair_json,
+    thoughts_validator,
+    validate_score
+)
+
+
+def test_curly_quotes_inside_strings_are_kept():
+    text = '```json\n{"thoughts": ["考虑“预算”分配", "先订‘机票’"]}\n```'
+    data, repaired = repair_json(text)
+    assert repaired
+    assert data == {"thoughts": ["考虑“预算”分配", "先订‘机票’"]}
+
+
+def test_curly_quotes_inside_strings_with_trailing_comma():
+    result = validate_score('{"score": 8, "reason": "计划“合理”",}')
+    assert result == {"score": 8, "reason": "计划“合理”"}
+
+
+def test_curly_quotes_as_delimiters_are_converted():
+    data, repaired = repair_json('{“score”: 7, “reason”: “还行”}')
+    assert repaired
+    assert data == {"score": 7, "reason": "还行"}
+
+
+def test_single_quotes_and_python_literals():
+    data, _ = repair_json("{'ok': True, 'note': \"it's\", 'x': None}")
+    assert data == {"ok": True, "note": "it's", "x": None}
+
+
+def test_thoughts_with_curly_quotes_need_no_rerequest():
+    validate = thoughts_validator(2)
+    assert validate('{"thoughts": ["考虑“预算”", "选“地点”"],}') == {"thoughts": ["考虑“预算”", "选“地点”"]}
+
+
+def test_coerced_values_count_as_repaired():
+    text = '{"score": "8/10", "reason": "好"}'
+    assert _was_repaired(text, validate_score(text))
+    clean = '{"score": 8, "reason": "好"}'
+    assert not _was_repaired(clean, validate_score(clean))
+
+
+@pytest.mark.parametrize("text, validate", [
+    ('{"score": 8}', validate_score),
+    ('{"score": 8, "reason": "好", "confidence": 0.9}', validate_score),
+    ('{"thoughts": ["a", "b", "c"]}', thoughts_validator(2)),
+    ('{"answers": {"9": "红色", "10": "蓝色"}}', answers_validator(["9"])),
+])
+def test_defaults_and_dropped_extras_are_not_repairs(text, validate):
+    assert not _was_repaired(text, validate(text))
+
+
+@pytest.mark.parametrize("text", [
+    '{"answers": {"1": "红色", "2": "三个人"}}',
+    '{"answers": [{"id": "1", "answer": "红色"}, {"id": 2, "answer": "三个人"}]}',
+    '{"answers": [{"id": "问题 1", "answer": "红色"}, {"id": "问题2：", "answer": "三个人"}]}',
+])
+def test_answers_ids_are_normalized(text):
+    assert answers_validator(["1", "2"])(text) == {"answers": {"1": "红色", "2": "三个人"}}
+
+
+def test_answers_dict_form_is_not_a_repair():
+    text = '{"answers": {"9": "红色"}}'
+    assert not _was_repaired(text, answers_validator(["9"])(text))